@@ -0,0 +1,226 @@
+"""Approximate nearest-neighbour index for large face galleries (pure NumPy).
+
+``IVFIndex`` is an inverted-file index: encodings are partitioned into
+``nlist`` cells by k-means, and a query is compared exactly only against the
+encodings in the ``nprobe`` cells whose centroids are closest. Distances that
+come back are exact, so the match threshold behaves the same as with a full
+scan; only recall can suffer if the true neighbour sits in an unprobed cell
+(see scripts/ann_benchmark.py to measure it).
+
+Each cell is an immutable (names, matrix, sqnorms) tuple, and inserts and
+deletes publish a new list of cells (sharing the untouched ones) instead of
+writing into the current one. ``view()`` therefore gives a gallery snapshot an
+index that keeps answering for that snapshot's students while the writer moves
+on. The trained centroids and cell assignments are persisted to an ``.npz``
+file so restarts neither retrain nor reassign.
+"""
+import copy
+import os
+import numpy as np
+
+from gallery import l2_distances, smallest_k
+
+
+def _nearest(x, centroids, chunk=8192):
+    """Index of the closest centroid for every row of ``x``."""
+    csq = (centroids * centroids).sum(axis=1)
+    out = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), chunk):
+        block = x[start:start + chunk]
+        # |x|^2 is the same for every centroid, so it can be left out of the argmin
+        out[start:start + chunk] = np.argmin(csq - 2.0 * (block @ centroids.T), axis=1)
+    return out
+
+
+def kmeans(x, k: int, iters: int = 15, seed: int = 0, points_per_centroid: int = 64):
+    """Lloyd's k-means trained on a sample of at most ``points_per_centroid * k``
+    rows; returns float32 centroids (k, dim)."""
+    x = np.asarray(x, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    if len(x) > points_per_centroid * k:
+        x = x[rng.choice(len(x), points_per_centroid * k, replace=False)]
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    assign = _nearest(x, centroids)
+    for _ in range(iters):
+        # per-cell sums via one sort + reduceat instead of a scatter-add
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=k)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        sums = np.add.reduceat(x[order], starts[filled], axis=0)
+        centroids[filled] = sums / counts[filled][:, None]
+        if not filled.all():
+            # reseed empty cells with random points
+            centroids[~filled] = x[rng.choice(len(x), int((~filled).sum()), replace=False)]
+        new_assign = _nearest(x, centroids)
+        if np.array_equal(new_assign, assign):
+            break
+        assign = new_assign
+    return centroids
+
+
+def _cell(names, matrix):
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    return (np.asarray(names, dtype=object), matrix, np.einsum('ij,ij->i', matrix, matrix))
+
+
+_EMPTY = (np.empty(0, dtype=object), np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.float32))
+
+
+class IVFIndex:
+    """Inverted-file ANN index keyed by student name.
+
+    ``min_size``: below this many encodings the index stays untrained and the
+    gallery keeps using exact search. ``nlist`` defaults to ~4*sqrt(N).
+    """
+
+    # retrain when the gallery has grown this much since the last k-means
+    RETRAIN_GROWTH = 4
+
+    def __init__(self, dim: int = 128, nlist: int = 0, nprobe: int = 16, min_size: int = 1000, path: str = None):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_size = min_size
+        self.path = path
+        self.trained_size = 0
+        self._state = None    # (centroids, centroid sqnorms, lists); never mutated, only swapped
+        self._where = {}      # name -> cell; writer side only
+        self._saved = None    # persisted {name: (cell, vector)} used by the next build
+
+    @property
+    def trained(self) -> bool:
+        return self._state is not None
+
+    def __len__(self):
+        return len(self._where)
+
+    def stale(self, n) -> bool:
+        """True once the gallery outgrew the centroids and build() should retrain."""
+        return n > self.RETRAIN_GROWTH * self.trained_size
+
+    def _default_nlist(self, n):
+        return int(min(max(self.nlist or 4 * np.sqrt(n), 1), n))
+
+    def build(self, names, matrix):
+        """(Re)build from the full gallery. Reuses persisted centroids and cell
+        assignments for unchanged encodings; retrains k-means only when there
+        are none or the gallery has grown RETRAIN_GROWTH-fold."""
+        names = list(names)
+        matrix = np.asarray(matrix, dtype=np.float32)
+        n = len(names)
+        if n < self.min_size:
+            self._state, self._where = None, {}
+            return
+        saved = self._saved
+        if saved is None or self.stale(n):
+            centroids = kmeans(matrix, self._default_nlist(n))
+            cells = _nearest(matrix, centroids)
+            self.trained_size = n
+        else:
+            centroids = saved['centroids']
+            cells = np.empty(n, dtype=np.int32)
+            todo = []
+            for i, name in enumerate(names):
+                hit = saved['entries'].get(name)
+                if hit is not None and np.array_equal(hit[1], matrix[i]):
+                    cells[i] = hit[0]
+                else:
+                    todo.append(i)
+            if todo:
+                cells[todo] = _nearest(matrix[todo], centroids)
+        order = np.argsort(cells, kind='stable')
+        bounds = np.searchsorted(cells[order], np.arange(len(centroids) + 1))
+        names_arr = np.asarray(names, dtype=object)
+        lists = []
+        for c in range(len(centroids)):
+            rows = order[bounds[c]:bounds[c + 1]]
+            lists.append(_cell(names_arr[rows], matrix[rows]) if len(rows) else _EMPTY)
+        self._where = dict(zip(names, cells.tolist()))
+        self._state = (centroids, np.einsum('ij,ij->i', centroids, centroids), lists)
+        self._saved = None
+
+    def view(self):
+        """Read-only copy for one gallery snapshot: its searches keep using the
+        current cells after later add/remove/build calls on this index."""
+        return copy.copy(self)
+
+    def _replace_cell(self, c, cell):
+        centroids, csq, lists = self._state
+        lists = list(lists)
+        lists[c] = cell
+        self._state = (centroids, csq, lists)
+
+    def add(self, name, vec):
+        """Insert or replace one encoding; touches only its cell(s)."""
+        if self._state is None:
+            return
+        self.remove(name)
+        centroids, _, lists = self._state
+        # a copy: the caller's row buffer may be written again later
+        vec = np.array(vec, dtype=np.float32).reshape(1, -1)
+        c = int(_nearest(vec, centroids)[0])
+        names, matrix, _ = lists[c]
+        if len(names):
+            self._replace_cell(c, _cell(np.append(names, np.array([name], dtype=object)), np.vstack([matrix, vec])))
+        else:
+            self._replace_cell(c, _cell(np.array([name], dtype=object), vec))
+        self._where[name] = c
+
+    def remove(self, name):
+        if self._state is None or name not in self._where:
+            return
+        _, _, lists = self._state
+        c = self._where.pop(name)
+        names, matrix, _ = lists[c]
+        keep = names != name
+        self._replace_cell(c, _cell(names[keep], matrix[keep]) if keep.any() else _EMPTY)
+
+    def search(self, query, k: int = 1, nprobe: int = 0):
+        """Approximate top ``k`` as (name, exact distance), nearest first."""
+        centroids, csq, lists = self._state
+        q = np.asarray(query, dtype=np.float32)
+        probes = smallest_k(l2_distances(centroids, csq, q), nprobe or self.nprobe)
+        cells = [lists[c] for c in probes]
+        cells = [cell for cell in cells if len(cell[0])]
+        if not cells:
+            return []
+        names = np.concatenate([cell[0] for cell in cells])
+        d = np.concatenate([l2_distances(cell[1], cell[2], q) for cell in cells])
+        return [(names[i], d[i].item()) for i in smallest_k(d, k)]
+
+    def save(self):
+        """Persist centroids and cell contents (atomic rename). No-op without a path."""
+        if not self.path or self._state is None:
+            return
+        centroids, _, lists = self._state
+        cells = [(c, cell) for c, cell in enumerate(lists) if len(cell[0])]
+        names = np.concatenate([cell[0] for _, cell in cells]).astype(str) if cells else np.empty(0, dtype=str)
+        vectors = np.vstack([cell[1] for _, cell in cells]) if cells else np.empty((0, self.dim), dtype=np.float32)
+        assign = np.concatenate([np.full(len(cell[0]), c, dtype=np.int32) for c, cell in cells]) if cells \
+            else np.empty(0, dtype=np.int32)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp.npz'
+            np.savez(tmp, centroids=centroids, names=names, cells=assign, vectors=vectors,
+                     trained_size=np.int64(self.trained_size))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f'Failed to save ANN index: {e}')
+
+    def load(self):
+        """Read a persisted index; it is applied by the next build()."""
+        self._saved = None
+        if not self.path or not os.path.exists(self.path):
+            return self
+        try:
+            with np.load(self.path) as npz:
+                centroids = npz['centroids']
+                if centroids.shape[1] != self.dim:
+                    return self
+                self.trained_size = int(npz['trained_size'])
+                entries = {str(n): (int(c), v) for n, c, v in zip(npz['names'], npz['cells'], npz['vectors'])}
+            self._saved = {'centroids': centroids, 'entries': entries}
+        except Exception as e:
+            print(f'Ignoring unreadable ANN index {self.path}: {e}')
+        return self
@@ -1,23 +1,39 @@
-from flask import Flask, request, render_template, jsonify, redirect, url_for, session, send_from_directory, flash
+from flask import Flask, request, render_template, jsonify, redirect, url_for, session, send_from_directory, send_file, flash, Response, stream_with_context, abort, g
+from werkzeug.security import safe_join
 from flask_mail import Mail, Message
 import os
-import io
 import base64
 import glob
 import numpy as np
 from datetime import datetime, timedelta
 from itsdangerous import URLSafeTimedSerializer
 import secrets
+import threading
+import time
+import importlib.util
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
-# Try to import face_recognition; if not available, fall back to image-hash based matching
-try:
-    import face_recognition
-    FACE_RECOG_AVAILABLE = True
-except Exception as _e:
-    FACE_RECOG_AVAILABLE = False
-    print('face_recognition not available, falling back to image-hash matcher:', _e)
-    from PIL import Image
-    import imagehash
+from face_cache import EncodingCache
+from gallery import Gallery, assign_unique, name_of
+from shared_gallery import SharedGallery
+from ann_index import IVFIndex
+from face_pipeline import (StageTimer, analyze, decode_image, detect_faces, encode_faces, encode_enrollment,
+                           PHASH_DECODE_SIDE, PHASH_CACHE_KIND)
+from face_tracking import FaceTracker
+from attendance_store import AttendanceStore, PresenceIndex
+from thumbnails import ThumbnailCache
+from engine import RecognitionEngine, EngineBusy, EngineTimeout
+from metrics import Registry, ProfileSampler
+from bulk_enroll import BulkEnroller, JobRunning
+from verify_cache import VerificationCache, frame_fingerprint
+
+# Use face_recognition if installed; otherwise fall back to image-hash based matching.
+# Importing it loads dlib and its models (seconds), so that is left to the gallery
+# warm-up thread, which also falls back if the import fails. FACE_MATCHER=phash
+# forces the image-hash matcher even when face_recognition is installed.
+FACE_RECOG_AVAILABLE = (os.environ.get('FACE_MATCHER', 'auto').lower() != 'phash'
+                        and importlib.util.find_spec('face_recognition') is not None)
 
 from PIL import Image as PILImage
 
@@ -85,29 +101,17 @@ except ImportError:
         app.config['MAIL_DEFAULT_SENDER'] = getattr(email_cfg, 'MAIL_DEFAULT_SENDER', os.environ.get('MAIL_DEFAULT_SENDER', ADMIN_EMAIL))
         print("[OK] Email configuration loaded from config/email_config.py")
     except ImportError:
-    # Load email config from file
-    ADMIN_EMAIL = ADMIN_EMAIL if 'ADMIN_EMAIL' in locals() else os.environ.get('ADMIN_EMAIL', 'admin@example.com')
-    ADMIN_NAME = ADMIN_NAME if 'ADMIN_NAME' in locals() else os.environ.get('ADMIN_NAME', 'Admin')
-    app.config['MAIL_SERVER'] = MAIL_SERVER if 'MAIL_SERVER' in locals() else os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-    app.config['MAIL_PORT'] = int(MAIL_PORT if 'MAIL_PORT' in locals() else os.environ.get('MAIL_PORT', 587))
-    app.config['MAIL_USE_TLS'] = MAIL_USE_TLS if 'MAIL_USE_TLS' in locals() else os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
-    app.config['MAIL_USE_SSL'] = MAIL_USE_SSL if 'MAIL_USE_SSL' in locals() else os.environ.get('MAIL_USE_SSL', 'false').lower() == 'true'
-    app.config['MAIL_USERNAME'] = MAIL_USERNAME if 'MAIL_USERNAME' in locals() else os.environ.get('MAIL_USERNAME', '')
-    app.config['MAIL_PASSWORD'] = MAIL_PASSWORD if 'MAIL_PASSWORD' in locals() else os.environ.get('MAIL_PASSWORD', '')
-    app.config['MAIL_DEFAULT_SENDER'] = MAIL_DEFAULT_SENDER if 'MAIL_DEFAULT_SENDER' in locals() else os.environ.get('MAIL_DEFAULT_SENDER', ADMIN_EMAIL)
-    print("[OK] Email configuration loaded from email_config.py")
-except ImportError:
-    # Fall back to environment variables
-    ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'admin@example.com')
-    ADMIN_NAME = os.environ.get('ADMIN_NAME', 'Admin')
-    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
-    app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
-    app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', 'false').lower() == 'true'
-    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', '')
-    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', '')
-    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', ADMIN_EMAIL)
-    print("[INFO] Using environment variables for email configuration (or create email_config.py)")
+        # Fall back to environment variables
+        ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'admin@example.com')
+        ADMIN_NAME = os.environ.get('ADMIN_NAME', 'Admin')
+        app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+        app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+        app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
+        app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', 'false').lower() == 'true'
+        app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', '')
+        app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', '')
+        app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', ADMIN_EMAIL)
+        print("[INFO] Using environment variables for email configuration (or create email_config.py)")
 
 # Initialize Flask-Mail
 mail = Mail(app)
@@ -115,49 +119,365 @@ mail = Mail(app)
 # Token serializer for password reset
 serializer = URLSafeTimedSerializer(app.secret_key)
 
-IMAGES_DIR = os.path.join(BASE_DIR, 'static', 'images')
-ATTENDANCE_CSV = os.path.join(BASE_DIR, 'data', 'attendance.csv')
+IMAGES_DIR = os.environ.get('IMAGES_DIR', os.path.join(BASE_DIR, 'static', 'images'))
+ATTENDANCE_CSV = os.environ.get('ATTENDANCE_CSV', os.path.join(BASE_DIR, 'data', 'attendance.csv'))
+ATTENDANCE_DB = os.environ.get('ATTENDANCE_DB', os.path.join(BASE_DIR, 'data', 'attendance.db'))
+CACHE_DIR = os.environ.get('FACE_CACHE_DIR', os.path.join(BASE_DIR, 'data', 'cache'))
 
 
 def sanitize_name(name: str) -> str:
     return "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).strip().replace(' ', '_')
 
 
+def _encode_image_file(path):
+    """Compute the gallery vector for one image file: a face encoding, or the
+    phash packed into one uint64 when face_recognition is unavailable (hashed
+    like uploads, see face_pipeline.PHASH_DECODE_SIDE). None if no face."""
+    if FACE_RECOG_AVAILABLE:
+        import face_recognition
+        img = face_recognition.load_image_file(path)
+        faces = face_recognition.face_encodings(img)
+        return faces[0] if faces else None
+    vector, error = encode_enrollment(path, PIPELINE_SETTINGS)
+    if vector is None:
+        raise ValueError(error)
+    return vector
+
+
+# 'exact' scans every encoding; 'ivf' uses the approximate index in ann_index.py
+# once the gallery has IVF_MIN_SIZE students (see scripts/ann_benchmark.py)
+GALLERY_INDEX = os.environ.get('GALLERY_INDEX', 'exact').lower()
+# galleries this large answer phash lookups from a multi-index hash (0 disables)
+PHASH_INDEX_MIN_SIZE = int(os.environ.get('PHASH_INDEX_MIN_SIZE', 200000))
+# GALLERY_SHARED=1: with several worker processes (gunicorn -w N), share one
+# memory-mapped copy of the gallery and propagate enrollments to every worker
+GALLERY_SHARED = os.environ.get('GALLERY_SHARED', '0') == '1'
+
+
+# Students with several photos (IMAGES_DIR/<student>/*) are matched by one
+# template per student: the mean (or 'medoid') of their encodings, plus up to
+# GALLERY_REPRESENTATIVES of the photos that differ most from it.
+GALLERY_TEMPLATE = os.environ.get('GALLERY_TEMPLATE', 'mean').lower()
+GALLERY_REPRESENTATIVES = int(os.environ.get('GALLERY_REPRESENTATIVES', 3))
+# GALLERY_QUANTIZE=int8: face matching scans a compact copy of the encodings,
+# then re-ranks the best few with exact float32 distances read from a
+# memory-mapped file under CACHE_DIR/rows (or the shared gallery's vectors.npy)
+GALLERY_QUANTIZE = os.environ.get('GALLERY_QUANTIZE', 'none').lower()
+
+
+def _image_paths():
+    """Every enrollment photo: IMAGES_DIR/<student>.<ext> and IMAGES_DIR/<student>/*."""
+    return [p for p in glob.glob(os.path.join(IMAGES_DIR, '*')) + glob.glob(os.path.join(IMAGES_DIR, '*', '*'))
+            if os.path.isfile(p)]
+
+
+def _student_photos(safe):
+    """Enrollment photos of one student, in either layout."""
+    paths = glob.glob(os.path.join(IMAGES_DIR, f"{safe}.*")) + glob.glob(os.path.join(IMAGES_DIR, safe, '*'))
+    return sorted(p for p in paths if os.path.isfile(p))
+
+
+def _image_relpath(path):
+    """Path under IMAGES_DIR as used in /images/ URLs and the thumbnail cache."""
+    return os.path.relpath(path, IMAGES_DIR).replace(os.sep, '/')
+
+
+def _make_gallery():
+    """Empty gallery for the active matcher: rows are float32 128-d encodings, or
+    one packed uint64 phash in the fallback."""
+    if FACE_RECOG_AVAILABLE:
+        ann = None
+        if GALLERY_INDEX == 'ivf':
+            ann = IVFIndex(dim=128,
+                           nlist=int(os.environ.get('IVF_NLIST', 0)),
+                           nprobe=int(os.environ.get('IVF_NPROBE', 16)),
+                           min_size=int(os.environ.get('IVF_MIN_SIZE', 1000)),
+                           path=os.path.join(CACHE_DIR, 'ivf_index.npz'))
+        gallery = Gallery(EncodingCache(CACHE_DIR, 'face', IMAGES_DIR), _encode_image_file, dim=128,
+                          dtype=np.float32, ann=ann, template=GALLERY_TEMPLATE,
+                          representatives=GALLERY_REPRESENTATIVES, quantize=GALLERY_QUANTIZE,
+                          rows_dir=os.path.join(CACHE_DIR, 'rows'))
+    else:
+        gallery = Gallery(EncodingCache(CACHE_DIR, PHASH_CACHE_KIND, IMAGES_DIR), _encode_image_file, dim=1,
+                          dtype=np.uint64, metric='hamming', index_min_size=PHASH_INDEX_MIN_SIZE,
+                          template=GALLERY_TEMPLATE, representatives=GALLERY_REPRESENTATIVES)
+    if GALLERY_SHARED:
+        kind = 'face' if FACE_RECOG_AVAILABLE else PHASH_CACHE_KIND
+        return SharedGallery(gallery, os.path.join(CACHE_DIR, 'shared', kind), _image_paths)
+    return gallery
+
+
+# Global gallery of known faces (made by init_app); filled by the warm-up thread,
+# then updated per student by add/remove.
+GALLERY = None
+
+# Max Hamming distance between phashes that still counts as a match (fallback matcher)
+PHASH_MAX_DISTANCE = 10
+
+# Decode/detect/encode sizes (see face_pipeline.py): uploads are decoded to at most
+# DECODE_MAX_SIDE px, faces detected on a DETECT_WIDTH px wide copy, and encoded from
+# a crop where the face is at most ENCODE_MAX_FACE px wide. 0 disables a step.
+DECODE_MAX_SIDE = int(os.environ.get('DECODE_MAX_SIDE', 640))
+DETECT_WIDTH = int(os.environ.get('DETECT_WIDTH', 320))
+ENCODE_MAX_FACE = int(os.environ.get('ENCODE_MAX_FACE', 300))
+PIPELINE_SETTINGS = {
+    'face_recognition': FACE_RECOG_AVAILABLE,
+    'decode_max_side': DECODE_MAX_SIDE,
+    'detect_width': DETECT_WIDTH,
+    'encode_max_face': ENCODE_MAX_FACE,
+    'phash_decode_side': PHASH_DECODE_SIDE,
+}
+# largest raw image body accepted by /api/verify and /api/stream/frame
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+
+# Run decode/detect/encode in INFERENCE_WORKERS processes (0 = inline in the request
+# thread). At most INFERENCE_QUEUE verifications may be pending before /api/verify
+# answers 503; each gets INFERENCE_TIMEOUT seconds.
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+ENGINE = None
+if INFERENCE_WORKERS > 0:
+    ENGINE = RecognitionEngine(INFERENCE_WORKERS,
+                               max_pending=int(os.environ.get('INFERENCE_QUEUE', 0)),
+                               timeout=float(os.environ.get('INFERENCE_TIMEOUT', 10)),
+                               face_recognition_available=FACE_RECOG_AVAILABLE)
+
+# multi-face mode: candidates per face considered when resolving duplicate identities
+MULTI_FACE_CANDIDATES = 3
+
+# Live streams (/api/stream/frame): faces are detected on every STREAM_DETECT_EVERY-th
+# frame (the others just repeat the current tracks) and only encoded for new or
+# changed tracks. Streams idle for STREAM_IDLE_SECONDS are dropped.
+STREAM_DETECT_EVERY = int(os.environ.get('STREAM_DETECT_EVERY', 2))
+STREAM_IDLE_SECONDS = 30
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', 16))
+
+# /api/verify_batch: max images per request and threads used to decode/encode them.
+# The threads only run in parallel with INFERENCE_WORKERS set (they hand the
+# images to the engine's processes); inline, dlib holds the GIL and the batch
+# is encoded about one image at a time.
+MAX_BATCH_IMAGES = int(os.environ.get('MAX_BATCH_IMAGES', 64))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', min(8, os.cpu_count() or 1)))
+BATCH_POOL = None
+
+# Upper bound for the optional top_k candidates list in /api/verify
+MAX_TOP_K = 10
+
+# Near-duplicate frames sent to /api/verify (double clicks, client retries) get
+# the result of the first one: the last VERIFY_CACHE_SIZE frames (0 disables) are
+# kept for VERIFY_CACHE_TTL seconds, and a frame is a near-duplicate when no cell
+# of its 16x16 grey thumbnail differs by more than VERIFY_CACHE_MAX_DIFF levels
+VERIFY_CACHE = VerificationCache(size=int(os.environ.get('VERIFY_CACHE_SIZE', 256)),
+                                 ttl=float(os.environ.get('VERIFY_CACHE_TTL', 5)),
+                                 max_diff=int(os.environ.get('VERIFY_CACHE_MAX_DIFF', 12)))
+
+# Thumbnails served by /images/<file>?size=N, generated on enrollment
+THUMB_SIZES = (64, 128, 256)
+THUMBNAILS = ThumbnailCache(IMAGES_DIR, os.path.join(CACHE_DIR, 'thumbs'), THUMB_SIZES)
+# Cache-Control max-age for /images/: URLs with ?v=<photo version> never change,
+# plain URLs are revalidated (ETag / Last-Modified) after IMAGE_MAX_AGE seconds
+IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', 60))
+IMAGE_MAX_AGE_VERSIONED = 365 * 24 * 3600
+
+
+# Prometheus metrics served at /metrics. Every request is timed per endpoint, and
+# the stages of its StageTimer (decode, detect, encode, match, record, ...) feed
+# attendance_stage_seconds.
+METRICS = Registry()
+REQUEST_SECONDS = METRICS.histogram('attendance_request_seconds', 'Request latency by endpoint', ('endpoint',))
+REQUESTS = METRICS.counter('attendance_requests_total', 'Requests by endpoint and status code', ('endpoint', 'status'))
+STAGE_SECONDS = METRICS.histogram('attendance_stage_seconds', 'Time spent per processing stage',
+                                  ('endpoint', 'stage'))
+VERIFICATIONS = METRICS.counter('attendance_verifications_total',
+                                'Verified faces by result (match, unknown, no_face, error)', ('result',))
+VERIFY_CACHE_LOOKUPS = METRICS.counter('attendance_verify_cache_total',
+                                      'Verification cache lookups by result (hit, miss)', ('result',))
+METRICS.gauge('attendance_verify_cache_entries', 'Frames in the verification cache', fn=lambda: len(VERIFY_CACHE))
+GALLERY_LOAD_SECONDS = METRICS.gauge('attendance_gallery_load_seconds', 'Duration of the last full gallery load')
+GALLERY_IMAGES = METRICS.counter('attendance_gallery_load_images_total',
+                                 'Images read by gallery loads, by source (cache or encoded)', ('source',))
+METRICS.gauge('attendance_gallery_students', 'Students in the gallery', fn=lambda: len(GALLERY))
+METRICS.gauge('attendance_gallery_ready', '1 once the gallery is loaded', fn=lambda: GALLERY_READY.is_set())
+METRICS.gauge('attendance_gallery_scan_bytes_per_student', 'Bytes per student read by the first matching pass',
+              fn=lambda: _gallery_bytes_per_student()[0])
+METRICS.gauge('attendance_gallery_bytes_per_student', 'Bytes per student held by the gallery arrays',
+              fn=lambda: _gallery_bytes_per_student()[1])
+
+# PROFILE_SAMPLE_RATE (0..1) of requests are run under cProfile and saved to
+# PROFILE_DIR (newest PROFILE_KEEP kept); 0 disables profiling.
+PROFILER = ProfileSampler(float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+                          os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'data', 'profiles')),
+                          keep=int(os.environ.get('PROFILE_KEEP', 100)))
+
+
+def _gallery_bytes_per_student():
+    snap = GALLERY.snapshot
+    if not len(snap):
+        return 0.0, 0.0
+    scanned, held = snap.nbytes()
+    return scanned / len(snap), held / len(snap)
+
+
+def _observe_stages(endpoint, timer):
+    for stage, ms in timer.ms.items():
+        STAGE_SECONDS.observe(ms / 1000.0, endpoint=endpoint, stage=stage)
+
+
 def load_known_faces():
-    """Load known faces. If face_recognition is available return name->encoding (np.array).
-    Otherwise return name->imagehash object (phash)."""
-    encodings = {}
-    for path in glob.glob(os.path.join(IMAGES_DIR, '*')):
-        if os.path.isfile(path):
-            filename = os.path.basename(path)
-            name, _ = os.path.splitext(filename)
+    """Load known faces into GALLERY and return its snapshot: a names array parallel
+    to a matrix of face encodings, or of packed phashes when face_recognition is unavailable.
+
+    Vectors are served from the on-disk cache in CACHE_DIR; only new or changed
+    images are decoded and encoded."""
+    timer = StageTimer()
+    started = time.perf_counter()
+    snapshot = GALLERY.load(_image_paths(), timer)
+    GALLERY_LOAD_SECONDS.set(time.perf_counter() - started)
+    _observe_stages('load_known_faces', timer)
+    cache = getattr(GALLERY, 'gallery', GALLERY).cache
+    GALLERY_IMAGES.inc(cache.hits, source='cache')
+    GALLERY_IMAGES.inc(cache.misses, source='encoded')
+    return snapshot
+
+
+# Set once the gallery is loaded; until then /api/verify and the student admin
+# endpoints answer 503 and /readyz reports not ready.
+GALLERY_READY = threading.Event()
+WARM_UP = {'error': None, 'seconds': None}
+_warm_up_pid = None
+_warm_up_lock = threading.Lock()
+
+
+def _warm_up():
+    """Import the face models and load the gallery (background thread)."""
+    global FACE_RECOG_AVAILABLE, GALLERY
+    started = time.perf_counter()
+    try:
+        if FACE_RECOG_AVAILABLE:
             try:
-                if FACE_RECOG_AVAILABLE:
-                    img = face_recognition.load_image_file(path)
-                    faces = face_recognition.face_encodings(img)
-                    if faces:
-                        encodings[name] = faces[0]
-                else:
-                    pil = PILImage.open(path).convert('RGB')
-                    encodings[name] = imagehash.phash(pil)
+                import face_recognition  # noqa: F401
             except Exception as e:
-                print(f"Skipping {path}: {e}")
-    return encodings
+                print('face_recognition not available, falling back to image-hash matcher:', e)
+                FACE_RECOG_AVAILABLE = False
+                PIPELINE_SETTINGS['face_recognition'] = False
+                if ENGINE is not None:
+                    ENGINE.face_recognition_available = False
+                GALLERY = _make_gallery()
+        if not FACE_RECOG_AVAILABLE:
+            import imagehash
+            # the first phash imports scipy's FFT; do it here, not in a request
+            imagehash.phash(PILImage.new('RGB', (32, 32)))
+        load_known_faces()
+        WARM_UP['seconds'] = round(time.perf_counter() - started, 2)
+        GALLERY_READY.set()
+        print(f"[INFO] Gallery ready: {len(GALLERY)} student(s) in {WARM_UP['seconds']}s")
+    except Exception as e:
+        WARM_UP['error'] = str(e)
+        print('Gallery warm-up failed:', e)
+
+
+def start_warm_up():
+    """Start the warm-up thread, once per process."""
+    global _warm_up_pid
+    with _warm_up_lock:
+        if _warm_up_pid == os.getpid():
+            return
+        _warm_up_pid = os.getpid()
+    threading.Thread(target=_warm_up, name='gallery-warm-up', daemon=True).start()
+
 
+@app.before_request
+def _ensure_warm_up():
+    # workers forked from a preloaded app (gunicorn --preload) don't inherit the thread
+    if not GALLERY_READY.is_set() and _warm_up_pid != os.getpid():
+        start_warm_up()
 
-# Global cache of known faces
-KNOWN_FACES = load_known_faces()
 
+@app.before_request
+def _start_request_metrics():
+    g.started = time.perf_counter()
+    g.timer = StageTimer()
+    g.profiler = PROFILER.start()
 
-def record_attendance(name: str):
-    """Append an attendance record to CSV (name,date,time)."""
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.get('started')
+    if started is not None:
+        # streamed responses (CSV export) are timed to the first byte
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        _observe_stages(endpoint, g.timer)
+    return response
+
+
+@app.teardown_request
+def _stop_profiler(_exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        PROFILER.stop(profiler, request.endpoint or 'unmatched')
+
+
+def _unavailable(message):
+    resp = jsonify({'error': message})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+
+def _gallery_loading():
+    return _unavailable('Face gallery is still loading, please retry')
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Counters, gauges and latency histograms in the Prometheus text format."""
+    return Response(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: the face gallery is loaded and verification can be served."""
+    if not GALLERY_READY.is_set():
+        return jsonify({'ready': False, 'error': WARM_UP['error']}), 503
+    scanned, held = _gallery_bytes_per_student()
+    return jsonify({'ready': True, 'students': len(GALLERY), 'warm_up_seconds': WARM_UP['seconds'],
+                    'matcher': 'face_recognition' if FACE_RECOG_AVAILABLE else 'phash',
+                    'bytes_per_student': {'scanned': round(scanned, 1), 'held': round(held, 1)}})
+
+
+# Attendance lives in SQLite; the legacy CSV is imported once on first start
+# Reports group marks into lectures of LECTURE_MINUTES-long slots of the day
+LECTURE_MINUTES = int(os.environ.get('LECTURE_MINUTES', 60))
+ATTENDANCE = None   # AttendanceStore, opened by init_app
+
+# Repeat matches of a student already marked today are answered from memory and not
+# recorded again. ATTENDANCE_DEDUP_TTL (seconds) allows a new mark after that long,
+# e.g. 3600 for hourly lectures; 0 = once per day.
+PRESENCE = PresenceIndex(ttl=float(os.environ.get('ATTENDANCE_DEDUP_TTL', 0)))
+
+
+def record_attendance(name: str) -> bool:
+    """Record an attendance row (name, date, time). Returns False if the student
+    was already marked (nothing is written)."""
+    return bool(record_attendance_many([name]))
+
+
+def record_attendance_many(names):
+    """Record one attendance row per name not already marked; the new rows are
+    queued and committed in one batch. Returns the set of names recorded now."""
+    fresh, _already = PRESENCE.claim(names)
     try:
-        ts = datetime.now()
-        line = f'{name},{ts.date()},{ts.time().strftime("%H:%M:%S")}\n'
-        with open(ATTENDANCE_CSV, 'a', encoding='utf-8') as f:
-            f.write(line)
+        ATTENDANCE.record(fresh)
     except Exception as e:
         print('Failed to record attendance:', e)
+    return set(fresh)
 
 
 @app.route('/')
@@ -272,158 +592,778 @@ def reset_password(token):
     return render_template('reset_password.html', token=token)
 
 
-def _image_from_bytes(file_bytes):
-    try:
-        if FACE_RECOG_AVAILABLE:
-            img = face_recognition.load_image_file(io.BytesIO(file_bytes))
-            return img
-        else:
-            return PILImage.open(io.BytesIO(file_bytes)).convert('RGB')
-    except Exception:
-        return PILImage.open(io.BytesIO(file_bytes)).convert('RGB')
+def _analyze(file_bytes, all_faces=False, wait=0.0):
+    """Decode + detect + encode one upload (face_pipeline.analyze), in the
+    recognition engine's worker processes when INFERENCE_WORKERS is set,
+    otherwise inline. Raises ValueError for undecodable images and
+    EngineBusy / EngineTimeout when the engine is saturated or too slow."""
+    if ENGINE is not None:
+        return ENGINE.run(analyze, bytes(file_bytes), PIPELINE_SETTINGS, all_faces, wait=wait)
+    return analyze(file_bytes, PIPELINE_SETTINGS, all_faces)
+
+
+def _busy_response(e):
+    if isinstance(e, EngineBusy):
+        return _unavailable('Server busy, please retry')
+    return _unavailable('Recognition timed out, please retry')
+
+
+def _is_raw_image_upload():
+    mimetype = request.mimetype or ''
+    return mimetype.startswith('image/') or mimetype == 'application/octet-stream'
+
+
+def _read_body(limit=None):
+    """Read the raw request body straight into one preallocated buffer (no
+    form/JSON parsing, no base64). Returns None if the body is larger than
+    ``limit`` (default MAX_UPLOAD_BYTES), also for uploads without a
+    Content-Length (chunked): at most ``limit`` + 1 bytes are ever read."""
+    limit = MAX_UPLOAD_BYTES if limit is None else limit
+    length = request.content_length
+    if length is not None and length > limit:
+        return None
+    if not length:
+        body = bytearray()
+        while len(body) <= limit:
+            chunk = request.stream.read(min(1 << 16, limit + 1 - len(body)))
+            if not chunk:
+                break
+            body += chunk
+        return body if len(body) <= limit else None
+    buf = bytearray(length)
+    view = memoryview(buf)
+    got = 0
+    while got < length:
+        n = request.stream.readinto(view[got:])
+        if not n:
+            break
+        got += n
+    return view[:got]
 
 
 @app.route('/api/verify', methods=['POST'])
 def api_verify():
-    # Accept form-data file or JSON with base64 image
+    # Accept a raw image body (image/* or application/octet-stream), form-data file
+    # or JSON with base64 image
+    if not GALLERY_READY.is_set():
+        return _gallery_loading()
     file = request.files.get('image')
-    img = None
-    if file:
-        img = _image_from_bytes(file.read())
+    file_bytes = None
+    payload = {}
+    timer = g.timer
+    if _is_raw_image_upload():
+        with timer('read'):
+            file_bytes = _read_body()
+        if file_bytes is None:
+            return jsonify({'error': 'Image too large'}), 413
+    elif file:
+        with timer('read'):
+            file_bytes = file.read()
     else:
         payload = request.get_json(silent=True) or {}
         b64 = payload.get('image')
         if b64:
-            header, _, data = b64.partition(',')
-            file_bytes = base64.b64decode(data or b64)
-            img = _image_from_bytes(file_bytes)
+            with timer('base64'):
+                header, _, data = b64.partition(',')
+                file_bytes = base64.b64decode(data or b64)
 
-    if img is None:
+    if not file_bytes:
         return jsonify({'error': 'No image provided'}), 400
 
+    # Optional: also return the k closest students (?top_k=3 or "top_k" in the JSON body)
+    try:
+        top_k = int(request.args.get('top_k') or payload.get('top_k') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k must be an integer'}), 400
+    top_k = min(max(top_k, 0), MAX_TOP_K)
+    # mode=multi (query string, form field or JSON): recognise every face in the frame
+    multi = (request.args.get('mode') or request.form.get('mode') or payload.get('mode')) == 'multi'
+    if multi and not FACE_RECOG_AVAILABLE:
+        return jsonify({'error': 'Multi-face mode requires face_recognition'}), 400
+
+    known = GALLERY.snapshot
+    fingerprint = None
+    if not multi and VERIFY_CACHE.size:
+        with timer('fingerprint'):
+            try:
+                fingerprint = frame_fingerprint(file_bytes)
+            except Exception:
+                pass   # not an image; _analyze reports it
+        if fingerprint is not None:
+            cached = VERIFY_CACHE.get(fingerprint, known, variant=top_k)
+            VERIFY_CACHE_LOOKUPS.inc(result='miss' if cached is None else 'hit')
+            if cached is not None:
+                return _cached_verification(cached, timer)
+    try:
+        analysis = _analyze(file_bytes, all_faces=multi)
+    except ValueError as e:
+        VERIFICATIONS.inc(result='error')
+        return jsonify({'error': str(e)}), 400
+    except (EngineBusy, EngineTimeout) as e:
+        return _busy_response(e)
+    timer.ms.update(analysis['timings_ms'])
+    if not analysis['encodings']:
+        VERIFICATIONS.inc(result='no_face')
+        if fingerprint is not None:
+            VERIFY_CACHE.put(fingerprint, known, (400, {'error': 'No face found'}), variant=top_k)
+        return jsonify({'error': 'No face found', 'timings_ms': timer.rounded()}), 400
+    if not len(known):
+        return jsonify({'error': 'No registered students'}), 400
+    if multi:
+        return _verify_all_faces(analysis, known, timer)
+
     # If face_recognition is available, use embeddings; otherwise use image-hash based approximate match
+    query = analysis['encodings'][0]
+    with timer('match'):
+        if FACE_RECOG_AVAILABLE:
+            candidates = known.top_k(query, max(top_k, 1))
+        else:
+            # indexed radius lookup first; a full vectorized scan only for unknowns / top_k
+            candidates = known.within(query, PHASH_MAX_DISTANCE)
+            if top_k or not candidates:
+                candidates = known.top_k(query, max(top_k, 1))
+    result = _match_result(candidates, top_k)
+    if fingerprint is not None:
+        VERIFY_CACHE.put(fingerprint, known, (200, dict(result)), variant=top_k)
+    VERIFICATIONS.inc(result='match' if result['match'] else 'unknown')
+    if result['match']:
+        with timer('record'):
+            result['already_marked'] = not record_attendance(result['name'])
+    result['timings_ms'] = timer.rounded()
+    return jsonify(result)
+
+
+def _cached_verification(cached, timer):
+    """/api/verify response for a near-duplicate frame: the earlier request's
+    result, marked ``cached``. Attendance is not recorded again; the first
+    request already did that for a match."""
+    status, body = cached
+    result = dict(body)
+    if status != 200:
+        VERIFICATIONS.inc(result='no_face')
+    else:
+        VERIFICATIONS.inc(result='match' if result['match'] else 'unknown')
+        if result['match']:
+            result['already_marked'] = True
+    result['cached'] = True
+    result['timings_ms'] = timer.rounded()
+    return jsonify(result), status
+
+
+def _is_face_match(distance):
+    return distance < 0.5
+
+
+def _verify_all_faces(analysis, known, timer):
+    """Multi-face mode: match every face in the frame in one vectorized pass and
+    record attendance for all of them at once. A student matched by several
+    faces is given to the closest one. Boxes are in uploaded-image pixels."""
+    with timer('match'):
+        candidate_lists = known.top_k_many(np.stack(analysis['encodings']), MULTI_FACE_CANDIDATES)
+        assigned = assign_unique(candidate_lists, _is_face_match)
+    faces = []
+    for (top, right, bottom, left), cands, hit in zip(analysis['boxes'], candidate_lists, assigned):
+        name, distance = hit if hit else ('Unknown', cands[0][1])
+        faces.append({'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left},
+                      'name': name, 'match': hit is not None, 'distance': distance})
+    matched = [f['name'] for f in faces if f['match']]
+    VERIFICATIONS.inc(len(matched), result='match')
+    VERIFICATIONS.inc(len(faces) - len(matched), result='unknown')
+    with timer('record'):
+        recorded = record_attendance_many(matched)
+    for f in faces:
+        if f['match']:
+            f['already_marked'] = f['name'] not in recorded
+    return jsonify({'faces': faces, 'matched': len(matched), 'timings_ms': timer.rounded()})
+
+
+def _match_result(candidates, top_k=0):
+    """Response dict for the best of ``candidates`` [(name, distance), ...]."""
+    best, best_dist = candidates[0]
     if FACE_RECOG_AVAILABLE:
-        faces = face_recognition.face_encodings(img)
-        if not faces:
-            return jsonify({'error': 'No face found'}), 400
-        face = faces[0]
-        names = list(KNOWN_FACES.keys())
-        encs = list(KNOWN_FACES.values())
-        if not encs:
-            return jsonify({'error': 'No registered students'}), 400
-        distances = face_recognition.face_distance(encs, face)
-        best_idx = int(np.argmin(distances))
-        match = distances[best_idx] < 0.5
-        name = names[best_idx] if match else 'Unknown'
-        if match:
-            record_attendance(name)
-        return jsonify({'name': name, 'match': bool(match), 'distance': float(distances[best_idx])})
+        match = _is_face_match(best_dist)
+    else:
+        match = best_dist <= PHASH_MAX_DISTANCE
+        best_dist = int(best_dist)
+        candidates = [(n, int(d)) for n, d in candidates]
+    result = {'name': best if match else 'Unknown', 'match': bool(match), 'distance': best_dist}
+    if top_k:
+        result['candidates'] = [{'name': n, 'distance': d} for n, d in candidates]
+    return result
+
+
+def _b64_image(b64):
+    """Bytes of one base64 batch entry (a data URL prefix is ignored), or None."""
+    try:
+        return base64.b64decode(b64.partition(',')[2] or b64)
+    except Exception:
+        return None
+
+
+def _decode_and_encode(file_bytes):
+    """Batch worker: raw image bytes -> (query vector or None, error message or None).
+    ``None`` stands for an entry that was not valid base64."""
+    if file_bytes is None:
+        return None, 'Invalid base64 image'
+    try:
+        # batch items may queue for an engine slot (up to INFERENCE_TIMEOUT)
+        # instead of failing fast; their own deadline starts once they get one
+        analysis = _analyze(file_bytes, wait=ENGINE.timeout if ENGINE is not None else 0.0)
+    except ValueError as e:
+        return None, str(e)
+    except EngineBusy:
+        return None, 'Server busy'
+    except EngineTimeout:
+        return None, 'Recognition timed out'
+    if not analysis['encodings']:
+        return None, 'No face found'
+    return analysis['encodings'][0], None
+
+
+@app.route('/api/verify_batch', methods=['POST'])
+def api_verify_batch():
+    """Verify many images in one request (multipart files named "images", or JSON
+    {"images": [base64, ...]}). Images are decoded and encoded concurrently (in
+    the engine's processes with INFERENCE_WORKERS; inline, the GIL serialises
+    them), all encodings are matched against the gallery in one matrix
+    operation and the attendance rows are written in a single append. An image
+    that cannot be used, including a malformed base64 entry, gets an error at
+    its index; the others are still verified."""
+    if not GALLERY_READY.is_set():
+        return _gallery_loading()
+    timer = g.timer
+    with timer('read'):
+        blobs = [f.read() for f in request.files.getlist('images') or request.files.getlist('image')]
+    payload = {}
+    if not blobs:
+        payload = request.get_json(silent=True) or {}
+        images = payload.get('images') or []
+        if not isinstance(images, list):
+            return jsonify({'error': 'images must be a list of base64 strings'}), 400
+        with timer('base64'):
+            blobs = [_b64_image(b64) for b64 in images]
+    if not blobs:
+        return jsonify({'error': 'No images provided'}), 400
+    if len(blobs) > MAX_BATCH_IMAGES:
+        return jsonify({'error': f'At most {MAX_BATCH_IMAGES} images per batch'}), 413
+    try:
+        top_k = int(request.args.get('top_k') or payload.get('top_k') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k must be an integer'}), 400
+    top_k = min(max(top_k, 0), MAX_TOP_K)
+
+    known = GALLERY.snapshot
+    if not len(known):
+        return jsonify({'error': 'No registered students'}), 400
+
+    with timer('encode'):
+        encoded = list(BATCH_POOL.map(_decode_and_encode, blobs))
+    ok = [i for i, (query, _) in enumerate(encoded) if query is not None]
+    results = [{'index': i, 'error': err} for i, (_, err) in enumerate(encoded)]
+    if ok:
+        with timer('match'):
+            queries = np.stack([encoded[i][0] for i in ok])
+            for i, candidates in zip(ok, known.top_k_many(queries, max(top_k, 1))):
+                results[i] = dict(_match_result(candidates, top_k), index=i)
+    for r in results:
+        if 'error' in r:
+            VERIFICATIONS.inc(result='no_face' if r['error'] == 'No face found' else 'error')
+        else:
+            VERIFICATIONS.inc(result='match' if r['match'] else 'unknown')
+    matched = [r['name'] for r in results if r.get('match')]
+    # the same student twice in one batch is recorded once
+    with timer('record'):
+        recorded = record_attendance_many(matched)
+    for r in results:
+        if r.get('match'):
+            r['already_marked'] = r['name'] not in recorded
+            recorded.discard(r['name'])
+    return jsonify({'results': results, 'matched': len(matched)})
+
+
+class _Stream:
+    """State of one live stream: its tracker and the last frame's decode scale."""
+
+    def __init__(self):
+        self.tracker = FaceTracker()
+        self.scale = 1.0
+        self.frame = 0
+        self.seen = time.monotonic()
+        self.lock = threading.Lock()
+
+
+STREAMS = {}   # stream id -> _Stream, for /api/stream/frame
+_streams_lock = threading.Lock()
+
+
+def _match_encodings(encodings):
+    """(name, distance, match) per face encoding, each student given to one face at most."""
+    candidate_lists = GALLERY.snapshot.top_k_many(np.stack(encodings), MULTI_FACE_CANDIDATES)
+    out = []
+    for cands, hit in zip(candidate_lists, assign_unique(candidate_lists, _is_face_match)):
+        if hit:
+            out.append((hit[0], hit[1], True))
+        else:
+            out.append(('Unknown', cands[0][1] if cands else None, False))
+        VERIFICATIONS.inc(result='match' if hit else 'unknown')
+    return out
+
+
+def identify_boxes(rgb):
+    """FaceTracker callback for one RGB frame: encode the given boxes of ``rgb``
+    and match them against the gallery (also used by the desktop recognizer)."""
+    def identify(boxes):
+        return _match_encodings(encode_faces(rgb, boxes, ENCODE_MAX_FACE))
+    return identify
+
+
+def _stream_frame(stream, frame_bytes):
+    """Run one frame through a stream's tracker, record attendance once per new
+    track, and return the frame's result dict. Raises ValueError for bad images,
+    EngineBusy / EngineTimeout when the recognition engine is saturated."""
+    stream.frame += 1
+    stream.seen = time.monotonic()
+    timer = StageTimer()
+    tracker = stream.tracker
+    if STREAM_DETECT_EVERY > 1 and (stream.frame - 1) % STREAM_DETECT_EVERY:
+        tracks, skipped = [t for t in tracker.tracks if t.missed == 0], True
+    elif ENGINE is not None:
+        # decode, detect and encode every face in an engine worker; the tracker
+        # then only matches the encodings of the tracks it asks about
+        skipped = False
+        analysis = _analyze(frame_bytes, all_faces=True)
+        timer.ms.update(analysis['timings_ms'])
+        stream.scale = 1.0   # boxes come back in upload pixels
+        encoding_of = dict(zip(analysis['boxes'], analysis['encodings']))
+        with timer('track'):
+            tracks = tracker.update(analysis['boxes'],
+                                    lambda boxes: _match_encodings([encoding_of[b] for b in boxes]))
     else:
-        # img is a PIL Image
-        ph = imagehash.phash(img)
-        best = None
-        best_dist = 999
-        for n, h in KNOWN_FACES.items():
-            d = ph - h
-            if d < best_dist:
-                best_dist = d
-                best = n
-        if best is None:
-            return jsonify({'error': 'No registered students'}), 400
-        match = best_dist <= 10
-        if match:
-            record_attendance(best)
-        return jsonify({'name': best if match else 'Unknown', 'match': bool(match), 'distance': int(best_dist)})
+        skipped = False
+        with timer('decode'):
+            try:
+                pil, stream.scale = decode_image(frame_bytes, DECODE_MAX_SIDE)
+            except Exception as e:
+                raise ValueError('Invalid image') from e
+            rgb = np.asarray(pil)
+        with timer('detect'):
+            boxes = detect_faces(rgb, DETECT_WIDTH)
+        with timer('track'):
+            tracks = tracker.update(boxes, identify_boxes(rgb))
+    due = [t for t in tracks if t.match and not t.marked]
+    recorded = set()
+    if due:
+        with timer('record'):
+            recorded = record_attendance_many([t.name for t in due])
+        for t in due:
+            t.marked = True
+    faces = []
+    for t in tracks:
+        face = t.as_dict(stream.scale)
+        if t in due:
+            face['already_marked'] = t.name not in recorded
+        faces.append(face)
+    _observe_stages('stream_frame', timer)
+    return {'frame': stream.frame, 'skipped': skipped, 'faces': faces, 'recorded': sorted(recorded),
+            'stats': tracker.stats(), 'timings_ms': timer.rounded()}
+
+
+def _stream_unavailable():
+    if not GALLERY_READY.is_set():
+        return _gallery_loading()
+    if not FACE_RECOG_AVAILABLE:
+        return jsonify({'error': 'Live mode requires face_recognition'}), 400
+    return None
+
+
+@app.route('/api/stream/frame', methods=['POST'])
+def api_stream_frame():
+    """One frame of a live stream (raw image body, ?stream=<client-chosen id>).
+
+    Faces are tracked across the stream's frames and attendance is recorded
+    once per track. Inline, only new or changed tracks are encoded; with
+    INFERENCE_WORKERS each detected frame goes to the recognition engine (503
+    when it is busy) and only the tracks' matching is done here."""
+    unavailable = _stream_unavailable()
+    if unavailable is not None:
+        return unavailable
+    stream_id = request.args.get('stream', '')
+    if not stream_id or len(stream_id) > 64:
+        return jsonify({'error': 'stream id required'}), 400
+    frame_bytes = _read_body()
+    if frame_bytes is None:
+        return jsonify({'error': 'Image too large'}), 413
+    if not frame_bytes:
+        return jsonify({'error': 'No image provided'}), 400
+    now = time.monotonic()
+    with _streams_lock:
+        for key in [k for k, st in STREAMS.items() if now - st.seen > STREAM_IDLE_SECONDS]:
+            del STREAMS[key]
+        stream = STREAMS.get(stream_id)
+        if stream is None:
+            if len(STREAMS) >= MAX_STREAMS:
+                return _unavailable('Too many live streams, please retry')
+            stream = STREAMS[stream_id] = _Stream()
+    with stream.lock:
+        try:
+            return jsonify(_stream_frame(stream, frame_bytes))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except (EngineBusy, EngineTimeout) as e:
+            return _busy_response(e)
 
 
 @app.route('/api/admin/add_student', methods=['POST'])
 def api_add_student():
     if not session.get('admin'):
         return jsonify({'error': 'unauthorized'}), 401
+    if not GALLERY_READY.is_set():
+        return _gallery_loading()
     name = request.form.get('name', '').strip()
-    file = request.files.get('image')
+    # one or more photos, as "image" and/or "images" files
+    files = [f for f in request.files.getlist('image') + request.files.getlist('images') if f and f.filename]
     if not name:
         return jsonify({'error': 'name required'}), 400
     safe = sanitize_name(name)
     os.makedirs(IMAGES_DIR, exist_ok=True)
-    if file:
-        ext = os.path.splitext(file.filename)[1] or '.png'
+    timer = g.timer
+    before = _student_photos(safe)
+    with timer('save'):
+        # mode=append adds the photos to the student's existing ones; otherwise they replace them
+        append = request.form.get('mode') == 'append'
+        written = _store_student_photos(safe, [(os.path.splitext(f.filename)[1] or '.png', f.save) for f in files],
+                                        append=append)
+        if not written and not _student_photos(safe):
+            # no uploaded file: copy placeholder image so student has a thumbnail
+            placeholder = os.path.join(BASE_DIR, 'static', 'img', 'placeholder.png')
+            dest = os.path.join(IMAGES_DIR, f"{safe}.png")
+            try:
+                if os.path.exists(placeholder):
+                    import shutil
+                    shutil.copyfile(placeholder, dest)
+                else:
+                    # create a tiny blank image as fallback
+                    from PIL import Image as PILImg
+                    img = PILImg.new('RGB', (200, 200), color=(200, 200, 200))
+                    img.save(dest)
+                written.append(dest)
+            except Exception as e:
+                print('Failed to create placeholder image:', e)
+    with timer('thumbnails'):
+        for path in written:
+            THUMBNAILS.generate(_image_relpath(path))
+    # encode just this student's photos and publish their template; the cache
+    # entries of replaced (or, when appending, moved) photos are dropped
+    photos = _student_photos(safe)
+    with timer('encode'):
+        enrolled = GALLERY.add(safe, photos, forget=[p for p in before if not append or p not in photos])
+    if files and not enrolled:
+        # the student's earlier template, if any, is gone with the old photos
+        return jsonify({'error': 'No face found in the uploaded photo(s)', 'students': GALLERY.names(),
+                        'photos': len(photos)}), 400
+    return jsonify({'ok': True, 'enrolled': enrolled, 'students': GALLERY.names(), 'photos': len(photos)})
+
+
+def _store_student_photos(safe, uploads, append=False):
+    """Save a student's new photos; ``uploads`` is [(extension, write(dest))].
+    Without ``append`` they replace the existing photos. One photo is stored as
+    IMAGES_DIR/<student><ext>, several in IMAGES_DIR/<student>/ (an existing
+    single photo moves into the folder). Returns the paths written or moved."""
+    photos = _student_photos(safe)
+    if not append:
+        _delete_photos(photos)
+        _remove_student_folder(safe)
+        photos = []
+    written = []
+    if len(uploads) > 1 or (uploads and photos):
+        # several photos per student live in IMAGES_DIR/<student>/
+        folder = os.path.join(IMAGES_DIR, safe)
+        os.makedirs(folder, exist_ok=True)
+        for path in photos:
+            if os.path.dirname(path) != folder:
+                # the student's single photo so far moves into the folder
+                dest = _next_photo_path(folder, os.path.splitext(path)[1])
+                os.replace(path, dest)
+                THUMBNAILS.remove(_image_relpath(path))
+                written.append(dest)
+        for ext, write in uploads:
+            dest = _next_photo_path(folder, ext)
+            write(dest)
+            written.append(dest)
+    elif uploads:
+        ext, write = uploads[0]
         dest = os.path.join(IMAGES_DIR, f"{safe}{ext}")
-        file.save(dest)
-    else:
-        # no uploaded file: copy placeholder image so student has a thumbnail
-        placeholder = os.path.join(BASE_DIR, 'static', 'img', 'placeholder.png')
-        dest = os.path.join(IMAGES_DIR, f"{safe}.png")
+        write(dest)
+        written.append(dest)
+    return written
+
+
+def _next_photo_path(folder, ext):
+    """Next free numbered file name (01.jpg, 02.jpg, ...) in a student folder."""
+    taken = {os.path.splitext(f)[0] for f in os.listdir(folder)}
+    n = 1
+    while f'{n:02d}' in taken:
+        n += 1
+    return os.path.join(folder, f'{n:02d}{ext.lower()}')
+
+
+def _remove_student_folder(safe):
+    folder = os.path.join(IMAGES_DIR, safe)
+    if os.path.isdir(folder):
         try:
-            if os.path.exists(placeholder):
-                import shutil
-                shutil.copyfile(placeholder, dest)
-            else:
-                # create a tiny blank image as fallback
-                from PIL import Image as PILImg
-                img = PILImg.new('RGB', (200, 200), color=(200, 200, 200))
-                img.save(dest)
+            os.rmdir(folder)
+        except OSError as e:
+            print('remove error', e)
+
+
+def _delete_photos(paths):
+    """Delete enrollment photos and their thumbnails; True if any file was removed."""
+    removed = False
+    for path in paths:
+        try:
+            os.remove(path)
+            removed = True
         except Exception as e:
-            print('Failed to create placeholder image:', e)
-    # reload
-    global KNOWN_FACES
-    KNOWN_FACES = load_known_faces()
-    return jsonify({'ok': True, 'students': list(KNOWN_FACES.keys())})
+            print('remove error', e)
+        THUMBNAILS.remove(_image_relpath(path))
+    return removed
 
 
 @app.route('/api/admin/remove_student', methods=['POST'])
 def api_remove_student():
     if not session.get('admin'):
         return jsonify({'error': 'unauthorized'}), 401
+    if not GALLERY_READY.is_set():
+        return _gallery_loading()
     name = request.form.get('name', '')
     if not name:
         return jsonify({'error': 'name required'}), 400
     safe = sanitize_name(name)
-    removed = False
-    for path in glob.glob(os.path.join(IMAGES_DIR, f"{safe}.*")):
-        try:
-            os.remove(path)
-            removed = True
-        except Exception as e:
-            print('remove error', e)
-    global KNOWN_FACES
-    KNOWN_FACES = load_known_faces()
-    return jsonify({'ok': True, 'removed': removed, 'students': list(KNOWN_FACES.keys())})
+    paths = _student_photos(safe)
+    removed = _delete_photos(paths)
+    _remove_student_folder(safe)
+    with g.timer('gallery'):
+        GALLERY.remove(safe, paths)
+    return jsonify({'ok': True, 'removed': removed, 'students': GALLERY.names()})
+
+
+def _publish_bulk_enrollment(photos, vectors, move, append):
+    """BulkEnroller callback: store the accepted photos of every student the way
+    add_student does, then add them all to the gallery, which is published once.
+    The vectors computed by the job are reused, so nothing is encoded twice."""
+    import shutil
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    by_student = {}
+    for name, paths in photos.items():
+        safe = sanitize_name(name)
+        if safe:
+            by_student.setdefault(safe, []).extend(paths)
+    known = {}   # stored path -> vector
+    written = []
+    for safe, paths in by_student.items():
+        uploads = []
+        for src in paths:
+            def write(dest, src=src):
+                (shutil.move if move else shutil.copy2)(src, dest)
+                known[dest] = vectors[src]
+            uploads.append((os.path.splitext(src)[1], write))
+        written.extend(_store_student_photos(safe, uploads, append))
+    added = GALLERY.add_many({safe: _student_photos(safe) for safe in by_student}, known)
+    for path in written:
+        THUMBNAILS.generate(_image_relpath(path))
+    return len(added)
+
+
+# Bulk enrollment (bulk_enroll.py): photos are encoded in BULK_WORKERS processes
+# (0 = in the job thread). An import may hold at most BULK_MAX_FILES photos and
+# BULK_MAX_MB uncompressed; server-side directories must be under BULK_IMPORT_ROOT.
+BULK_WORKERS = int(os.environ.get('BULK_WORKERS', os.cpu_count() or 1))
+BULK_IMPORT_ROOT = os.environ.get('BULK_IMPORT_ROOT', os.path.join(BASE_DIR, 'data', 'import'))
+BULK_ENROLLER = None
+
+
+@app.route('/api/admin/enroll_jobs', methods=['POST'])
+def api_start_enroll_job():
+    """Start a bulk enrollment from a zip ("archive" file) or a directory under
+    BULK_IMPORT_ROOT ("directory"). Answers 202 with the job; poll its URL."""
+    if not session.get('admin'):
+        return jsonify({'error': 'unauthorized'}), 401
+    if not GALLERY_READY.is_set():
+        return _gallery_loading()
+    append = request.form.get('mode') == 'append'
+    archive = request.files.get('archive')
+    directory = request.form.get('directory', '').strip()
+    try:
+        if archive and archive.filename:
+            job = BULK_ENROLLER.start_archive(archive.save, append)
+        elif directory:
+            root = os.path.realpath(BULK_IMPORT_ROOT)
+            path = os.path.realpath(os.path.join(root, directory))
+            if path != root and not path.startswith(root + os.sep):
+                return jsonify({'error': 'directory must be inside the import folder'}), 400
+            if not os.path.isdir(path):
+                return jsonify({'error': 'directory not found'}), 404
+            job = BULK_ENROLLER.start_directory(path, append)
+        else:
+            return jsonify({'error': 'archive or directory required'}), 400
+    except JobRunning:
+        return jsonify({'error': 'another bulk enrollment is running'}), 409
+    resp = jsonify(job.as_dict())
+    resp.status_code = 202
+    resp.headers['Location'] = url_for('api_enroll_job', job_id=job.id)
+    return resp
+
+
+@app.route('/api/admin/enroll_jobs')
+def api_enroll_jobs():
+    if not session.get('admin'):
+        return jsonify({'error': 'unauthorized'}), 401
+    return jsonify({'jobs': [job.as_dict() for job in BULK_ENROLLER.recent()]})
+
+
+@app.route('/api/admin/enroll_jobs/<job_id>')
+def api_enroll_job(job_id):
+    if not session.get('admin'):
+        return jsonify({'error': 'unauthorized'}), 401
+    job = BULK_ENROLLER.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job.as_dict())
 
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
-    # Serve images from the images directory
-    return send_from_directory(IMAGES_DIR, filename)
+    """Serve an enrollment photo from the images directory, or its thumbnail with
+    ?size=64|128|256. Responses carry ETag / Last-Modified and answer
+    conditional requests with 304; ?v=<version> URLs are cached for a year."""
+    versioned = bool(request.args.get('v'))
+    max_age = IMAGE_MAX_AGE_VERSIONED if versioned else IMAGE_MAX_AGE
+    size = request.args.get('size', type=int)
+    if size:
+        if size not in THUMB_SIZES:
+            return jsonify({'error': f'size must be one of {list(THUMB_SIZES)}'}), 400
+        path = safe_join(IMAGES_DIR, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        thumb = THUMBNAILS.get(os.path.relpath(path, IMAGES_DIR), size)
+        if thumb is None:
+            abort(404)
+        resp = send_file(thumb, mimetype='image/jpeg', max_age=max_age, conditional=True, etag=True)
+    else:
+        resp = send_from_directory(IMAGES_DIR, filename, max_age=max_age)
+    if versioned:
+        resp.cache_control.immutable = True
+    return resp
 
 
-def read_attendance():
-    rows = []
-    if os.path.exists(ATTENDANCE_CSV):
-        try:
-            with open(ATTENDANCE_CSV, 'r', encoding='utf-8') as f:
-                for line in f:
-                    parts = line.strip().split(',')
-                    if len(parts) >= 3:
-                        rows.append({'name': parts[0], 'date': parts[1], 'time': parts[2]})
-        except Exception as e:
-            print('Failed to read attendance:', e)
-    return rows
+# Attendance records per page in /api/admin/attendance (default / upper bound)
+ATTENDANCE_PAGE_SIZE = 50
+MAX_ATTENDANCE_PAGE_SIZE = 500
+
+
+def _attendance_filters(args):
+    """Student / date-range filters from query args; raises ValueError on bad dates."""
+    filters = {'name': args.get('student') or None,
+               'date_from': args.get('from') or None,
+               'date_to': args.get('to') or None}
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            try:
+                datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError('Dates must be YYYY-MM-DD')
+    return filters
+
+
+@app.route('/api/admin/attendance')
+def api_attendance():
+    """One page of attendance records, newest first.
+
+    Query args: student, from / to (YYYY-MM-DD, inclusive), order (desc|asc),
+    limit and cursor (the next_cursor of the previous page)."""
+    if not session.get('admin'):
+        return jsonify({'error': 'unauthorized'}), 401
+    try:
+        filters = _attendance_filters(request.args)
+        limit = int(request.args.get('limit') or ATTENDANCE_PAGE_SIZE)
+        with g.timer('query'):
+            rows, next_cursor = ATTENDANCE.page(**filters,
+                                                descending=request.args.get('order', 'desc') != 'asc',
+                                                limit=min(max(limit, 1), MAX_ATTENDANCE_PAGE_SIZE),
+                                                cursor=request.args.get('cursor') or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'rows': rows, 'next_cursor': next_cursor})
+
+
+@app.route('/api/admin/reports')
+def api_reports():
+    """Attendance summaries from the incrementally maintained aggregates.
+
+    Query args: report (students|days|lectures; default all three) and
+    from / to (YYYY-MM-DD, inclusive)."""
+    if not session.get('admin'):
+        return jsonify({'error': 'unauthorized'}), 401
+    report = request.args.get('report')
+    if report not in (None, '', 'students', 'days', 'lectures'):
+        return jsonify({'error': 'report must be students, days or lectures'}), 400
+    try:
+        filters = _attendance_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    span = {'date_from': filters['date_from'], 'date_to': filters['date_to']}
+    result = {}
+    timer = g.timer
+    if report in (None, '', 'students'):
+        with timer('students'):
+            result['class_days'], result['students'] = ATTENDANCE.student_report(**span)
+    if report in (None, '', 'days'):
+        with timer('days'):
+            result['days'] = ATTENDANCE.daily_report(**span)
+    if report in (None, '', 'lectures'):
+        result['lecture_minutes'] = LECTURE_MINUTES
+        with timer('lectures'):
+            result['lectures'] = ATTENDANCE.lecture_report(**span)
+    return jsonify(result)
+
+
+@app.route('/admin/export.csv')
+def export_attendance_csv():
+    """Stream attendance records as CSV (same filters as /api/admin/attendance);
+    rows are fetched in chunks, so memory use does not grow with the history."""
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    try:
+        filters = _attendance_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(stream_with_context(ATTENDANCE.iter_csv(**filters)), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=attendance.csv'})
 
 
 @app.route('/admin/dashboard')
 def admin_dashboard():
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
-    # Build student list from actual files in IMAGES_DIR so we can show correct extensions
-    students = []
-    for path in sorted(glob.glob(os.path.join(IMAGES_DIR, '*'))):
-        if os.path.isfile(path):
-            filename = os.path.basename(path)
-            name, _ext = os.path.splitext(filename)
-            students.append({'name': name, 'filename': filename})
-    attendance = read_attendance()
-    return render_template('admin_dashboard.html', students=students, attendance=attendance)
+    timer = g.timer
+    # Build student list from actual files in IMAGES_DIR so we can show correct extensions;
+    # students with a photo folder are shown with their first photo
+    students = {}
+    with timer('list_images'):
+        for path in sorted(_image_paths()):
+            name = name_of(path, IMAGES_DIR)
+            if name in students:
+                students[name]['photos'] += 1
+                continue
+            # the photo's mtime versions its URL so browsers can cache it for good
+            students[name] = {'name': name, 'filename': _image_relpath(path),
+                              'version': int(os.path.getmtime(path)), 'photos': 1}
+        students = sorted(students.values(), key=lambda s: s['name'])
+    # records themselves are loaded page by page by admin.js
+    with timer('summary'):
+        summary = ATTENDANCE.summary(str(datetime.now().date()))
+    with timer('render'):
+        return render_template('admin_dashboard.html', students=students, summary=summary)
 
 
 @app.route('/admin/logout')
@@ -432,6 +1372,34 @@ def admin_logout():
     return redirect(url_for('index'))
 
 
+def init_app():
+    """Make the gallery and start its warm-up, open the attendance store
+    (importing the legacy CSV once) and create the batch pool and bulk enroller."""
+    global GALLERY, ATTENDANCE, BATCH_POOL, BULK_ENROLLER
+    if not FACE_RECOG_AVAILABLE:
+        print('face_recognition not available, falling back to image-hash matcher')
+    GALLERY = _make_gallery()
+    start_warm_up()
+    ATTENDANCE = AttendanceStore(ATTENDANCE_DB, lecture_minutes=LECTURE_MINUTES)
+    imported = ATTENDANCE.import_csv(ATTENDANCE_CSV)
+    if imported:
+        print(f'[INFO] Imported {imported} attendance record(s) from {ATTENDANCE_CSV}')
+    PRESENCE.rebuild(ATTENDANCE)
+    BATCH_POOL = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+    BULK_ENROLLER = BulkEnroller(encode_enrollment, PIPELINE_SETTINGS, _publish_bulk_enrollment,
+                                 os.path.join(BASE_DIR, 'data', 'bulk_staging'), workers=BULK_WORKERS,
+                                 max_files=int(os.environ.get('BULK_MAX_FILES', 10000)),
+                                 max_bytes=int(os.environ.get('BULK_MAX_MB', 2048)) * 1024 * 1024)
+
+
+# The inference engine and bulk enrollment start their workers with 'spawn',
+# which re-imports the main script (this file as __mp_main__ under
+# 'python app.py', or a script importing it) in every worker. Those workers
+# only run face_pipeline, so they skip all of the above.
+if multiprocessing.current_process().name == 'MainProcess':
+    init_app()
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
 
@@ -0,0 +1,461 @@
+"""SQLite attendance store (WAL mode).
+
+Replaces the append-only ``data/attendance.csv``. Rows are the same
+(name, date, time) triples, with indexes on (name, date) and (date, time) so
+per-student and per-day lookups don't scan the whole history.
+
+Writes go through one background writer thread. ``record`` only enqueues the
+rows. The writer drains everything queued so far and inserts it in a single
+transaction, so concurrent verifications never wait on each other for the
+database or a file handle. Readers use their own per-thread connections;
+thanks to WAL they are never blocked by the writer.
+
+Reports (per-student attendance, per-day headcounts, per-lecture counts) are
+read from aggregate tables that triggers update on every insert, so they cost
+O(result) instead of a scan of the history. ``rebuild_aggregates``
+recomputes them from the raw rows.
+
+``PresenceIndex`` remembers who has already been marked today so repeat
+matches are answered from memory without queueing another row.
+
+The admin dashboard reads it a page at a time (``page``, keyset pagination on
+(date, time, id), so deep pages cost the same as the first one). The old CSV
+is imported once (``import_csv``) and stays available as a streamed export
+(``iter_csv`` / ``export_csv``).
+"""
+import atexit
+import base64
+import json
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attendance (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attendance_name_date ON attendance (name, date);
+CREATE INDEX IF NOT EXISTS attendance_date_time ON attendance (date, time);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Aggregates kept up to date by the attendance_aggregates trigger. A "lecture" is
+# a fixed-length time slot of the day (slot = minutes since midnight // length).
+AGGREGATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS student_days (
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    first_time TEXT NOT NULL,
+    marks INTEGER NOT NULL,
+    PRIMARY KEY (name, date)
+);
+CREATE INDEX IF NOT EXISTS student_days_date ON student_days (date);
+CREATE TABLE IF NOT EXISTS student_totals (
+    name TEXT PRIMARY KEY,
+    days INTEGER NOT NULL,
+    marks INTEGER NOT NULL,
+    first_date TEXT NOT NULL,
+    last_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_counts (
+    date TEXT PRIMARY KEY,
+    students INTEGER NOT NULL,
+    marks INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS student_lectures (
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    PRIMARY KEY (date, slot, name)
+);
+CREATE TABLE IF NOT EXISTS lecture_counts (
+    date TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    students INTEGER NOT NULL,
+    marks INTEGER NOT NULL,
+    PRIMARY KEY (date, slot)
+);
+"""
+
+AGGREGATE_TABLES = ('student_days', 'student_totals', 'daily_counts', 'student_lectures', 'lecture_counts')
+
+
+def _slot_sql(time_column, minutes):
+    return f"((CAST(substr({time_column}, 1, 2) AS INTEGER) * 60 + CAST(substr({time_column}, 4, 2) AS INTEGER)) / {int(minutes)})"
+
+
+def _trigger_sql(minutes):
+    slot = _slot_sql('NEW.time', minutes)
+    # order matters: the "new student today / in this lecture" tests look at
+    # student_days / student_lectures before this row is added to them
+    return f"""
+CREATE TRIGGER attendance_aggregates AFTER INSERT ON attendance BEGIN
+    INSERT INTO daily_counts (date, students, marks) VALUES (NEW.date, 0, 0) ON CONFLICT (date) DO NOTHING;
+    UPDATE daily_counts SET marks = marks + 1,
+        students = students + NOT EXISTS (SELECT 1 FROM student_days WHERE name = NEW.name AND date = NEW.date)
+        WHERE date = NEW.date;
+    INSERT INTO student_totals (name, days, marks, first_date, last_date) VALUES (NEW.name, 0, 0, NEW.date, NEW.date)
+        ON CONFLICT (name) DO NOTHING;
+    UPDATE student_totals SET marks = marks + 1,
+        days = days + NOT EXISTS (SELECT 1 FROM student_days WHERE name = NEW.name AND date = NEW.date),
+        first_date = min(first_date, NEW.date), last_date = max(last_date, NEW.date)
+        WHERE name = NEW.name;
+    INSERT INTO student_days (name, date, first_time, marks) VALUES (NEW.name, NEW.date, NEW.time, 1)
+        ON CONFLICT (name, date) DO UPDATE SET marks = marks + 1, first_time = min(first_time, excluded.first_time);
+    INSERT INTO lecture_counts (date, slot, students, marks) VALUES (NEW.date, {slot}, 0, 0)
+        ON CONFLICT (date, slot) DO NOTHING;
+    UPDATE lecture_counts SET marks = marks + 1,
+        students = students + NOT EXISTS (SELECT 1 FROM student_lectures
+                                          WHERE date = NEW.date AND slot = {slot} AND name = NEW.name)
+        WHERE date = NEW.date AND slot = {slot};
+    INSERT INTO student_lectures (name, date, slot) VALUES (NEW.name, NEW.date, {slot})
+        ON CONFLICT DO NOTHING;
+END;
+"""
+
+
+def slot_label(slot, minutes):
+    """Lecture slot number -> 'HH:MM-HH:MM'."""
+    start, end = slot * minutes, min((slot + 1) * minutes, 24 * 60)
+    return f'{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}'
+
+
+CSV_HEADER = 'name,date,time\n'
+
+
+def encode_cursor(key):
+    """(date, time, id) of the last row on a page -> opaque URL-safe token."""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError for a malformed token."""
+    try:
+        date, time, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return str(date), str(time), int(row_id)
+    except Exception as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def _filters(name=None, date_from=None, date_to=None):
+    """WHERE clauses + parameters for the optional student / date range filters."""
+    clauses, params = [], []
+    if name:
+        clauses.append('name = ?')
+        params.append(name)
+    if date_from:
+        clauses.append('date >= ?')
+        params.append(date_from)
+    if date_to:
+        clauses.append('date <= ?')
+        params.append(date_to)
+    return clauses, params
+
+
+def parse_csv_line(line):
+    """'name,date,time' -> (name, date, time), or None for malformed lines."""
+    parts = line.strip().split(',')
+    if len(parts) < 3 or parts[0] == 'name':
+        return None
+    return parts[0], parts[1], parts[2]
+
+
+class AttendanceStore:
+    # most rows inserted per transaction by the writer thread
+    BATCH_ROWS = 1000
+
+    def __init__(self, path: str, lecture_minutes: int = 60):
+        self.path = path
+        self.lecture_minutes = lecture_minutes
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        conn.executescript(AGGREGATE_SCHEMA)
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='attendance-writer', daemon=True)
+        self._writer.start()
+        self._ensure_aggregates()
+        atexit.register(self.flush)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL + NORMAL: durable across app crashes, fsync only at checkpoints
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # --- writes ---------------------------------------------------------------
+
+    def record(self, names, when: datetime = None):
+        """Queue one (name, date, time) row per name, stamped ``when`` (default
+        now). Returns the rows; they are committed shortly by the writer."""
+        if not names:
+            return []
+        ts = when or datetime.now()
+        date, time = str(ts.date()), ts.time().strftime('%H:%M:%S')
+        rows = [(name, date, time) for name in names]
+        self._queue.put(rows)
+        return rows
+
+    def flush(self, timeout: float = 10.0):
+        """Block until everything queued so far is committed."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        conn = self._conn()
+        while True:
+            items = [self._queue.get()]
+            pending = len(items[0]) if isinstance(items[0], list) else 0
+            # group commit: take whatever else is already waiting
+            while pending < self.BATCH_ROWS:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+                if isinstance(item, list):
+                    pending += len(item)
+            rows = [row for item in items if isinstance(item, list) for row in item]
+            if rows:
+                try:
+                    with conn:
+                        conn.executemany('INSERT INTO attendance (name, date, time) VALUES (?, ?, ?)', rows)
+                except Exception as e:
+                    print(f'Failed to record attendance ({len(rows)} rows):', e)
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    # --- reads ----------------------------------------------------------------
+
+    def rows(self):
+        """Every record as {'name', 'date', 'time'} dicts, oldest first."""
+        self.flush()
+        cur = self._conn().execute('SELECT name, date, time FROM attendance ORDER BY id')
+        return [{'name': n, 'date': d, 'time': t} for n, d, t in cur]
+
+    def latest_marks(self, date: str):
+        """{name: datetime of the last mark} for one 'YYYY-MM-DD' day."""
+        self.flush()
+        cur = self._conn().execute('SELECT name, MAX(time) FROM attendance WHERE date = ? GROUP BY name', (date,))
+        return {n: datetime.fromisoformat(f'{date}T{t}') for n, t in cur}
+
+    def count(self) -> int:
+        return self._conn().execute('SELECT COUNT(*) FROM attendance').fetchone()[0]
+
+    def page(self, name=None, date_from=None, date_to=None, descending: bool = True,
+             limit: int = 50, cursor: str = None):
+        """One page of records, newest first unless ``descending`` is False.
+
+        ``cursor`` is the ``next_cursor`` of the previous page. Returns
+        (rows, next_cursor); next_cursor is None on the last page."""
+        clauses, params = _filters(name, date_from, date_to)
+        if cursor:
+            clauses.append(f'(date, time, id) {"<" if descending else ">"} (?, ?, ?)')
+            params.extend(decode_cursor(cursor))
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        order = 'DESC' if descending else 'ASC'
+        self.flush()
+        cur = self._conn().execute(
+            f'SELECT id, name, date, time FROM attendance{where} '
+            f'ORDER BY date {order}, time {order}, id {order} LIMIT ?', params + [limit + 1])
+        found = cur.fetchall()
+        rows = [{'name': n, 'date': d, 'time': t} for _, n, d, t in found[:limit]]
+        next_cursor = None
+        if len(found) > limit:
+            row_id, _, date, time = found[limit - 1]
+            next_cursor = encode_cursor((date, time, row_id))
+        return rows, next_cursor
+
+    def summary(self, date: str):
+        """{'total': all records, 'today': distinct students marked on ``date``},
+        read from the daily_counts aggregates instead of the raw rows."""
+        self.flush()
+        total, today = self._conn().execute(
+            'SELECT COALESCE(SUM(marks), 0), COALESCE(SUM(students * (date = ?)), 0) FROM daily_counts',
+            (date,)).fetchone()
+        return {'total': total, 'today': today}
+
+    def iter_csv(self, name=None, date_from=None, date_to=None, header: bool = True, chunk: int = 5000):
+        """CSV lines (name,date,time), oldest first, fetched ``chunk`` rows at a
+        time so the whole table is never held in memory. Accepts the same
+        filters as ``page``."""
+        self.flush()
+        clauses, params = _filters(name, date_from, date_to)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        if header:
+            yield CSV_HEADER
+        # a private connection: the generator may outlive the request's thread-local one
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            cur = conn.execute(f'SELECT name, date, time FROM attendance{where} ORDER BY date, time, id', params)
+            while True:
+                batch = cur.fetchmany(chunk)
+                if not batch:
+                    break
+                yield ''.join(f'{n},{d},{t}\n' for n, d, t in batch)
+        finally:
+            conn.close()
+
+    def export_csv(self, path: str, header: bool = False) -> int:
+        """Write the whole table to ``path`` in the legacy CSV format (no header
+        by default, like the old file). Returns the number of rows written."""
+        written = 0
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for block in self.iter_csv(header=header):
+                f.write(block)
+                written += block.count('\n')
+        os.replace(tmp, path)
+        return written - (1 if header else 0)
+
+    # --- aggregates / reports -------------------------------------------------
+
+    def _ensure_aggregates(self):
+        """Install the aggregate trigger; databases created before it existed, or
+        with another lecture length, are rebuilt once."""
+        conn = self._conn()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'lecture_minutes'").fetchone()
+        has_trigger = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'attendance_aggregates'").fetchone()
+        if not has_trigger or row is None or int(row[0]) != self.lecture_minutes:
+            self.rebuild_aggregates()
+
+    def rebuild_aggregates(self):
+        """Recompute every aggregate table from the raw rows (and reinstall the
+        trigger). Returns the number of raw rows scanned."""
+        self.flush()
+        conn = self._conn()
+        slot = _slot_sql('time', self.lecture_minutes)
+        with conn:
+            conn.execute('DROP TRIGGER IF EXISTS attendance_aggregates')
+            for table in AGGREGATE_TABLES:
+                conn.execute(f'DELETE FROM {table}')
+            conn.execute('INSERT INTO student_days (name, date, first_time, marks) '
+                         'SELECT name, date, MIN(time), COUNT(*) FROM attendance GROUP BY name, date')
+            conn.execute('INSERT INTO student_totals (name, days, marks, first_date, last_date) '
+                         'SELECT name, COUNT(*), SUM(marks), MIN(date), MAX(date) FROM student_days GROUP BY name')
+            conn.execute('INSERT INTO daily_counts (date, students, marks) '
+                         'SELECT date, COUNT(*), SUM(marks) FROM student_days GROUP BY date')
+            conn.execute(f'INSERT INTO student_lectures (name, date, slot) '
+                         f'SELECT DISTINCT name, date, {slot} FROM attendance')
+            conn.execute(f'INSERT INTO lecture_counts (date, slot, students, marks) '
+                         f'SELECT date, {slot} AS s, COUNT(DISTINCT name), COUNT(*) FROM attendance GROUP BY date, s')
+            conn.execute(_trigger_sql(self.lecture_minutes))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('lecture_minutes', ?)",
+                         (str(self.lecture_minutes),))
+            return conn.execute('SELECT COUNT(*) FROM attendance').fetchone()[0]
+
+    def student_report(self, date_from=None, date_to=None):
+        """Per student: days present, marks, first/last date and percentage of
+        class days (days on which anyone was marked) in the range."""
+        self.flush()
+        conn = self._conn()
+        if date_from or date_to:
+            clauses, params = _filters(None, date_from, date_to)
+            where = ' WHERE ' + ' AND '.join(clauses)
+            class_days = conn.execute(f'SELECT COUNT(*) FROM daily_counts{where}', params).fetchone()[0]
+            cur = conn.execute(f'SELECT name, COUNT(*), SUM(marks), MIN(date), MAX(date) FROM student_days{where} '
+                               f'GROUP BY name ORDER BY name', params)
+        else:
+            class_days = conn.execute('SELECT COUNT(*) FROM daily_counts').fetchone()[0]
+            cur = conn.execute('SELECT name, days, marks, first_date, last_date FROM student_totals ORDER BY name')
+        students = [{'name': n, 'days_present': days, 'marks': marks, 'first_date': first, 'last_date': last,
+                     'percentage': round(100.0 * days / class_days, 1) if class_days else 0.0}
+                    for n, days, marks, first, last in cur]
+        return class_days, students
+
+    def daily_report(self, date_from=None, date_to=None):
+        """Per day: distinct students present and total marks."""
+        self.flush()
+        clauses, params = _filters(None, date_from, date_to)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        cur = self._conn().execute(f'SELECT date, students, marks FROM daily_counts{where} ORDER BY date', params)
+        return [{'date': d, 'students': n, 'marks': m} for d, n, m in cur]
+
+    def lecture_report(self, date_from=None, date_to=None):
+        """Per lecture (date + ``lecture_minutes`` slot): distinct students and marks."""
+        self.flush()
+        clauses, params = _filters(None, date_from, date_to)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        cur = self._conn().execute(
+            f'SELECT date, slot, students, marks FROM lecture_counts{where} ORDER BY date, slot', params)
+        return [{'date': d, 'lecture': slot_label(slot, self.lecture_minutes), 'students': n, 'marks': m}
+                for d, slot, n, m in cur]
+
+    # --- legacy CSV import ----------------------------------------------------
+
+    def import_csv(self, csv_path: str, force: bool = False) -> int:
+        """Import the legacy append-only CSV once. A marker in the ``meta`` table
+        stops later runs from importing it again unless ``force`` is set.
+        Returns the number of rows imported."""
+        if not os.path.exists(csv_path):
+            return 0
+        conn = self._conn()
+        key = 'imported:' + os.path.abspath(csv_path)
+        if not force and conn.execute('SELECT 1 FROM meta WHERE key = ?', (key,)).fetchone():
+            return 0
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            rows = [row for row in map(parse_csv_line, f) if row]
+        self.flush()
+        with conn:
+            conn.executemany('INSERT INTO attendance (name, date, time) VALUES (?, ?, ?)', rows)
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                         (key, datetime.now().isoformat(timespec='seconds')))
+        return len(rows)
+
+
+class PresenceIndex:
+    """Who has been marked present today, for duplicate suppression.
+
+    ``claim`` splits a list of names into those to record now and those already
+    marked. With ``ttl`` 0 a student is marked once per day; otherwise they can
+    be marked again ``ttl`` seconds after their previous mark (e.g. once per
+    lecture). Only today's marks are kept; the index resets at midnight.
+    """
+
+    def __init__(self, ttl: float = 0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._date = None
+        self._last = {}   # name -> datetime of the last recorded mark today
+
+    def rebuild(self, store: AttendanceStore, now: datetime = None):
+        """Load today's marks from ``store`` (one indexed query)."""
+        date = str((now or datetime.now()).date())
+        marks = store.latest_marks(date)
+        with self._lock:
+            self._date, self._last = date, marks
+        return len(marks)
+
+    def claim(self, names, now: datetime = None):
+        """-> (fresh, already): names to record now, and names marked within the
+        TTL (or earlier today). Fresh names count as marked from here on."""
+        now = now or datetime.now()
+        date = str(now.date())
+        fresh, already = [], []
+        with self._lock:
+            if date != self._date:
+                self._date, self._last = date, {}
+            for name in names:
+                last = self._last.get(name)
+                if last is not None and (not self.ttl or (now - last).total_seconds() < self.ttl):
+                    already.append(name)
+                else:
+                    self._last[name] = now
+                    fresh.append(name)
+        return fresh, already
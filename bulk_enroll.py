@@ -0,0 +1,255 @@
+"""Bulk enrollment: import a whole intake of students as one background job.
+
+A job takes a zip archive or a directory on the server, laid out like the
+images directory:
+
+    <student>.jpg              one photo
+    <student>/<anything>.jpg   several photos of one student
+
+A single folder wrapping everything (as zip tools often add) is skipped. The
+photos are encoded in parallel in ``workers`` processes. Photos that are
+unreadable, or that show no face or several faces, are reported as failures.
+The accepted photos are then handed to ``publish`` in one call, so the gallery
+is published once for the whole intake, not once per student. Jobs run one at
+a time. Their progress (counts, failures, images per second) is kept in
+memory for the status endpoint.
+"""
+import itertools
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+# failures listed per job (the count keeps going)
+MAX_FAILURES_LISTED = 500
+# finished jobs kept for the status endpoint
+KEEP_JOBS = 20
+
+
+class JobRunning(Exception):
+    """Another bulk enrollment is still in progress."""
+
+
+def _is_image(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS and not os.path.basename(name).startswith('.')
+
+
+def collect_photos(root):
+    """{student: [photo paths]} for a directory laid out like the images directory."""
+    entries = [e for e in os.listdir(root) if not e.startswith('.') and e != '__MACOSX']
+    if len(entries) == 1 and os.path.isdir(os.path.join(root, entries[0])):
+        inner = os.path.join(root, entries[0])
+        # a wrapper folder holds students, a student folder holds only photos
+        if any(os.path.isdir(os.path.join(inner, e)) for e in os.listdir(inner)):
+            root = inner
+    students = {}
+    for entry in sorted(os.listdir(root)):
+        path = os.path.join(root, entry)
+        if os.path.isdir(path) and not entry.startswith('.') and entry != '__MACOSX':
+            photos = [os.path.join(path, f) for f in sorted(os.listdir(path))
+                      if _is_image(f) and os.path.isfile(os.path.join(path, f))]
+            if photos:
+                students.setdefault(entry, []).extend(photos)
+        elif os.path.isfile(path) and _is_image(entry):
+            students.setdefault(os.path.splitext(entry)[0], []).append(path)
+    return students
+
+
+def extract_zip(archive, dest, max_files, max_bytes):
+    """Extract the image members of ``archive`` into ``dest``. Members with
+    absolute or '..' paths are skipped; ValueError if the archive holds more
+    than ``max_files`` images or ``max_bytes`` uncompressed."""
+    with zipfile.ZipFile(archive) as zf:
+        members = [m for m in zf.infolist() if not m.is_dir() and _is_image(m.filename)]
+        if len(members) > max_files:
+            raise ValueError(f'Archive has {len(members)} images, at most {max_files} allowed')
+        if sum(m.file_size for m in members) > max_bytes:
+            raise ValueError(f'Archive is larger than {max_bytes // 2 ** 20} MB uncompressed')
+        root = os.path.realpath(dest)
+        for m in members:
+            target = os.path.realpath(os.path.join(dest, m.filename))
+            if not target.startswith(root + os.sep):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zf.open(m) as src, open(target, 'wb') as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+
+
+class EnrollmentJob:
+    def __init__(self, job_id, source, append=False):
+        self.id = job_id
+        self.source = source
+        self.append = append
+        self.status = 'queued'   # queued, extracting, encoding, publishing, done, failed
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self.failures = []       # [{'student', 'file', 'error'}], first MAX_FAILURES_LISTED
+        self.students = 0        # students enrolled
+        self.photos = 0          # photos accepted
+        self.error = None
+        self.created = time.time()
+        self.encode_started = None
+        self.encode_seconds = None
+        self.finished = None
+
+    def fail(self, student, filename, error):
+        self.failed += 1
+        if len(self.failures) < MAX_FAILURES_LISTED:
+            self.failures.append({'student': student, 'file': filename, 'error': error})
+
+    def as_dict(self):
+        if self.encode_seconds is not None:
+            elapsed = self.encode_seconds
+        elif self.encode_started is not None:
+            elapsed = time.monotonic() - self.encode_started
+        else:
+            elapsed = 0.0
+        return {'id': self.id, 'source': self.source, 'mode': 'append' if self.append else 'replace',
+                'status': self.status,
+                'total': self.total, 'processed': self.processed, 'failed': self.failed,
+                'progress': round(self.processed / self.total, 3) if self.total else 0.0,
+                'images_per_second': round(self.processed / elapsed, 1) if elapsed else None,
+                'students': self.students, 'photos': self.photos, 'error': self.error,
+                'failures': list(self.failures),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.created)),
+                'seconds': round((self.finished or time.time()) - self.created, 2)}
+
+
+class BulkEnroller:
+    """Runs enrollment jobs in a background thread.
+
+    ``encode(path, settings)`` is a picklable module-level function returning
+    (vector, error) per photo. It runs in 'spawn' worker processes, so it
+    should live in a module that is cheap to import (the app passes
+    face_pipeline.encode_enrollment). The workers also re-import the main
+    script, which must not start the app there (see app.init_app).
+    ``publish(photos, vectors, move, append)``
+    stores the accepted photos ({student: [paths]}, with ``vectors``
+    {path: vector}) and publishes the gallery once. It returns the number of
+    students enrolled. ``move`` says whether the files may be moved (extracted
+    archives) or must be copied (a server directory); ``append`` whether they
+    are added to the students' existing photos rather than replacing them."""
+
+    def __init__(self, encode, settings, publish, staging_dir, workers=0,
+                 max_files=10000, max_bytes=2 * 2 ** 30):
+        self.encode = encode
+        self.settings = settings
+        self.publish = publish
+        self.staging_dir = staging_dir
+        self.workers = workers
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._running = None
+
+    def _new_job(self, source, append):
+        with self._lock:
+            if self._running is not None:
+                raise JobRunning()
+            job = EnrollmentJob(f'{int(time.time())}-{next(self._ids)}', source, append)
+            self._running = job
+            self.jobs[job.id] = job
+            for old in [j for j in self.jobs.values() if j.finished][:-KEEP_JOBS]:
+                del self.jobs[old.id]
+        return job
+
+    def start_archive(self, save_to, append=False):
+        """Start a job for an uploaded zip; ``save_to(path)`` writes the upload."""
+        job = self._new_job('archive', append)
+        staging = os.path.join(self.staging_dir, job.id)
+        try:
+            os.makedirs(staging, exist_ok=True)
+            archive = os.path.join(staging, 'upload.zip')
+            save_to(archive)
+        except Exception:
+            self._finish(job, staging)
+            raise
+        threading.Thread(target=self._run, args=(job, archive, staging), name=f'enroll-{job.id}', daemon=True).start()
+        return job
+
+    def start_directory(self, directory, append=False):
+        job = self._new_job(f'directory:{directory}', append)
+        threading.Thread(target=self._run, args=(job, None, directory), name=f'enroll-{job.id}', daemon=True).start()
+        return job
+
+    def _finish(self, job, staging=None):
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+        job.finished = time.time()
+        with self._lock:
+            self._running = None
+
+    def _run(self, job, archive, root):
+        try:
+            if archive is not None:
+                job.status = 'extracting'
+                extract_zip(archive, os.path.join(root, 'photos'), self.max_files, self.max_bytes)
+                os.remove(archive)
+                photos = collect_photos(os.path.join(root, 'photos'))
+            else:
+                photos = collect_photos(root)
+            job.total = sum(len(paths) for paths in photos.values())
+            if job.total > self.max_files:
+                raise ValueError(f'{job.total} images found, at most {self.max_files} allowed')
+
+            job.status = 'encoding'
+            job.encode_started = time.monotonic()
+            vectors = {}
+            student_of = {path: name for name, paths in photos.items() for path in paths}
+            for path, (vector, error) in self._encode_all(list(student_of)):
+                job.processed += 1
+                if vector is None:
+                    job.fail(student_of[path], os.path.basename(path), error)
+                else:
+                    vectors[path] = vector
+            job.encode_seconds = time.monotonic() - job.encode_started
+
+            accepted = {name: [p for p in paths if p in vectors] for name, paths in photos.items()}
+            accepted = {name: paths for name, paths in accepted.items() if paths}
+            job.photos = sum(len(paths) for paths in accepted.values())
+            job.status = 'publishing'
+            job.students = self.publish(accepted, vectors, archive is not None, job.append) if accepted else 0
+            job.status = 'done'
+            print(f'[INFO] Bulk enrollment {job.id}: {job.students} student(s), {job.photos} photo(s), '
+                  f'{job.failed} failure(s)')
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            print(f'Bulk enrollment {job.id} failed: {e}')
+        finally:
+            self._finish(job, root if archive is not None else None)
+
+    def _encode_all(self, paths):
+        """Yield (path, (vector, error)) as photos finish encoding."""
+        if self.workers <= 0 or len(paths) < 2:
+            for path in paths:
+                yield path, self._encode_one(path)
+            return
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(paths)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(self.encode, path, self.settings): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = (None, f'Encoding failed: {e}')
+                yield futures[future], result
+
+    def _encode_one(self, path):
+        try:
+            return self.encode(path, self.settings)
+        except Exception as e:
+            return None, f'Encoding failed: {e}'
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def recent(self):
+        return sorted(self.jobs.values(), key=lambda j: j.created, reverse=True)
@@ -0,0 +1,105 @@
+"""Process-pool recognition engine.
+
+Face detection and encoding are CPU-bound dlib calls that hold the GIL, so
+running them in Flask request threads serialises a burst of verifications.
+``RecognitionEngine`` runs them in a pool of worker processes instead; each
+worker imports face_recognition (and loads the dlib models) once, when it
+starts.
+
+Submissions are bounded: at most ``max_pending`` jobs may be queued or running.
+When that is reached, ``run`` raises ``EngineBusy`` straight away, or after
+``wait`` seconds, so the web layer can answer 503 at once instead of letting
+requests pile up. Each job also has a deadline, after which ``EngineTimeout``
+is raised.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+
+class EngineBusy(Exception):
+    """All submission slots are taken."""
+
+
+class EngineTimeout(Exception):
+    """The job did not finish before its deadline."""
+
+
+def _warm_up(face_recognition_available):
+    # load the dlib models once per worker, not per request
+    if face_recognition_available:
+        import face_recognition  # noqa: F401
+    else:
+        import imagehash  # noqa: F401
+    import face_pipeline  # noqa: F401
+
+
+class RecognitionEngine:
+    def __init__(self, workers: int, max_pending: int = 0, timeout: float = 10.0,
+                 face_recognition_available: bool = True):
+        self.workers = workers
+        self.max_pending = max_pending or workers * 4
+        self.timeout = timeout
+        self.face_recognition_available = face_recognition_available
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _executor(self):
+        # started lazily so importing the app never forks/spawns processes
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_warm_up,
+                        initargs=(self.face_recognition_available,),
+                    )
+        return self._pool
+
+    def _release(self, _future):
+        with self._stats_lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def run(self, fn, *args, wait: float = 0.0, timeout: float = None):
+        """Run ``fn(*args)`` in a worker and return its result.
+
+        ``fn`` must be a picklable module-level function. Waits at most ``wait``
+        seconds for a free slot (EngineBusy otherwise), then ``timeout`` seconds
+        (default: the engine's) for the result (EngineTimeout otherwise). The
+        two are separate budgets: time spent waiting for a slot does not eat
+        into the job's own deadline."""
+        acquired = self._slots.acquire(timeout=wait) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._stats_lock:
+                self.rejected += 1
+            raise EngineBusy()
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._stats_lock:
+            self.pending += 1
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        # the slot is freed when the worker is done, even if the caller gave up
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            future.cancel()
+            with self._stats_lock:
+                self.timed_out += 1
+            raise EngineTimeout()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
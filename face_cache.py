@@ -0,0 +1,145 @@
+"""Persistent on-disk cache of per-image face encodings / perceptual hashes.
+
+Vectors live in a compact ``.npz`` file and a small JSON index maps each image
+(path relative to the images directory) to its row, together with the file's
+size, mtime and content hash. On a warm start only a ``stat`` per image is
+needed; the content hash is only computed when size/mtime changed, so touched
+or renamed files are not re-encoded either.
+"""
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+CACHE_VERSION = 2
+
+
+def file_digest(path: str) -> str:
+    """sha1 of a file's content, read in chunks."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class EncodingCache:
+    """Cache of one vector (or a negative "no face" result) per image file.
+
+    ``kind`` separates incompatible vector types ('face' encodings vs 'phash')
+    so switching matchers never reuses the wrong data.
+    """
+
+    def __init__(self, cache_dir: str, kind: str, root: str):
+        self.cache_dir = cache_dir
+        self.kind = kind
+        self.root = root
+        self.index_path = os.path.join(cache_dir, f'{kind}_index.json')
+        self.data_path = os.path.join(cache_dir, f'{kind}_vectors.npz')
+        self.entries = {}   # relpath -> {'size', 'mtime_ns', 'sha1', 'vector' (np.array or None)}
+        self.by_sha1 = {}   # content hash -> entry, to reuse encodings of renamed/copied files
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def _rel(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def load(self):
+        """Read index + vectors from disk; a missing or corrupt cache just starts empty."""
+        self.entries = {}
+        self.by_sha1 = {}
+        self.hits = self.misses = 0
+        if not (os.path.exists(self.index_path) and os.path.exists(self.data_path)):
+            return self
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != CACHE_VERSION or index.get('kind') != self.kind:
+                return self
+            with np.load(self.data_path) as npz:
+                vectors = npz['vectors']
+                generation = int(npz['generation'])
+            if generation != index.get('generation'):
+                # crashed between the two writes; rows no longer line up
+                return self
+            for rel, meta in index.get('files', {}).items():
+                row = meta.get('row', -1)
+                self.entries[rel] = {
+                    'size': meta['size'],
+                    'mtime_ns': meta['mtime_ns'],
+                    'sha1': meta['sha1'],
+                    'vector': vectors[row] if row >= 0 else None,
+                }
+                self.by_sha1[meta['sha1']] = self.entries[rel]
+        except Exception as e:
+            print(f'Ignoring unreadable encoding cache {self.index_path}: {e}')
+            self.entries = {}
+            self.by_sha1 = {}
+        return self
+
+    def get(self, path: str, compute):
+        """Return the cached vector for ``path`` or call ``compute(path)`` and store it.
+
+        ``compute`` may return None (e.g. no face found); that result is cached too
+        so unusable photos are not re-decoded on every start.
+        """
+        rel = self._rel(path)
+        st = os.stat(path)
+        entry = self.entries.get(rel)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            self.hits += 1
+            return entry['vector']
+
+        digest = file_digest(path)
+        # same content under this or another name (touched, renamed or copied file)
+        reuse = self.by_sha1.get(digest)
+        if reuse is not None:
+            self.hits += 1
+            vector = reuse['vector']
+        else:
+            vector = compute(path)
+            self.misses += 1
+        self.entries[rel] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': digest, 'vector': vector}
+        self.by_sha1[digest] = self.entries[rel]
+        self.dirty = True
+        return vector
+
+    def forget(self, path: str):
+        if self.entries.pop(self._rel(path), None) is not None:
+            self.dirty = True
+
+    def prune(self, live_paths):
+        """Drop entries for files that no longer exist."""
+        live = {self._rel(p) for p in live_paths}
+        for rel in [r for r in self.entries if r not in live]:
+            del self.entries[rel]
+            self.dirty = True
+
+    def save(self):
+        """Write index + vectors atomically (temp file + rename). No-op when unchanged."""
+        if not self.dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = {}
+        rows = []
+        for rel, e in self.entries.items():
+            row = -1
+            if e['vector'] is not None:
+                row = len(rows)
+                rows.append(np.asarray(e['vector']))
+            files[rel] = {'size': e['size'], 'mtime_ns': e['mtime_ns'], 'sha1': e['sha1'], 'row': row}
+        vectors = np.stack(rows) if rows else np.zeros((0,))
+        generation = time.time_ns()
+        try:
+            tmp_data = self.data_path + '.tmp.npz'
+            np.savez(tmp_data, vectors=vectors, generation=np.int64(generation))
+            os.replace(tmp_data, self.data_path)
+            tmp_index = self.index_path + '.tmp'
+            with open(tmp_index, 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_VERSION, 'kind': self.kind, 'generation': generation, 'files': files}, f)
+            os.replace(tmp_index, self.index_path)
+            self.dirty = False
+        except Exception as e:
+            print(f'Failed to save encoding cache: {e}')
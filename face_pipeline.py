@@ -0,0 +1,173 @@
+"""Decode -> detect -> encode pipeline for verification snapshots.
+
+Webcam snapshots arrive as 1280x720 JPEGs, but neither step needs that much:
+
+* decode: JPEGs are decoded in PIL draft mode, which downscales by 1/2, 1/4 or
+  1/8 inside the DCT, so pixels that would be thrown away are never produced;
+* detect: the HOG detector runs on a copy no wider than ``detect_width``
+  (the desktop script does the same with ``fx=0.25``) and the boxes are scaled
+  back up;
+* encode: only a crop around each face is passed to the encoder, shrunk so the
+  face is at most ``max_face`` pixels wide (dlib aligns faces to a 150px chip).
+
+``analyze`` runs all three for one upload and records how long each stage
+took (``StageTimer``). It only takes picklable arguments, so the recognition
+engine can run it in a worker process.
+"""
+import io
+import math
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image as PILImage
+
+# The phash fallback hashes a decode no larger than PHASH_DECODE_SIDE px, for
+# uploads and enrollment photos alike, so the same picture always gets the same
+# hash. The encoding cache kind names the size: changing it re-hashes the gallery.
+PHASH_DECODE_SIDE = 256
+PHASH_CACHE_KIND = f'phash{PHASH_DECODE_SIDE}'
+
+
+class StageTimer:
+    """Accumulates wall time per named stage, in milliseconds."""
+
+    def __init__(self):
+        self.ms = {}
+
+    @contextmanager
+    def __call__(self, stage):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.ms[stage] = self.ms.get(stage, 0.0) + (time.perf_counter() - t) * 1000.0
+
+    def rounded(self):
+        return {k: round(v, 2) for k, v in self.ms.items()}
+
+
+def decode_image(file_bytes, max_side: int = 0):
+    """Bytes -> (RGB PIL image whose longer side is at most ``max_side``, scale
+    relative to the original). ``max_side`` 0 decodes at full size.
+
+    JPEGs are downscaled while decoding (draft mode); anything still too large
+    is resized afterwards."""
+    pil = PILImage.open(io.BytesIO(file_bytes))
+    original_width = pil.width
+    if max_side and max(pil.size) > max_side:
+        scale = max_side / max(pil.size)
+        if pil.format == 'JPEG':
+            pil.draft('RGB', (math.ceil(pil.width * scale), math.ceil(pil.height * scale)))
+        pil = pil.convert('RGB')
+        if max(pil.size) > max_side:
+            pil.thumbnail((max_side, max_side), PILImage.BILINEAR)
+    else:
+        pil = pil.convert('RGB')
+    return pil, pil.width / original_width
+
+
+def phash_code(pil):
+    """Perceptual hash of a decoded image, packed into one uint64."""
+    import imagehash
+    from hash_index import pack_phash
+    return pack_phash(imagehash.phash(pil).hash)
+
+
+def _resize(rgb, scale):
+    h, w = rgb.shape[:2]
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return np.asarray(PILImage.fromarray(rgb).resize(size, PILImage.BILINEAR))
+
+
+def detect_faces(rgb, detect_width: int = 0, upsample: int = 1):
+    """Face boxes (top, right, bottom, left) in ``rgb`` coordinates, detected on a
+    copy downscaled to ``detect_width`` pixels wide."""
+    import face_recognition
+    h, w = rgb.shape[:2]
+    scale = detect_width / w if detect_width and w > detect_width else 1.0
+    small = _resize(rgb, scale) if scale < 1.0 else rgb
+    boxes = face_recognition.face_locations(small, number_of_times_to_upsample=upsample)
+    if scale == 1.0:
+        return boxes
+    inv = 1.0 / scale
+    return [(max(0, int(t * inv)), min(w, int(math.ceil(r * inv))), min(h, int(math.ceil(b * inv))), max(0, int(l * inv)))
+            for t, r, b, l in boxes]
+
+
+def encode_faces(rgb, boxes, max_face: int = 0, margin: float = 0.25):
+    """One 128-d encoding per box, computed on a crop around the face (with
+    ``margin`` of the box size on each side) shrunk so the face is at most
+    ``max_face`` pixels wide."""
+    import face_recognition
+    h, w = rgb.shape[:2]
+    encodings = []
+    for t, r, b, l in boxes:
+        mh, mw = int((b - t) * margin), int((r - l) * margin)
+        ct, cl = max(0, t - mh), max(0, l - mw)
+        crop = rgb[ct:min(h, b + mh), cl:min(w, r + mw)]
+        box = (t - ct, r - cl, b - ct, l - cl)
+        if max_face and (r - l) > max_face:
+            scale = max_face / (r - l)
+            crop = _resize(np.ascontiguousarray(crop), scale)
+            box = tuple(int(round(v * scale)) for v in box)
+        encodings.append(face_recognition.face_encodings(np.ascontiguousarray(crop), [box])[0])
+    return encodings
+
+
+def analyze(file_bytes, settings, all_faces=False):
+    """Decode, detect and encode one upload.
+
+    ``settings``: face_recognition (bool), decode_max_side, detect_width,
+    encode_max_face, phash_decode_side. Returns a dict with ``encodings`` (one
+    vector per face, first face only unless ``all_faces``; the packed phash in
+    the fallback), ``boxes`` (top, right, bottom, left in upload pixels; None in
+    the fallback) and ``timings_ms``. Raises ValueError if the image can't be
+    decoded."""
+    timer = StageTimer()
+    face_mode = settings['face_recognition']
+    with timer('decode'):
+        try:
+            pil, scale = decode_image(file_bytes, settings['decode_max_side'] if face_mode
+                                      else settings['phash_decode_side'])
+        except Exception as e:
+            raise ValueError('Invalid image') from e
+    if not face_mode:
+        with timer('encode'):
+            code = phash_code(pil)
+        return {'encodings': [code], 'boxes': None, 'timings_ms': timer.ms}
+    rgb = np.asarray(pil)
+    with timer('detect'):
+        boxes = detect_faces(rgb, settings['detect_width'])
+    if not all_faces:
+        boxes = boxes[:1]
+    with timer('encode'):
+        encodings = encode_faces(rgb, boxes, settings['encode_max_face'])
+    boxes = [tuple(int(round(v / scale)) for v in box) for box in boxes]
+    return {'encodings': encodings, 'boxes': boxes, 'timings_ms': timer.ms}
+
+
+def encode_enrollment(path, settings):
+    """Gallery vector for one enrollment photo file (bulk imports; runs in worker
+    processes): (vector, None), or (None, error) for unreadable photos and for
+    photos without exactly one face. Detected and encoded at full resolution,
+    like a single enrollment (face_recognition.face_encodings on the whole
+    photo), so both paths give the same vector for the same file. The phash
+    fallback cannot see faces and accepts any readable image; it is hashed from
+    the same ``phash_decode_side`` decode as uploads."""
+    try:
+        if not settings['face_recognition']:
+            with open(path, 'rb') as f:
+                pil, _ = decode_image(f.read(), settings['phash_decode_side'])
+            return np.array([phash_code(pil)], dtype=np.uint64), None
+        pil = PILImage.open(path).convert('RGB')
+    except Exception:
+        return None, 'Invalid image'
+    import face_recognition
+    rgb = np.asarray(pil)
+    boxes = detect_faces(rgb)
+    if not boxes:
+        return None, 'No face found'
+    if len(boxes) > 1:
+        return None, f'{len(boxes)} faces found'
+    return face_recognition.face_encodings(rgb, boxes)[0], None
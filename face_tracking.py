@@ -0,0 +1,123 @@
+"""Face tracking for live video streams.
+
+In a continuous camera feed the same few faces appear in frame after frame,
+so encoding every face in every frame (what /api/verify would do) wastes
+nearly all of its CPU on faces that were already identified. ``FaceTracker``
+associates each frame's detections with the previous frame's tracks by box
+overlap (IoU). It only asks for encodings when:
+
+* a detection starts a new track,
+* an unidentified track has gone ``retry_every`` frames without one,
+* an identified track has gone ``reverify_every`` frames without one (someone
+  else may have stepped into the same spot), or
+* a track's box jumped (IoU below ``stable_iou``), so it may be a different
+  face now.
+
+Everything else reuses the track's identity. ``Track.marked`` lets the caller
+record attendance once per track instead of once per frame.
+"""
+import itertools
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    if not inter:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    __slots__ = ('id', 'box', 'name', 'distance', 'match', 'age', 'missed', 'since_identify', 'marked')
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.name = 'Unknown'
+        self.distance = None
+        self.match = False
+        self.age = 0             # frames since the track started
+        self.missed = 0          # consecutive detection frames without a matching box
+        self.since_identify = 0  # detection frames since the last encoding
+        self.marked = False      # attendance already recorded for this track
+
+    def as_dict(self, scale=1.0):
+        top, right, bottom, left = (int(round(v / scale)) for v in self.box)
+        return {'track': self.id, 'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left},
+                'name': self.name, 'match': self.match, 'distance': self.distance}
+
+
+class FaceTracker:
+    """Per-stream tracker.
+
+    ``update(boxes, identify)`` takes this frame's face boxes and a callable
+    that maps a list of boxes to one (name, distance, match) per box. It is
+    called only for the boxes that need encoding.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, stable_iou: float = 0.5, max_missed: int = 5,
+                 retry_every: int = 5, reverify_every: int = 15):
+        self.iou_threshold = iou_threshold
+        self.stable_iou = stable_iou
+        self.max_missed = max_missed
+        self.retry_every = retry_every
+        self.reverify_every = reverify_every
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self.frames = 0
+        self.faces = 0       # detections seen
+        self.encoded = 0     # encodings actually computed
+
+    def update(self, boxes, identify):
+        self.frames += 1
+        self.faces += len(boxes)
+        # greedy association, best overlap first
+        pairs = sorted(((iou(t.box, b), ti, bi) for ti, t in enumerate(self.tracks) for bi, b in enumerate(boxes)),
+                       reverse=True)
+        track_of, used = {}, set()
+        for overlap, ti, bi in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if ti in used or bi in track_of:
+                continue
+            track_of[bi] = (ti, overlap)
+            used.add(ti)
+
+        todo = []   # tracks needing an encoding
+        for ti, t in enumerate(self.tracks):
+            if ti not in used:
+                t.missed += 1
+        for bi, box in enumerate(boxes):
+            if bi in track_of:
+                ti, overlap = track_of[bi]
+                t = self.tracks[ti]
+                t.box, t.missed = box, 0
+                t.age += 1
+                t.since_identify += 1
+                due = self.reverify_every if t.match else self.retry_every
+                if overlap < self.stable_iou or t.since_identify >= due:
+                    todo.append(t)
+            else:
+                t = Track(next(self._ids), box)
+                self.tracks.append(t)
+                todo.append(t)
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+
+        if todo:
+            self.encoded += len(todo)
+            for t, (name, distance, match) in zip(todo, identify([t.box for t in todo])):
+                name = name if match else 'Unknown'
+                if name != t.name:
+                    # someone else holds the track now (or it lost or gained
+                    # its match): attendance is due again for whoever it is
+                    t.marked = False
+                t.name, t.distance, t.match = name, distance, bool(match)
+                t.since_identify = 0
+        return [t for t in self.tracks if t.missed == 0]
+
+    def stats(self):
+        return {'frames': self.frames, 'faces': self.faces, 'encoded': self.encoded}
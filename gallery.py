@@ -0,0 +1,613 @@
+"""In-memory gallery of enrolled students.
+
+Vectors are kept in one preallocated contiguous matrix (float32 N x 128 for
+face encodings) with precomputed squared norms and a parallel names array, so
+matching is a single BLAS matrix-vector product instead of a Python loop.
+Perceptual hashes (the no-dlib fallback) are stored as one packed uint64 per
+row and compared with a vectorized XOR + popcount.
+
+The gallery is published as an immutable snapshot: readers grab
+``gallery.snapshot`` once and only look at rows ``[0, count)``. Appending a new
+student writes the row past ``count`` and then publishes a snapshot with
+``count + 1``; replacing or removing a student copies the buffers first. Either
+way concurrent readers (``/api/verify``) see the old or the new gallery, never
+a half-built one, and only the affected entry is ever encoded.
+
+A student may have several enrollment photos (``<images>/<student>/*.jpg``).
+Their encodings are folded into one template row (mean or medoid), so matching
+stays one row per student. A few representative encodings can be kept besides
+the template. Only the closest ``RERANK_CANDIDATES`` students are then
+re-scored by their nearest representative.
+
+Face galleries can also keep a compact int8 copy of the rows (``quantize``),
+with one scale per column. The first matching pass reads only that copy, 4
+times fewer bytes per student. The best ``QUANT_CANDIDATES`` are then re-ranked
+with exact float32 distances, so reported distances, and the match threshold
+applied to them, are unchanged. The float32 rows themselves are then kept in a
+memory-mapped file (``rows_dir``, or the shared gallery's vectors.npy): only
+the few re-ranked rows are paged in per query.
+"""
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import nullcontext
+import numpy as np
+
+from hash_index import MultiIndexHash, hamming, popcount64
+
+MIN_CAPACITY = 64
+# max entries of one (queries x gallery) distance block in batch matching
+BATCH_CELLS = 1 << 22
+# hamming galleries at least this large get a multi-index hash for radius lookups;
+# below that the vectorized XOR + popcount scan is faster (~1 ms per 200k rows)
+INDEX_MIN_SIZE = 200000
+# students re-scored against their representative encodings per query
+RERANK_CANDIDATES = 5
+# compact row types for the first matching pass (Gallery(quantize=...)).
+# No float16: numpy widens it to float32 ~10x slower than it scans float32.
+QUANTIZED_DTYPES = {'int8': np.int8}
+# rows widened to float32 at a time in the quantized pass (~512 KB, stays in cache)
+QUANT_BLOCK = 1024
+# students re-ranked with exact float32 distances after a quantized pass
+QUANT_CANDIDATES = 16
+
+
+def _no_timer(_stage):
+    return nullcontext()
+
+
+def name_of(path: str, root: str = None) -> str:
+    """Student name for an image file: the folder name for photos in a student
+    folder under ``root``, otherwise the file name without extension."""
+    if root is not None:
+        parts = os.path.relpath(path, root).replace(os.sep, '/').split('/')
+        if len(parts) > 1:
+            return parts[0]
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def pairwise_distances(a, b, metric='l2'):
+    """(len(a), len(b)) distances between two sets of rows."""
+    if metric == 'hamming':
+        return popcount64(np.bitwise_xor(a[:, 0][:, None], b[:, 0][None, :]))
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    d2 = np.einsum('ij,ij->i', a, a)[:, None] - 2.0 * (a @ b.T) + np.einsum('ij,ij->i', b, b)[None, :]
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2)
+
+
+def aggregate(vectors, metric='l2', method='mean'):
+    """One template row for a student's encodings.
+
+    'mean' averages face encodings (for packed phashes: the per-bit majority);
+    'medoid' picks the encoding with the smallest total distance to the others,
+    which is robust to one bad photo."""
+    v = np.asarray(vectors)
+    if len(v) == 1:
+        return v[0]
+    if method == 'medoid':
+        return v[int(np.argmin(pairwise_distances(v, v, metric).sum(axis=1)))]
+    if metric == 'hamming':
+        bits = np.unpackbits(v[:, 0].astype('<u8').view(np.uint8).reshape(len(v), 8), axis=1)
+        majority = (bits.sum(axis=0, dtype=np.int64) * 2 > len(v)).astype(np.uint8)
+        return np.packbits(majority).view('<u8').astype(np.uint64)
+    return v.astype(np.float32).mean(axis=0)
+
+
+def representatives(vectors, template, metric='l2', count=3):
+    """Up to ``count`` of ``vectors`` that cover what the template does not:
+    farthest from the template first, then farthest from everything chosen so
+    far. None when there is nothing to add (a single photo, or ``count`` 0)."""
+    v = np.asarray(vectors)
+    if count <= 0 or len(v) < 2:
+        return None
+    chosen = []
+    nearest = pairwise_distances(v, np.asarray(template)[None, :], metric)[:, 0].astype(np.float64)
+    for _ in range(min(count, len(v))):
+        i = int(np.argmax(nearest))
+        if nearest[i] <= 0:
+            break
+        chosen.append(i)
+        nearest = np.minimum(nearest, pairwise_distances(v, v[i:i + 1], metric)[:, 0])
+    return v[chosen].copy() if chosen else None
+
+
+def is_mapped(array) -> bool:
+    """Whether ``array`` (or the array it views) lives in a memory-mapped file."""
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+def int8_scale(matrix):
+    """Per-column int8 scale: the largest |value| of each column maps to 127."""
+    scale = np.abs(np.asarray(matrix, dtype=np.float32)).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    return scale
+
+
+def quantize(rows, dtype, scale=None):
+    """Compact copy of float rows: int8 as round(value / ``scale``) clipped to
+    [-127, 127]."""
+    if np.dtype(dtype) != np.int8:
+        raise ValueError(f'unsupported quantized type {dtype}')
+    rows = np.asarray(rows, dtype=np.float32)
+    return np.clip(np.rint(rows / scale), -127, 127).astype(np.int8)
+
+
+def l2_distances(matrix, sqnorms, query):
+    """Euclidean distance from ``query`` to every row of ``matrix`` in one matrix
+    product: |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, clipped at 0 against rounding."""
+    q = np.asarray(query, dtype=np.float32)
+    d2 = sqnorms - 2.0 * (matrix @ q) + float(q @ q)
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2)
+
+
+def smallest_k(d, k: int):
+    """Indices of the ``k`` smallest values of ``d``, smallest first."""
+    k = max(1, min(int(k), len(d)))
+    idx = np.argpartition(d, k - 1)[:k] if k < len(d) else np.arange(len(d))
+    return idx[np.argsort(d[idx], kind='stable')]
+
+
+def assign_unique(candidate_lists, is_match):
+    """Resolve duplicate identities between faces of one frame.
+
+    ``candidate_lists`` holds each face's [(name, distance), ...] nearest first.
+    Pairs are taken greedily by increasing distance, so a name goes to the face
+    closest to it and the other face falls back to its next candidate (if that
+    still satisfies ``is_match``). Returns one (name, distance) or None per face.
+    """
+    pairs = sorted((d, f, n) for f, cands in enumerate(candidate_lists) for n, d in cands if is_match(d))
+    out = [None] * len(candidate_lists)
+    taken = set()
+    for d, f, n in pairs:
+        if out[f] is None and n not in taken:
+            out[f] = (n, d)
+            taken.add(n)
+    return out
+
+
+class Snapshot:
+    """Read-only view of the first ``count`` gallery rows."""
+
+    __slots__ = ('names', 'matrix', 'sqnorms', 'metric', 'index_min_size', '_index', 'ann', 'reps', 'codes', 'scale')
+
+    def __init__(self, names, matrix, sqnorms, metric='l2', index_min_size=INDEX_MIN_SIZE, ann=None, reps=None,
+                 codes=None, scale=None):
+        self.names = names      # np.ndarray of str (object), parallel to matrix rows
+        self.matrix = matrix    # (count, dim)
+        self.sqnorms = sqnorms  # (count,) float32, squared L2 norm of each row
+        self.metric = metric    # 'l2' (face encodings) or 'hamming' (packed phash, dim 1)
+        self.index_min_size = index_min_size
+        self._index = None      # MultiIndexHash, built on first radius lookup
+        self.ann = ann          # optional approximate index (ann_index.IVFIndex.view()) for top_k
+        self.reps = reps or {}  # name -> (r, dim) representative encodings besides the template
+        self.codes = codes      # optional (count, dim) int8 copy of matrix for the first pass
+        self.scale = scale      # (dim,) float32 per-column scale of int8 codes
+
+    def __len__(self):
+        return len(self.names)
+
+    def nbytes(self):
+        """(bytes the first matching pass reads, bytes held in memory) for the
+        whole snapshot; divide by len() for the cost per student. Held is what
+        the pass reads plus the other arrays, except float32 rows that a
+        quantized pass leaves in a memory-mapped file."""
+        reps = sum(r.nbytes for r in self.reps.values())
+        if self.codes is None:
+            scanned = self.matrix.nbytes + self.sqnorms.nbytes
+            return scanned, scanned + reps
+        scanned = self.codes.nbytes + self.sqnorms.nbytes
+        held = scanned + reps + (self.scale.nbytes if self.scale is not None else 0)
+        if not is_mapped(self.matrix):
+            held += self.matrix.nbytes
+        return scanned, held
+
+    def items(self):
+        return zip(self.names, self.matrix)
+
+    def distances(self, query):
+        """Distance from ``query`` to every row: L2 via one matrix product, or
+        Hamming via XOR + popcount over the packed hashes."""
+        if self.metric == 'hamming':
+            return hamming(self.matrix[:, 0], query)
+        return l2_distances(self.matrix, self.sqnorms, query)
+
+    def _approx_d2(self, queries):
+        """(len(queries), count) approximate squared L2 distances from the
+        int8 rows, widened to float32 QUANT_BLOCK rows at a time (about as fast
+        as a float32 scan, which reads 4 times more)."""
+        q = np.asarray(queries, dtype=np.float32)
+        qs = q * self.scale if self.scale is not None else q
+        dots = np.empty((len(q), len(self)), dtype=np.float32)
+        for start in range(0, len(self), QUANT_BLOCK):
+            block = self.codes[start:start + QUANT_BLOCK].astype(np.float32)
+            np.matmul(qs, block.T, out=dots[:, start:start + len(block)])
+        return self.sqnorms[None, :] - 2.0 * dots + np.einsum('ij,ij->i', q, q)[:, None]
+
+    def _exact_top(self, query, approx_d2, k):
+        """Re-rank the QUANT_CANDIDATES best rows of a quantized pass with exact
+        float32 distances: (rows, distances) of the closest ``k``. Only those
+        rows of the (possibly memory-mapped) matrix are read."""
+        idx = smallest_k(approx_d2, max(k, QUANT_CANDIDATES))
+        d = l2_distances(self.matrix[idx], self.sqnorms[idx], query)
+        order = smallest_k(d, k)
+        return idx[order], d[order]
+
+    def _rerank(self, query, found, k):
+        """Re-score candidates [(name, distance), ...] by their nearest
+        representative encoding (if closer than the template); best ``k``."""
+        if not self.reps:
+            return found[:k]
+        q = np.asarray(query, dtype=self.matrix.dtype).reshape(1, -1)
+        out = []
+        for name, d in found:
+            reps = self.reps.get(name)
+            if reps is not None:
+                d = min(d, pairwise_distances(reps, q, self.metric)[:, 0].min().item())
+            out.append((name, d))
+        out.sort(key=lambda item: item[1])
+        return out[:k]
+
+    def top_k(self, query, k: int = 1, exact: bool = False):
+        """Closest ``k`` students as a list of (name, distance), nearest first.
+
+        Uses the approximate index when one is attached and trained, unless
+        ``exact`` is set."""
+        if not len(self):
+            return []
+        wanted = max(k, RERANK_CANDIDATES) if self.reps else k
+        if not exact and self.ann is not None and self.ann.trained:
+            found = self.ann.search(query, wanted)
+            if found:
+                return self._rerank(query, found, k)
+        if self.codes is not None:
+            idx, d = self._exact_top(query, self._approx_d2(np.asarray(query).reshape(1, -1))[0], wanted)
+            return self._rerank(query, [(self.names[i], v.item()) for i, v in zip(idx, d)], k)
+        d = self.distances(query)
+        idx = smallest_k(d, wanted)
+        return self._rerank(query, [(self.names[i], d[i].item()) for i in idx], k)
+
+    def distances_many(self, queries):
+        """(len(queries), count) distance matrix: one GEMM for L2, one broadcast
+        XOR + popcount for Hamming."""
+        if self.metric == 'hamming':
+            codes = np.asarray(queries, dtype=np.uint64).reshape(-1)
+            return popcount64(np.bitwise_xor(codes[:, None], self.matrix[:, 0][None, :]))
+        q = np.asarray(queries, dtype=np.float32)
+        d2 = self.sqnorms[None, :] - 2.0 * (q @ self.matrix.T) + np.einsum('ij,ij->i', q, q)[:, None]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2)
+
+    def top_k_many(self, queries, k: int = 1, exact: bool = False):
+        """top_k for a batch of queries, as one list of candidates per query."""
+        if not len(self) or not len(queries):
+            return [[] for _ in range(len(queries))]
+        if not exact and self.ann is not None and self.ann.trained:
+            return [self.top_k(q, k) for q in queries]
+        wanted = max(k, RERANK_CANDIDATES) if self.reps else k
+        out = []
+        # keep each distance block around BATCH_CELLS entries
+        step = max(1, BATCH_CELLS // len(self))
+        for start in range(0, len(queries), step):
+            if self.codes is not None:
+                block = self._approx_d2(queries[start:start + step])
+                for q, d2 in zip(queries[start:start + step], block):
+                    idx, d = self._exact_top(q, d2, wanted)
+                    out.append(self._rerank(q, [(self.names[i], v.item()) for i, v in zip(idx, d)], k))
+                continue
+            block = self.distances_many(queries[start:start + step])
+            for q, d in zip(queries[start:start + step], block):
+                out.append(self._rerank(q, [(self.names[i], d[i].item()) for i in smallest_k(d, wanted)], k))
+        return out
+
+    def within(self, query, radius):
+        """Every row within ``radius`` of ``query`` as (name, distance), nearest first.
+
+        Hamming galleries of ``index_min_size`` rows or more answer this from a
+        multi-index hash instead of scanning every row."""
+        if self.metric == 'hamming' and self.index_min_size and len(self) >= self.index_min_size:
+            if self._index is None:
+                self._index = MultiIndexHash(self.matrix[:, 0])
+            rows, d = self._index.search(query, radius)
+        else:
+            d = self.distances(query)
+            rows = np.flatnonzero(d <= radius)
+            rows = rows[np.argsort(d[rows], kind='stable')]
+            d = d[rows]
+        found = [(self.names[i], v.item()) for i, v in zip(rows, d)]
+        return self._rerank(query, found, len(found)) if self.reps else found
+
+
+class Gallery:
+    """name -> vector store backed by a preallocated matrix.
+
+    ``cache`` is a face_cache.EncodingCache and ``encode(path)`` computes the raw
+    vector for an image (None if unusable). ``dim``/``dtype``/``metric`` describe
+    the rows: 128 float32 'l2' for face encodings, 1 uint64 'hamming' for phashes.
+    ``ann`` is an optional approximate index (ann_index.IVFIndex) kept in sync
+    with every update and used by Snapshot.top_k. Students with several photos
+    get one ``template`` row ('mean' or 'medoid') plus up to
+    ``representatives`` extra encodings. ``quantize`` ('int8', L2 galleries
+    only) keeps a compact copy of the rows for the first matching pass; the
+    float32 rows then go to a memory-mapped temporary file in ``rows_dir``
+    (when given) instead of staying in RAM.
+    """
+
+    def __init__(self, cache, encode, dim: int = 128, dtype=np.float32, metric='l2',
+                 index_min_size=INDEX_MIN_SIZE, ann=None, template='mean', representatives=3, quantize=None,
+                 rows_dir=None):
+        self.cache = cache
+        self.encode = encode
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.metric = metric
+        self.index_min_size = index_min_size
+        self.ann = ann
+        self.template = template
+        self.representatives = representatives
+        if quantize in (None, '', 'none') or metric != 'l2':
+            # packed phashes are 8 bytes per student already
+            self.qdtype = None
+        elif quantize in QUANTIZED_DTYPES:
+            self.qdtype = np.dtype(QUANTIZED_DTYPES[quantize])
+        else:
+            raise ValueError(f'unknown quantization {quantize!r}, expected one of {sorted(QUANTIZED_DTYPES)}')
+        self.rows_dir = rows_dir if self.qdtype is not None else None
+        self._scale = None   # per-column scale of int8 codes
+        self._lock = threading.Lock()
+        self._rows = {}   # name -> row; writer side only
+        self._reps = {}   # name -> representative encodings (students with several photos)
+        self._alloc(0)
+        self._publish(0)
+
+    def _alloc(self, count):
+        cap = max(MIN_CAPACITY, 1 << max(count - 1, 0).bit_length())
+        if self.rows_dir:
+            # an unlinked file: the mapping is all that is left of it, and pages
+            # are written back to disk instead of pinning RAM
+            os.makedirs(self.rows_dir, exist_ok=True)
+            with tempfile.TemporaryFile(dir=self.rows_dir) as f:
+                self._matrix = np.memmap(f, dtype=self.dtype, mode='w+', shape=(cap, self.dim))
+        else:
+            self._matrix = np.zeros((cap, self.dim), dtype=self.dtype)
+        self._sqnorms = np.zeros(cap, dtype=np.float32)
+        self._names = np.empty(cap, dtype=object)
+        self._codes = np.zeros((cap, self.dim), dtype=self.qdtype) if self.qdtype is not None else None
+
+    def _publish(self, count):
+        self._count = count
+        # single reference assignment: the swap readers observe
+        self.snapshot = Snapshot(self._names[:count], self._matrix[:count], self._sqnorms[:count],
+                                 self.metric, self.index_min_size,
+                                 self.ann.view() if self.ann is not None else None, dict(self._reps),
+                                 self._codes[:count] if self._codes is not None else None, self._scale)
+
+    def _quantize_rows(self, rows, count):
+        """Fill the compact copy of ``rows``. An int8 value beyond the current
+        scale rescales every row [0, count) into a new codes buffer (published
+        snapshots keep the old one)."""
+        if self._codes is None or not count:
+            return
+        v = self._matrix[rows].astype(np.float32)
+        if self.qdtype == np.int8 and (self._scale is None or np.any(np.abs(v) > self._scale * 127.0)):
+            self._scale = int8_scale(self._matrix[:count])
+            codes = np.zeros_like(self._codes)
+            codes[:count] = quantize(self._matrix[:count], self.qdtype, self._scale)
+            self._codes = codes
+        else:
+            self._codes[rows] = quantize(v, self.qdtype, self._scale)
+
+    def _template(self, name, vectors):
+        """Template row for ``name``'s encodings; keeps its representatives."""
+        template = aggregate(vectors, self.metric, self.template)
+        reps = representatives(vectors, template, self.metric, self.representatives)
+        if reps is not None:
+            self._reps[name] = reps.astype(self.dtype)
+        else:
+            self._reps.pop(name, None)
+        return template
+
+    def _set_row(self, row, name, vec):
+        v = np.asarray(vec, dtype=self.dtype)
+        self._matrix[row] = v
+        if self.metric == 'l2':
+            self._sqnorms[row] = float(np.dot(v.astype(np.float32), v.astype(np.float32)))
+        self._names[row] = name
+        self._rows[name] = row
+
+    def _copy_buffers(self, count, need=None):
+        """Move rows [0, count) into fresh buffers (sized for ``need`` rows) so
+        published snapshots stay untouched."""
+        old_m, old_n, old_s, old_c = self._matrix, self._names, self._sqnorms, self._codes
+        self._alloc(need or count)
+        self._matrix[:count] = old_m[:count]
+        self._names[:count] = old_n[:count]
+        self._sqnorms[:count] = old_s[:count]
+        if old_c is not None:
+            self._codes[:count] = old_c[:count]
+
+    def names(self):
+        return list(self.snapshot.names)
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def _vector(self, path, known=None):
+        """Cached vector for ``path``; ``known`` (already computed elsewhere, e.g.
+        by a bulk import) is stored instead of encoding the file."""
+        try:
+            return self.cache.get(path, self.encode if known is None else (lambda _path: known))
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+            return None
+
+    def load(self, paths, timer=None):
+        """Full rebuild from image files (served from the cache where possible).
+
+        ``timer`` (a face_pipeline.StageTimer) receives the time of each step."""
+        stage = timer or _no_timer
+        with self._lock:
+            with stage('cache_load'):
+                self.cache.load()
+            per_student = {}
+            with stage('scan'):
+                for path in sorted(paths):
+                    vec = self._vector(path)
+                    if vec is not None:
+                        per_student.setdefault(name_of(path, self.cache.root), []).append(vec)
+            with stage('cache_save'):
+                self.cache.prune(paths)
+                self.cache.save()
+            if self.cache.misses:
+                print(f'[INFO] Encoded {self.cache.misses} new/changed image(s), {self.cache.hits} from cache')
+            with stage('build'):
+                self._reps = {}
+                vectors = {name: self._template(name, vecs) for name, vecs in per_student.items()}
+                self._rows = {}
+                self._alloc(len(vectors))
+                for row, (name, vec) in enumerate(vectors.items()):
+                    self._set_row(row, name, vec)
+                self._scale = None
+                self._quantize_rows(np.arange(len(vectors)), len(vectors))
+                if self.ann is not None:
+                    self.ann.load()
+                    self.ann.build(self._names[:len(vectors)], self._matrix[:len(vectors)])
+                    self.ann.save()
+            self._publish(len(vectors))
+            return self.snapshot
+
+    def adopt(self, names, matrix, sqnorms, reindex: bool = True, reps=None, codes=None, scale=None):
+        """Publish rows owned elsewhere (e.g. read-only memory-mapped arrays of a
+        shared_gallery version) as the gallery without copying them. Capacity
+        equals the row count, so the next add/remove copies them into private
+        buffers before writing. ``reindex`` rebuilds the ANN index from them.
+        ``reps`` maps names to their representative encodings; ``codes`` and
+        ``scale`` are the quantized rows (computed here if not given)."""
+        with self._lock:
+            count = len(names)
+            self._names = np.asarray(names, dtype=object)
+            self._matrix = matrix
+            self._sqnorms = sqnorms
+            self._reps = dict(reps or {})
+            if self.qdtype is not None:
+                if codes is not None and codes.dtype == self.qdtype and len(codes) == count:
+                    self._codes, self._scale = codes, scale
+                elif count:
+                    self._scale = int8_scale(matrix) if self.qdtype == np.int8 else None
+                    self._codes = quantize(matrix, self.qdtype, self._scale)
+                else:
+                    self._scale = None
+                    self._codes = np.zeros((0, self.dim), dtype=self.qdtype)
+            self._rows = {name: row for row, name in enumerate(self._names)}
+            if self.ann is not None and reindex:
+                self.ann.load()
+                self.ann.build(self._names, self._matrix)
+            self._publish(count)
+            return self.snapshot
+
+    def add(self, name: str, paths, forget=()) -> bool:
+        """Encode a student's image(s) (one path or a list of all of them) and
+        publish their template under ``name``; ``forget`` lists replaced image
+        paths whose cache entries are dropped. False if no image has a usable
+        face, in which case any earlier row of ``name`` is removed."""
+        if isinstance(paths, str):
+            paths = [paths]
+        with self._lock:
+            for path in forget:
+                self.cache.forget(path)
+            vectors = [v for v in (self._vector(path) for path in paths) if v is not None]
+            self.cache.save()
+            if not vectors:
+                self._drop(name)
+                return False
+            vec = self._template(name, vectors)
+            count = self._count
+            row = self._rows.get(name)
+            if row is not None:
+                # re-enrollment: the row is visible to readers, so copy first
+                self._copy_buffers(count)
+            else:
+                row = count
+                count += 1
+                if count > len(self._matrix):
+                    self._copy_buffers(row, count)
+            self._set_row(row, name, vec)
+            self._quantize_rows([row], count)
+            if self.ann is not None:
+                if self.ann.trained and not self.ann.stale(count):
+                    self.ann.add(name, self._matrix[row])
+                else:
+                    self.ann.build(self._names[:count], self._matrix[:count])
+                self.ann.save()
+            self._publish(count)
+            return True
+
+    def add_many(self, students, known=None):
+        """Add or replace several students and publish once (bulk enrollment).
+
+        ``students`` maps name -> all of that student's image paths; ``known``
+        maps paths to vectors that were already computed, so those files are
+        not encoded again. Returns the names that got a row."""
+        known = known or {}
+        with self._lock:
+            count = self._count
+            # one copy for the whole batch; published snapshots stay untouched
+            self._copy_buffers(count, count + len(students))
+            added = []
+            for name, paths in students.items():
+                vectors = [v for v in (self._vector(p, known.get(p)) for p in paths) if v is not None]
+                if not vectors:
+                    continue
+                row = self._rows.get(name)
+                if row is None:
+                    row = count
+                    count += 1
+                self._set_row(row, name, self._template(name, vectors))
+                added.append(name)
+            self._quantize_rows([self._rows[name] for name in added], count)
+            self.cache.save()
+            if self.ann is not None and added:
+                self.ann.build(self._names[:count], self._matrix[:count])
+                self.ann.save()
+            self._publish(count)
+            return added
+
+    def remove(self, name: str, paths=()) -> bool:
+        """Drop ``name`` (and the cache entries for its image ``paths``)."""
+        with self._lock:
+            for path in paths:
+                self.cache.forget(path)
+            self.cache.save()
+            return self._drop(name)
+
+    def _drop(self, name):
+        """Remove ``name``'s row and publish; False if it has none (lock held)."""
+        row = self._rows.get(name)
+        if row is None:
+            return False
+        self._reps.pop(name, None)
+        count = self._count
+        self._copy_buffers(count)
+        last = count - 1
+        if row != last:
+            # move the last row into the hole (fresh buffers, so no reader sees it)
+            self._matrix[row] = self._matrix[last]
+            self._sqnorms[row] = self._sqnorms[last]
+            if self._codes is not None:
+                self._codes[row] = self._codes[last]
+            self._names[row] = self._names[last]
+            self._rows[self._names[row]] = row
+        self._names[last] = None
+        del self._rows[name]
+        if self.ann is not None and self.ann.trained:
+            self.ann.remove(name)
+            self.ann.save()
+        self._publish(last)
+        return True
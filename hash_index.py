@@ -0,0 +1,96 @@
+"""Packed 64-bit perceptual hashes and Hamming-distance search.
+
+Used by the no-dlib fallback: each phash (8x8 bits) is packed into one uint64
+so a whole gallery is a single array and distances are a vectorized XOR +
+popcount. For large galleries ``MultiIndexHash`` finds every hash within a
+small radius without scanning all rows.
+"""
+from itertools import combinations
+import numpy as np
+
+# byte -> number of set bits, for numpy versions without np.bitwise_count
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def pack_phash(bits) -> np.uint64:
+    """8x8 (or flat 64) boolean phash -> uint64, same bit order as str(ImageHash)."""
+    packed = np.packbits(np.asarray(bits, dtype=bool).reshape(-1))
+    return np.uint64(int.from_bytes(packed.tobytes(), 'big'))
+
+
+def popcount64(x):
+    """Number of set bits of every element of a uint64 array."""
+    x = np.asarray(x, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x).astype(np.int32)
+    return _POPCOUNT8[x.reshape(x.shape + (1,)).view(np.uint8)].sum(axis=-1, dtype=np.int32)
+
+
+def hamming(codes, query):
+    """Hamming distance from ``query`` (uint64) to every code."""
+    return popcount64(np.bitwise_xor(codes, np.uint64(query)))
+
+
+class MultiIndexHash:
+    """Multi-index hashing (Norouzi et al.) over 64-bit codes.
+
+    Codes are split into four 16-bit substrings. Any code within Hamming
+    radius ``r`` of the query agrees with it on at least one substring to within
+    ``r // chunks`` bits, so probing each substring's sorted table with all
+    values at that small distance yields a candidate set that is then verified
+    exactly. Lookups touch a tiny fraction of the gallery.
+    """
+
+    CHUNKS = 4
+    BITS = 16
+
+    def __init__(self, codes):
+        self.codes = np.asarray(codes, dtype=np.uint64)
+        self.tables = []
+        for c in range(self.CHUNKS):
+            sub = self._chunk(self.codes, c)
+            order = np.argsort(sub, kind='stable')
+            # bucket v holds order[offsets[v]:offsets[v + 1]]
+            offsets = np.searchsorted(sub[order], np.arange((1 << self.BITS) + 1))
+            self.tables.append((offsets, order))
+        self._masks = {}
+
+    def _chunk(self, codes, c):
+        return ((codes >> np.uint64(c * self.BITS)) & np.uint64(0xFFFF)).astype(np.uint16)
+
+    def _probe_masks(self, radius):
+        """All 16-bit masks with at most ``radius`` bits set."""
+        if radius not in self._masks:
+            masks = [0]
+            for k in range(1, radius + 1):
+                for bits in combinations(range(self.BITS), k):
+                    masks.append(sum(1 << b for b in bits))
+            self._masks[radius] = np.array(masks, dtype=np.uint16)
+        return self._masks[radius]
+
+    def candidates(self, query, radius):
+        """Row ids that may lie within ``radius`` (superset, unverified)."""
+        q = np.array([query], dtype=np.uint64)
+        masks = self._probe_masks(radius // self.CHUNKS)
+        found = []
+        for c, (offsets, order) in enumerate(self.tables):
+            probes = (self._chunk(q, c)[0] ^ masks).astype(np.intp)
+            lo = offsets[probes]
+            lens = offsets[probes + 1] - lo
+            # gather all [lo, lo + len) ranges in one shot
+            total = int(lens.sum())
+            if total:
+                starts = np.repeat(lo - np.cumsum(lens) + lens, lens)
+                found.append(order[starts + np.arange(total)])
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(found))
+
+    def search(self, query, radius):
+        """(row ids, distances) of every code within ``radius``, nearest first."""
+        rows = self.candidates(query, radius)
+        d = hamming(self.codes[rows], query)
+        keep = d <= radius
+        rows, d = rows[keep], d[keep]
+        order = np.argsort(d, kind='stable')
+        return rows[order], d[order]
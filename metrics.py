@@ -0,0 +1,204 @@
+"""In-process metrics in the Prometheus text format, plus sampled cProfile runs.
+
+``Registry`` holds counters, gauges and histograms (optionally labelled) and
+``render()`` produces the text served by /metrics:
+
+    REQUESTS = METRICS.counter('requests_total', 'Requests served', ('endpoint',))
+    REQUESTS.inc(endpoint='api_verify')
+
+Histograms use cumulative ``le`` buckets in seconds, as Prometheus expects, so
+percentiles can be computed server-side with histogram_quantile(). Gauges can
+take a callback that is evaluated at scrape time (e.g. the gallery size).
+
+``ProfileSampler`` runs cProfile on a random fraction of requests and writes
+each profile as a .prof file, to be opened with pstats or snakeviz.
+"""
+import cProfile
+import math
+import os
+import random
+import threading
+import time
+
+# request / stage latencies in seconds: 1 ms .. 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    value = float(value)
+    return repr(int(value)) if value.is_integer() else repr(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}   # label values tuple -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_labels(self.labelnames, key)} {_number(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        """``fn`` (unlabelled gauges only) is called at scrape time for the value."""
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.fn is not None:
+            try:
+                self.set(float(self.fn()))
+            except Exception as e:
+                print(f'Cannot read gauge {self.name}: {e}')
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # per-bucket (non-cumulative) counts, sum
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            running = 0
+            for bound, count in zip(self.buckets, counts):
+                running += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", _number(bound))])} {running}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {running}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        return self._add(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class ProfileSampler:
+    """Profile a random ``rate`` fraction of requests (0 disables) into
+    ``directory``, keeping the newest ``keep`` profiles.
+
+    Only one request is profiled at a time; cProfile cannot run in several
+    threads at once on newer Pythons, and one sample at a time is plenty."""
+
+    def __init__(self, rate: float, directory: str, keep: int = 100):
+        self.rate = max(0.0, min(float(rate), 1.0))
+        self.directory = directory
+        self.keep = keep
+        self._busy = threading.Lock()
+
+    def start(self):
+        """A running profiler for this request, or None if it is not sampled."""
+        if not self.rate or random.random() >= self.rate or not self._busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:   # another profiler is active
+            self._busy.release()
+            return None
+        return profiler
+
+    def stop(self, profiler, label: str):
+        """Stop ``profiler`` and write it as <directory>/<time>-<label>.prof."""
+        try:
+            profiler.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in label)
+            path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{safe}.prof')
+            profiler.dump_stats(path)
+            self._prune()
+            return path
+        except Exception as e:
+            print('Failed to save profile:', e)
+        finally:
+            self._busy.release()
+
+    def _prune(self):
+        profiles = sorted(f for f in os.listdir(self.directory) if f.endswith('.prof'))
+        for name in profiles[:max(0, len(profiles) - self.keep)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
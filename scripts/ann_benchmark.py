@@ -0,0 +1,91 @@
+"""Compare exact and IVF (approximate) gallery search: recall and latency.
+
+Usage:
+    python scripts/ann_benchmark.py --size 50000 --queries 500
+    python scripts/ann_benchmark.py --source data/cache/face_vectors.npz
+
+Without --source a synthetic gallery is generated (random 128-d encodings
+spaced like dlib's, queries are noisy copies ~0.35 away from their identity).
+Recall@1 is the fraction of queries whose IVF nearest neighbour equals the
+exact one.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gallery import Snapshot  # noqa: E402
+from ann_index import IVFIndex  # noqa: E402
+
+
+def synthetic_gallery(size, seed=0):
+    rng = np.random.default_rng(seed)
+    # ~0.95 between different people, like typical dlib encodings
+    return (rng.normal(0.0, 0.06, size=(size, 128))).astype(np.float32)
+
+
+def make_queries(gallery, count, noise=0.35, seed=1):
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(len(gallery), count, replace=len(gallery) < count)
+    q = gallery[ids] + rng.normal(0.0, noise / np.sqrt(128), size=(count, 128)).astype(np.float32)
+    return ids, q
+
+
+def timed(fn, queries):
+    out, lat = [], []
+    for q in queries:
+        t = time.perf_counter()
+        out.append(fn(q))
+        lat.append((time.perf_counter() - t) * 1000.0)
+    return out, np.array(lat)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--size', type=int, default=50000, help='synthetic gallery size')
+    ap.add_argument('--source', help='npz with a "vectors" array (e.g. data/cache/face_vectors.npz)')
+    ap.add_argument('--queries', type=int, default=500)
+    ap.add_argument('--nlist', type=int, default=0, help='IVF cells (default ~4*sqrt(N))')
+    ap.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    ap.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = ap.parse_args()
+
+    if args.source:
+        with np.load(args.source) as npz:
+            gallery = np.asarray(npz['vectors'], dtype=np.float32)
+    else:
+        gallery = synthetic_gallery(args.size)
+    names = np.array([f's{i}' for i in range(len(gallery))], dtype=object)
+    _, queries = make_queries(gallery, args.queries)
+
+    snap = Snapshot(names, gallery, np.einsum('ij,ij->i', gallery, gallery))
+    exact, exact_lat = timed(lambda q: snap.top_k(q, 1, exact=True)[0][0], queries)
+    results = [{'mode': 'exact', 'recall_at_1': 1.0, 'p50_ms': float(np.percentile(exact_lat, 50)),
+                'p95_ms': float(np.percentile(exact_lat, 95))}]
+
+    index = IVFIndex(dim=gallery.shape[1], nlist=args.nlist, min_size=1)
+    t = time.perf_counter()
+    index.build(names, gallery)
+    build_s = time.perf_counter() - t
+    for nprobe in args.nprobe:
+        found, lat = timed(lambda q: (index.search(q, 1, nprobe=nprobe) or [(None, 0)])[0][0], queries)
+        recall = float(np.mean([a == b for a, b in zip(found, exact)]))
+        results.append({'mode': f'ivf nprobe={nprobe}', 'recall_at_1': recall,
+                        'p50_ms': float(np.percentile(lat, 50)), 'p95_ms': float(np.percentile(lat, 95))})
+
+    if args.json:
+        print(json.dumps({'gallery_size': len(gallery), 'nlist': len(index._state[0]),
+                          'ivf_build_s': build_s, 'results': results}, indent=2))
+        return
+    print(f'gallery={len(gallery)}  queries={len(queries)}  nlist={len(index._state[0])}  ivf build={build_s:.2f}s')
+    print(f'{"mode":<18}{"recall@1":>10}{"p50 ms":>10}{"p95 ms":>10}')
+    for r in results:
+        print(f'{r["mode"]:<18}{r["recall_at_1"]:>10.3f}{r["p50_ms"]:>10.3f}{r["p95_ms"]:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
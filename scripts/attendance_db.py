@@ -0,0 +1,51 @@
+"""Import / export records and rebuild report aggregates of the SQLite attendance store.
+
+Usage:
+    python scripts/attendance_db.py import data/attendance.csv [--force]
+    python scripts/attendance_db.py export attendance_backup.csv [--header]
+    python scripts/attendance_db.py count
+    python scripts/attendance_db.py rebuild-reports [--lecture-minutes 60]
+
+The app imports data/attendance.csv automatically on first start; use
+``import --force`` to load another file (or the same one again).
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from attendance_store import AttendanceStore  # noqa: E402
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--db', default=os.environ.get('ATTENDANCE_DB', os.path.join(BASE_DIR, 'data', 'attendance.db')))
+    sub = ap.add_subparsers(dest='command', required=True)
+    imp = sub.add_parser('import', help='import a name,date,time CSV')
+    imp.add_argument('csv')
+    imp.add_argument('--force', action='store_true', help='import even if this file was imported before')
+    exp = sub.add_parser('export', help='write all records as CSV')
+    exp.add_argument('csv')
+    exp.add_argument('--header', action='store_true', help='write a name,date,time header line')
+    sub.add_parser('count', help='print the number of records')
+    reb = sub.add_parser('rebuild-reports', help='recompute the report aggregates from the raw records')
+    reb.add_argument('--lecture-minutes', type=int, default=int(os.environ.get('LECTURE_MINUTES', 60)))
+    args = ap.parse_args()
+
+    store = AttendanceStore(args.db, lecture_minutes=getattr(args, 'lecture_minutes', None)
+                            or int(os.environ.get('LECTURE_MINUTES', 60)))
+    if args.command == 'import':
+        print(f'Imported {store.import_csv(args.csv, force=args.force)} record(s) into {args.db}')
+    elif args.command == 'export':
+        print(f'Exported {store.export_csv(args.csv, header=args.header)} record(s) to {args.csv}')
+    elif args.command == 'rebuild-reports':
+        print(f'Rebuilt report aggregates from {store.rebuild_aggregates()} record(s)')
+    else:
+        print(store.count())
+
+
+if __name__ == '__main__':
+    main()
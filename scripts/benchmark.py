@@ -0,0 +1,393 @@
+"""Benchmark suite: gallery loading, verification, attendance writes and the
+admin dashboard, as gallery and attendance history grow.
+
+Usage:
+    python scripts/benchmark.py --students 100 1000 10000 --history 10000 100000
+    python scripts/benchmark.py --matcher face --probe-image static/images/jatin.png
+    python scripts/benchmark.py --matcher face --probe-image static/images/jatin.png --quantize int8
+    python scripts/benchmark.py --out bench.json
+    python scripts/benchmark.py --baseline bench.json   # exit 1 on regressions
+
+For every (matcher, students, history) combination a fresh process builds a
+synthetic setup in a temporary directory:
+
+* ``students`` enrollment files, with their encodings / phashes written
+  straight into the encoding cache. Nothing is encoded while the benchmark
+  runs, and load_known_faces takes the normal warm-start path.
+* ``history`` attendance rows spread over the previous ``--days`` days and
+  imported into a fresh SQLite store.
+
+It then drives the app through the Flask test client at each ``--concurrency``
+level (threads), ``--requests`` per scenario or as many as fit in
+``--max-seconds``. The scenarios are:
+
+* load_known_faces: a warm reload of the gallery, called directly.
+* api_verify: POST /api/verify with a probe image that matches a student.
+* record_attendance: a new student per call, including the final flush.
+* admin_dashboard: GET /admin/dashboard.
+
+Each result row has throughput, p50/p95/p99 latency and the process's peak
+RSS so far. The warm_up row also has the gallery's bytes per student: those
+read by a verification's first matching pass, and those held in memory
+(``--quantize`` sets GALLERY_QUANTIZE for the face matcher). The verification
+cache is off, so every api_verify request runs the whole pipeline. The phash matcher needs imagehash. The face matcher needs
+face_recognition and ``--probe-image``, a photo with one face. That photo
+is enrolled as one of the students, and verifications send it. Inputs are
+generated from ``--seed``, so runs are repeatable. Compare a run against a
+saved one with ``--baseline``. A row regresses when it is more than
+``--tolerance`` slower and at least ``--min-change-ms`` slower per request
+(see compare). scripts/benchmark_baseline.json is a run of the default grid;
+only compare against runs from similar hardware.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# rows compared with --baseline
+KEY_FIELDS = ('matcher', 'students', 'history', 'scenario', 'concurrency')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (None if unknown)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2 ** 20, 1)
+        except Exception:
+            return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return round(rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def summarize(latencies_ms, wall_s, errors):
+    lat = np.asarray(latencies_ms, dtype=np.float64)
+    p50, p95, p99 = (float(v) for v in np.percentile(lat, [50, 95, 99])) if len(lat) else (None,) * 3
+    return {'requests': len(lat), 'errors': errors,
+            'throughput_rps': round(len(lat) / wall_s, 1) if wall_s else None,
+            'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'peak_rss_mb': peak_rss_mb()}
+
+
+def drive(call, requests, concurrency, max_seconds=None):
+    """Run ``call(i)`` for i in range(requests) on ``concurrency`` threads, or
+    until ``max_seconds`` have passed (no new calls start after that).
+    ``call`` returns True on success. -> (latencies_ms, wall_s, errors)."""
+    started = time.perf_counter()
+    deadline = started + max_seconds if max_seconds else None
+
+    def one(i):
+        t = time.perf_counter()
+        if deadline is not None and i >= concurrency and t > deadline:
+            return None
+        try:
+            ok = call(i)
+        except Exception as e:
+            print(f'request {i} failed: {e}')
+            ok = False
+        return (time.perf_counter() - t) * 1000.0, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = [r for r in pool.map(one, range(requests)) if r is not None]
+    wall = time.perf_counter() - started
+    return [ms for ms, _ in results], wall, sum(1 for _, ok in results if not ok)
+
+
+# --- synthetic data -----------------------------------------------------------
+
+def noise_image(seed, size=128):
+    """A random grey-blob PNG; different seeds give clearly different phashes."""
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, size=(8, 8), dtype=np.uint8)
+    img = Image.fromarray(small, 'L').resize((size, size), Image.BILINEAR).convert('RGB')
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def build_gallery(cfg, images_dir, cache_dir):
+    """Write the enrollment files and their cached vectors; returns the probe
+    image bytes (each matching an enrolled student)."""
+    from face_cache import EncodingCache
+    from face_pipeline import PHASH_CACHE_KIND, PHASH_DECODE_SIDE, decode_image, phash_code
+
+    rng = np.random.default_rng(cfg['seed'])
+    n = cfg['students']
+    if cfg['matcher'] == 'face':
+        import face_recognition
+        with open(cfg['probe_image'], 'rb') as f:
+            probes = [f.read()]
+        faces = face_recognition.face_encodings(face_recognition.load_image_file(cfg['probe_image']))
+        if not faces:
+            raise SystemExit(f"No face found in {cfg['probe_image']}")
+        # spaced like dlib encodings of different people (~0.95 apart)
+        vectors = rng.normal(0.0, 0.06, size=(n, 128)).astype(np.float32)
+        vectors[0] = faces[0]
+        kind = 'face'
+    else:
+        probes = [noise_image(cfg['seed'] * 1000 + i) for i in range(min(n, 16))]
+        vectors = rng.integers(0, 2 ** 63, size=(n, 1), dtype=np.uint64)
+        for i, data in enumerate(probes):
+            vectors[i, 0] = phash_code(decode_image(data, PHASH_DECODE_SIDE)[0])
+        kind = PHASH_CACHE_KIND
+
+    os.makedirs(images_dir, exist_ok=True)
+    cache = EncodingCache(cache_dir, kind, images_dir)
+    for i in range(n):
+        if i < len(probes):
+            path, data = os.path.join(images_dir, f'probe_{i:04d}.png'), probes[i]
+        else:
+            # placeholder photo: only its stat and content hash are ever used
+            path, data = os.path.join(images_dir, f'student_{i:06d}.jpg'), f'synthetic {i}'.encode()
+        with open(path, 'wb') as f:
+            f.write(data)
+        cache.get(path, lambda _path, v=vectors[i]: v)
+    cache.save()
+    return probes
+
+
+def build_history(cfg, db_path, csv_path):
+    """Import ``history`` rows over the previous ``days`` days; returns seconds taken."""
+    from attendance_store import AttendanceStore
+
+    rng = np.random.default_rng(cfg['seed'] + 1)
+    n, days = cfg['history'], max(1, cfg['days'])
+    today = date.today()
+    students = rng.integers(0, cfg['students'], size=n)
+    day = rng.integers(1, days + 1, size=n)
+    second = rng.integers(8 * 3600, 17 * 3600, size=n)
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write('name,date,time\n')
+        for s, d, t in zip(students.tolist(), day.tolist(), second.tolist()):
+            f.write(f'student_{s:06d},{today - timedelta(days=d)},'
+                    f'{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}\n')
+    started = time.perf_counter()
+    AttendanceStore(db_path).import_csv(csv_path)
+    return time.perf_counter() - started
+
+
+# --- one configuration (runs in its own process) ------------------------------
+
+def run_config(cfg):
+    work = tempfile.mkdtemp(prefix='attendance-bench-')
+    try:
+        images_dir = os.path.join(work, 'images')
+        cache_dir = os.path.join(work, 'cache')
+        db_path = os.path.join(work, 'attendance.db')
+        probes = build_gallery(cfg, images_dir, cache_dir)
+        import_s = build_history(cfg, db_path, os.path.join(work, 'history.csv'))
+
+        # app.py reads its paths and matcher at import time
+        os.environ.update({'IMAGES_DIR': images_dir, 'FACE_CACHE_DIR': cache_dir, 'ATTENDANCE_DB': db_path,
+                           'ATTENDANCE_CSV': os.path.join(work, 'none.csv'),
+                           'FACE_MATCHER': 'auto' if cfg['matcher'] == 'face' else 'phash',
+                           'GALLERY_QUANTIZE': cfg.get('quantize', 'none'), 'VERIFY_CACHE_SIZE': '0'})
+        import app
+        if not app.GALLERY_READY.wait(600):
+            raise SystemExit(f"Gallery did not load: {app.WARM_UP['error']}")
+        base = {k: cfg[k] for k in ('matcher', 'students', 'history')}
+        scanned, held = app._gallery_bytes_per_student()
+        rows = [dict(base, scenario='warm_up', concurrency=1, seconds=app.WARM_UP['seconds'],
+                     history_import_seconds=round(import_s, 2), peak_rss_mb=peak_rss_mb(),
+                     scan_bytes_per_student=round(scanned, 1), bytes_per_student=round(held, 1))]
+
+        lat, wall, errors = drive(lambda i: len(app.load_known_faces()) == cfg['students'], cfg['load_repeats'], 1)
+        rows.append(dict(base, scenario='load_known_faces', concurrency=1, **summarize(lat, wall, errors)))
+
+        local = threading.local()
+
+        def client():
+            c = getattr(local, 'client', None)
+            if c is None:
+                c = local.client = app.app.test_client()
+                with c.session_transaction() as sess:
+                    sess['admin'] = True
+            return c
+
+        def verify(i):
+            resp = client().post('/api/verify', data=probes[i % len(probes)], content_type='image/png')
+            return resp.status_code == 200 and resp.get_json().get('match')
+
+        def dashboard(i):
+            return client().get('/admin/dashboard').status_code == 200
+
+        for concurrency in cfg['concurrency']:
+            local = threading.local()   # fresh clients per level
+            for scenario, call in (('api_verify', verify), ('admin_dashboard', dashboard)):
+                lat, wall, errors = drive(call, cfg['requests'], concurrency, cfg['max_seconds'])
+                rows.append(dict(base, scenario=scenario, concurrency=concurrency, **summarize(lat, wall, errors)))
+
+            def record(i, c=concurrency):
+                return app.record_attendance(f'bench_c{c}_{i}')
+
+            started = time.perf_counter()
+            lat, _, errors = drive(record, cfg['requests'], concurrency, cfg['max_seconds'])
+            app.ATTENDANCE.flush()
+            wall = time.perf_counter() - started
+            rows.append(dict(base, scenario='record_attendance', concurrency=concurrency,
+                             **summarize(lat, wall, errors)))
+        return rows
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+# --- driver -------------------------------------------------------------------
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(rows, baseline, tolerance, min_ms):
+    """Rows more than ``tolerance`` slower than in the baseline, and by at least
+    ``min_ms`` per request. Sub-millisecond rows vary by 2-4x between runs of
+    the same code; the floor keeps them out.
+
+    At concurrency 1 the p50 latency is compared. The p95 of a few-millisecond
+    row moves by 4 ms between identical runs. Above concurrency 1, latency is
+    mostly time spent queueing, so throughput is compared instead, as
+    milliseconds per request. Warm-up seconds are a single sample and are not
+    compared; load_known_faces times the same load."""
+    old = {tuple(r.get(k) for k in KEY_FIELDS): r for r in baseline}
+    regressions = []
+    for r in rows:
+        b = old.get(tuple(r.get(k) for k in KEY_FIELDS))
+        if not b or r['scenario'] == 'warm_up':
+            continue
+        field = 'p50_ms' if r['concurrency'] == 1 else 'throughput_rps'
+        if not r.get(field) or not b.get(field):
+            continue
+        new, was = r[field], b[field]
+        if field == 'throughput_rps':
+            new, was = 1000.0 / new, 1000.0 / was
+        if new > was * (1 + tolerance) and new - was >= min_ms:
+            regressions.append({**{k: r.get(k) for k in KEY_FIELDS}, 'metric': field,
+                                'baseline': b[field], 'current': r[field]})
+    return regressions
+
+
+def print_table(rows):
+    print(f"{'matcher':7} {'students':>8} {'history':>8} {'scenario':18} {'conc':>4} "
+          f"{'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>4} {'rss MiB':>8}")
+    fmt = lambda v, spec: format(v, spec) if v is not None else '-'  # noqa: E731
+    for r in rows:
+        if r['scenario'] == 'warm_up':
+            print(f"{r['matcher']:7} {r['students']:>8} {r['history']:>8} {'warm_up':18} {'':>4} "
+                  f"{'':>9} {fmt(r['seconds'] * 1000 if r['seconds'] is not None else None, '8.1f')} "
+                  f"{'':>8} {'':>8} {'':>4} {fmt(r['peak_rss_mb'], '8.1f')}"
+                  f"  {fmt(r.get('bytes_per_student'), '.0f')} B/student ({fmt(r.get('scan_bytes_per_student'), '.0f')} scanned)")
+            continue
+        print(f"{r['matcher']:7} {r['students']:>8} {r['history']:>8} {r['scenario']:18} {r['concurrency']:>4} "
+              f"{fmt(r['throughput_rps'], '9.1f')} {fmt(r['p50_ms'], '8.2f')} {fmt(r['p95_ms'], '8.2f')} "
+              f"{fmt(r['p99_ms'], '8.2f')} {r['errors']:>4} {fmt(r['peak_rss_mb'], '8.1f')}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--matcher', choices=('phash', 'face', 'both'), default='phash')
+    ap.add_argument('--probe-image', help='photo with one face (required for --matcher face)')
+    ap.add_argument('--quantize', choices=('none', 'int8'), default='none',
+                    help='GALLERY_QUANTIZE for the face matcher')
+    ap.add_argument('--students', type=int, nargs='+', default=[100, 1000, 10000])
+    ap.add_argument('--history', type=int, nargs='+', default=[10000, 100000], help='attendance rows')
+    ap.add_argument('--days', type=int, default=60, help='days the history is spread over')
+    ap.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    ap.add_argument('--requests', type=int, default=200, help='requests per scenario and concurrency level')
+    ap.add_argument('--max-seconds', type=float, default=20,
+                    help='stop a scenario early after this long (the dashboard at 10000 students)')
+    ap.add_argument('--load-repeats', type=int, default=20, help='timed load_known_faces calls')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--out', help='write the JSON results to this file')
+    ap.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    ap.add_argument('--baseline', help='earlier --out file to compare against')
+    ap.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown vs the baseline (0.5 = 50%%)')
+    ap.add_argument('--min-change-ms', type=float, default=2.5,
+                    help='ignore slowdowns smaller than this per request')
+    ap.add_argument('--verbose', action='store_true', help="show the app's own output")
+    ap.add_argument('--worker', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        cfg = json.loads(args.worker)
+        rows = run_config(cfg)
+        with open(cfg['result_path'], 'w', encoding='utf-8') as f:
+            json.dump(rows, f)
+        return
+
+    matchers = ['phash', 'face'] if args.matcher == 'both' else [args.matcher]
+    if 'face' in matchers and not args.probe_image:
+        ap.error('--matcher face needs --probe-image (a photo with one face)')
+
+    rows, skipped = [], []
+    for matcher in matchers:
+        for students in args.students:
+            for history in args.history:
+                cfg = {'matcher': matcher, 'students': students, 'history': history, 'days': args.days,
+                       'concurrency': args.concurrency, 'requests': args.requests,
+                       'max_seconds': args.max_seconds,
+                       'load_repeats': args.load_repeats, 'seed': args.seed, 'quantize': args.quantize,
+                       'probe_image': os.path.abspath(args.probe_image) if args.probe_image else None}
+                with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+                    cfg['result_path'] = f.name
+                label = f'{matcher}, {students} students, {history} history rows'
+                print(f'Running {label}...', file=sys.stderr)
+                try:
+                    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(cfg)],
+                                          stdout=None if args.verbose else subprocess.PIPE,
+                                          stderr=subprocess.STDOUT, text=True)
+                    if proc.returncode != 0:
+                        print(f'{label} failed:\n{proc.stdout or ""}', file=sys.stderr)
+                        skipped.append({'matcher': matcher, 'students': students, 'history': history,
+                                        'error': (proc.stdout or '').strip().splitlines()[-1:] or None})
+                        continue
+                    with open(cfg['result_path'], 'r', encoding='utf-8') as f:
+                        rows.extend(json.load(f))
+                finally:
+                    os.remove(cfg['result_path'])
+
+    report = {'environment': environment(), 'args': {k: v for k, v in vars(args).items() if k != 'worker'},
+              'results': rows, 'failed': skipped}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(rows, json.load(f)['results'], args.tolerance, args.min_change_ms)
+        report['regressions'] = regressions
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_table(rows)
+        for r in regressions:
+            print(f"REGRESSION {r['scenario']} ({r['matcher']}, {r['students']} students, "
+                  f"{r['history']} rows, concurrency {r['concurrency']}): "
+                  f"{r['metric']} {r['baseline']:.2f} -> {r['current']:.2f}")
+    if regressions or skipped:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,181 +1,188 @@
-import face_recognition
-import cv2
-import numpy as np
-import os
-import xlwt
-from xlwt import Workbook
-from datetime import date
-import xlrd, xlwt
-from xlutils.copy import copy as xl_copy
+"""Desktop attendance recognizer: live webcam recognition for one lecture.
 
-CurrentFolder = os.getcwd() #Read current folder path
+Usage:
+    python "scripts/face recognition code.py" [--lecture "Maths"] [--camera 0]
 
-def get_png_images():
-    folder_path = './images'
-    # Check if the folder path exists
-    if not os.path.exists(folder_path):
-        print(f"The folder path '{folder_path}' does not exist.")
-        return []
+It runs the same recognition as the web app, importing app.py for it:
 
-    # Initialize an empty list to store image names
-    image_names = []
+* The cached gallery in static/images + data/cache. Only new or changed photos
+  are encoded at launch.
+* The same matcher and face tracker as live mode. Each face is encoded when its
+  track appears (or is re-checked), not on every frame.
+* The same attendance store (data/attendance.db). Marks are batched by the
+  store's writer thread, and a student is marked once per day.
 
-    # Iterate over each file in the folder
-    for filename in os.listdir(folder_path):
-        # Check if the file has a .png extension
-        if filename.lower().endswith('.png'):
-            # Get the filename without extension and append it to the list
-            image_name = os.path.splitext(filename)[0]
-            image_names.append(image_name)
-
-    return image_names
-
-# print(get_png_images())
-
-# exit()
-
-# image2 = CurrentFolder+'\\kalpana.png'
-# image3 = CurrentFolder+'\\saurav.png'
+Frames are read on a capture thread into a one-slot "latest frame" buffer, so
+the camera never stalls while dlib works. Slow recognition just skips the
+frames that arrived in the meantime. Press 'q' to end the session. The
+students seen are then written to the Excel workbook as one new sheet per
+lecture, with a single save.
 
+Requires face_recognition, opencv-python, xlwt, xlrd and xlutils.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
 
+import cv2
+import numpy as np
+import xlrd
+import xlwt
+from xlutils.copy import copy as xl_copy
 
-# This is a demo of running face recognition on live video from your webcam. It's a little more complicated than the
-# other example, but it includes some basic performance tweaks to make things run a lot faster:
-#   1. Process each video frame at 1/4 resolution (though still display it at full resolution)
-#   2. Only detect faces in every other frame of video.
-
-# PLEASE NOTE: This example requires OpenCV (the `cv2` library) to be installed only to read from your webcam.
-# OpenCV is not required to use the face_recognition library. It's only required if you want to run this
-# specific demo. If you have trouble installing it, try any of the other demos that don't require it instead.
-
-# Get a reference to webcam #0 (the default one)
-video_capture = cv2.VideoCapture(0)
-
-
-
-# Load a second sample picture and learn how to recognize it.
-known_face_encodings = []
-
-images = get_png_images()
-known_face_names = images
-for name in images:
-    image_path = f'./images/{name}.png'
-    person_image = face_recognition.load_image_file(image_path)
-    person_face_encoding = face_recognition.face_encodings(person_image)[0]
-    known_face_encodings.append(person_face_encoding)
-
-
-# person2_name = "kalpana"
-# person2_image = face_recognition.load_image_file(image2)
-# person2_face_encoding = face_recognition.face_encodings(person2_image)[0]
-
-# person3_name = "saurav"
-# person3_image = face_recognition.load_image_file(image3)
-# person3_face_encoding = face_recognition.face_encodings(person3_image)[0]
-
-
-
-
-# Create arrays of known face encodings and their names
-# known_face_encodings = [
-    
-#      person2_face_encoding,
-#      person3_face_encoding
-# ]
-# known_face_names = [
-    
-#      person2_name,
-#      person3_name
-# ]
-
-# Initialize some variables
-face_locations = []
-face_encodings = []
-face_names = []
-process_this_frame = True
-
-rb = xlrd.open_workbook('attendence_excel.xls', formatting_info=True) 
-wb = xl_copy(rb)
-inp = input('Please give current subject lecture name')
-sheet1 = wb.add_sheet(inp)
-sheet1.write(0, 0, 'Name/Date')
-sheet1.write(0, 1, str(date.today()))
-row=1
-col=0
-already_attendence_taken = ""
-while True:
-            # Grab a single frame of video
-            ret, frame = video_capture.read()
-
-            # Resize frame of video to 1/4 size for faster face recognition processing
-            small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-
-            # Convert the image from BGR color (which OpenCV uses) to RGB color (which face_recognition uses)
-            rgb_small_frame = small_frame[:, :, ::-1]
-
-            # Only process every other frame of video to save time
-            if process_this_frame:
-                # Find all the faces and face encodings in the current frame of video
-                face_locations = face_recognition.face_locations(rgb_small_frame)
-                face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-
-                face_names = []
-                for face_encoding in face_encodings:
-                    # See if the face is a match for the known face(s)
-                    matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-                    name = "Unknown"
-
-                    # # If a match was found in known_face_encodings, just use the first one.
-                    # if True in matches:
-                    #     first_match_index = matches.index(True)
-                    #     name = known_face_names[first_match_index]
-
-                    # Or instead, use the known face with the smallest distance to the new face
-                    face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-                    best_match_index = np.argmin(face_distances)
-                    if matches[best_match_index]:
-                        name = known_face_names[best_match_index]
-
-                    face_names.append(name)
-                    if((already_attendence_taken != name) and (name != "Unknown")):
-                     sheet1.write(row, col, name )
-                     col =col+1
-                     sheet1.write(row, col, "Present" )
-                     row = row+1
-                     col = 0
-                     print("attendence taken")
-                     wb.save('attendence_excel.xls')
-                     already_attendence_taken = name
-                    else:
-                     print("next student")
-                        
-            process_this_frame = not process_this_frame
-
-
-            # Display the results
-            for (top, right, bottom, left), name in zip(face_locations, face_names):
-                # Scale back up face locations since the frame we detected in was scaled to 1/4 size
-                top *= 4
-                right *= 4
-                bottom *= 4
-                left *= 4
-
-                # Draw a box around the face
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+from face_pipeline import detect_faces  # noqa: E402
+from face_tracking import FaceTracker  # noqa: E402
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class LatestFrame:
+    """One-slot buffer: the capture thread overwrites it, the recognizer takes
+    the newest frame (older ones are simply dropped)."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self.closed = False
+
+    def put(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, after: int, timeout: float = 1.0):
+        """(seq, frame) newer than ``after``; (after, None) on timeout or close."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after or self.closed, timeout)
+            if self._seq > after:
+                return self._seq, self._frame
+            return after, None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def capture(video_capture, buffer):
+    while not buffer.closed:
+        ret, frame = video_capture.read()
+        if not ret:
+            print('Camera stopped delivering frames')
+            buffer.close()
+            break
+        buffer.put(frame)
+
+
+def export_excel(path, lecture, seen):
+    """Append one sheet for this lecture ({name: first time seen}) and save once."""
+    if os.path.exists(path):
+        rb = xlrd.open_workbook(path, formatting_info=True)
+        wb = xl_copy(rb)
+        existing = set(rb.sheet_names())
+    else:
+        wb = xlwt.Workbook()
+        existing = set()
+    # sheet names must be unique and at most 31 characters
+    sheet_name, n = lecture[:31], 1
+    while sheet_name in existing:
+        n += 1
+        sheet_name = f'{lecture[:27]} ({n})'
+    sheet = wb.add_sheet(sheet_name)
+    sheet.write(0, 0, 'Name/Date')
+    sheet.write(0, 1, str(date.today()))
+    sheet.write(0, 2, 'Time')
+    for row, (name, ts) in enumerate(sorted(seen.items(), key=lambda item: item[1]), start=1):
+        sheet.write(row, 0, name)
+        sheet.write(row, 1, 'Present')
+        sheet.write(row, 2, ts.strftime('%H:%M:%S'))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    wb.save(path)
+    return sheet_name
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--lecture', help='lecture / subject name (asked for if omitted)')
+    ap.add_argument('--camera', type=int, default=0)
+    ap.add_argument('--scale', type=float, default=0.25, help='detect faces on frames shrunk by this factor')
+    ap.add_argument('--load-timeout', type=float, default=300, help='seconds to wait for the gallery to load')
+    ap.add_argument('--excel', default=os.path.join(BASE_DIR, 'data', 'attendence_excel.xls'))
+    args = ap.parse_args()
+
+    lecture = args.lecture or input('Please give current subject lecture name: ')
+    video_capture = cv2.VideoCapture(args.camera)
+    if not video_capture.isOpened():
+        print('Error: Unable to open camera')
+        return
+
+    buffer = LatestFrame()
+    threading.Thread(target=capture, args=(video_capture, buffer), name='capture', daemon=True).start()
+
+    print('Loading gallery...')
+    deadline = time.monotonic() + args.load_timeout
+    while not app.GALLERY_READY.wait(0.5):
+        if app.WARM_UP['error'] or time.monotonic() > deadline:
+            buffer.close()
+            video_capture.release()
+            sys.exit(f"Gallery failed to load: {app.WARM_UP['error']}" if app.WARM_UP['error']
+                     else f'Gallery not ready after {args.load_timeout:g}s')
+    if not app.FACE_RECOG_AVAILABLE:
+        print('face_recognition is required for the desktop recognizer')
+        return
+    print(f'{len(app.GALLERY)} student(s) loaded')
+
+    tracker = FaceTracker()
+    seen = {}   # name -> first time seen this session
+    seq = 0
+    inv = 1.0 / args.scale
+    try:
+        while not buffer.closed:
+            seq, frame = buffer.get(seq)
+            if frame is None:
+                continue
+            small = cv2.resize(frame, (0, 0), fx=args.scale, fy=args.scale)
+            # BGR (OpenCV) -> RGB (face_recognition)
+            rgb = np.ascontiguousarray(small[:, :, ::-1])
+            tracks = tracker.update(detect_faces(rgb), app.identify_boxes(rgb))
+
+            due = [t for t in tracks if t.match and not t.marked]
+            if due:
+                # queued to the store's writer thread; repeats today are skipped
+                recorded = app.record_attendance_many([t.name for t in due])
+                for t in due:
+                    t.marked = True
+                    seen.setdefault(t.name, datetime.now())
+                    print(f'{t.name}: ' + ('attendance taken' if t.name in recorded else 'already marked today'))
+
+            for t in tracks:
+                top, right, bottom, left = (int(v * inv) for v in t.box)
                 cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
-
-                # Draw a label with a name below the face
                 cv2.rectangle(frame, (left, bottom - 35), (right, bottom), (0, 0, 255), cv2.FILLED)
-                font = cv2.FONT_HERSHEY_DUPLEX
-                cv2.putText(frame, name, (left + 6, bottom - 6), font, 1.0, (255, 255, 255), 1)
-
-            # Display the resulting image
+                cv2.putText(frame, t.name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 1.0, (255, 255, 255), 1)
             cv2.imshow('Video', frame)
-
             # Hit 'q' on the keyboard to quit!
-            if cv2.waitKey(1) & 0xff==ord('q'):   
-                print("data save")
+            if cv2.waitKey(1) & 0xff == ord('q'):
                 break
+    finally:
+        buffer.close()
+        video_capture.release()
+        cv2.destroyAllWindows()
+        app.ATTENDANCE.flush()
+
+    stats = tracker.stats()
+    print(f"{stats['frames']} frame(s) processed, {stats['encoded']} face encoding(s) computed")
+    sheet = export_excel(args.excel, lecture, seen)
+    print(f'{len(seen)} student(s) saved to sheet "{sheet}" of {args.excel}')
+
 
-# Release handle to the webcam
-video_capture.release()
-cv2.destroyAllWindows()
+if __name__ == '__main__':
+    main()
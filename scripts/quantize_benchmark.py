@@ -0,0 +1,107 @@
+"""Compare float32 and int8 gallery matching: accuracy, latency, memory.
+
+Usage:
+    python scripts/quantize_benchmark.py --size 100000 --queries 500
+    python scripts/quantize_benchmark.py --source data/cache/face_vectors.npz --json
+
+int8 scans a compact copy of the gallery and re-ranks the best QUANT_CANDIDATES
+rows with exact float32 distances read from a memory-mapped file, as the app
+does (see gallery.py). Half the
+queries are noisy copies of enrolled students, the other half are strangers.
+Reported per mode:
+
+* recall@1: the nearest student is the same as with exact float32 search;
+* threshold agreement: match / no-match at the 0.5 threshold (and the matched
+  name) agree with float32;
+* max distance error of the reported best distance;
+* p50 / p95 latency of one query and of a 32-query batch (top_k_many);
+* bytes per student read by the first pass and held in memory.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gallery import Snapshot, int8_scale, quantize  # noqa: E402
+from ann_benchmark import synthetic_gallery, make_queries, timed  # noqa: E402
+
+MATCH_THRESHOLD = 0.5
+BATCH = 32
+
+
+def make_snapshot(names, gallery, mode, rows_dir=None):
+    sqnorms = np.einsum('ij,ij->i', gallery, gallery)
+    if mode == 'float32':
+        return Snapshot(names, gallery, sqnorms)
+    scale = int8_scale(gallery)
+    codes = quantize(gallery, mode, scale)
+    if rows_dir is not None:
+        # float32 rows for the re-ranking stay on disk, as in the app
+        path = os.path.join(rows_dir, 'vectors.npy')
+        np.save(path, gallery)
+        gallery = np.load(path, mmap_mode='r')
+    return Snapshot(names, gallery, sqnorms, codes=codes, scale=scale)
+
+
+def decision(best):
+    name, distance = best
+    return name if distance < MATCH_THRESHOLD else None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--size', type=int, default=100000, help='synthetic gallery size')
+    ap.add_argument('--source', help='npz with a "vectors" array (e.g. data/cache/face_vectors.npz)')
+    ap.add_argument('--queries', type=int, default=500)
+    ap.add_argument('--modes', nargs='+', default=['float32', 'int8'], choices=['float32', 'int8'])
+    ap.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = ap.parse_args()
+
+    if args.source:
+        with np.load(args.source) as npz:
+            gallery = np.asarray(npz['vectors'], dtype=np.float32)
+    else:
+        gallery = synthetic_gallery(args.size)
+    names = np.array([f's{i}' for i in range(len(gallery))], dtype=object)
+    _, genuine = make_queries(gallery, args.queries - args.queries // 2)
+    strangers = synthetic_gallery(args.queries // 2, seed=2)
+    queries = np.concatenate([genuine, strangers])
+
+    reference = make_snapshot(names, gallery, 'float32')
+    exact = [reference.top_k(q, 1)[0] for q in queries]
+    results = []
+    with tempfile.TemporaryDirectory() as rows_dir:
+        for mode in args.modes:
+            snap = make_snapshot(names, gallery, mode, rows_dir)
+            found, lat = timed(lambda q: snap.top_k(q, 1)[0], queries)
+            batches = [queries[i:i + BATCH] for i in range(0, len(queries) - BATCH + 1, BATCH)] or [queries]
+            _, batch_lat = timed(lambda qs: snap.top_k_many(qs, 1), batches)
+            scanned, held = snap.nbytes()
+            results.append({
+                'mode': mode,
+                'recall_at_1': float(np.mean([a[0] == b[0] for a, b in zip(found, exact)])),
+                'threshold_agreement': float(np.mean([decision(a) == decision(b) for a, b in zip(found, exact)])),
+                'max_distance_error': float(max(abs(a[1] - b[1]) for a, b in zip(found, exact) if a[0] == b[0])),
+                'p50_ms': float(np.percentile(lat, 50)), 'p95_ms': float(np.percentile(lat, 95)),
+                'batch_p50_ms': float(np.percentile(batch_lat, 50)),
+                'scan_bytes_per_student': scanned / len(snap), 'bytes_per_student': held / len(snap),
+            })
+
+    if args.json:
+        print(json.dumps({'gallery_size': len(gallery), 'queries': len(queries), 'results': results}, indent=2))
+        return
+    print(f'gallery={len(gallery)}  queries={len(queries)} ({len(genuine)} enrolled, {len(strangers)} strangers)')
+    print(f'{"mode":<9}{"recall@1":>9}{"agree@0.5":>10}{"max err":>10}{"p50 ms":>8}{"p95 ms":>8}'
+          f'{"batch ms":>10}{"scan B/st":>10}{"held B/st":>10}')
+    for r in results:
+        print(f'{r["mode"]:<9}{r["recall_at_1"]:>9.3f}{r["threshold_agreement"]:>10.3f}{r["max_distance_error"]:>10.2e}'
+              f'{r["p50_ms"]:>8.2f}{r["p95_ms"]:>8.2f}{r["batch_p50_ms"]:>10.2f}'
+              f'{r["scan_bytes_per_student"]:>10.0f}{r["bytes_per_student"]:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""Gallery shared by several server worker processes through memory-mapped files.
+
+Under gunicorn every worker would otherwise build its own copy of the gallery
+matrix, and an enrollment handled by one worker would be invisible to the others.
+``SharedGallery`` wraps a gallery.Gallery and publishes every version to
+``<directory>/v<generation>/`` (vectors.npy, sqnorms.npy, reps.npy with the
+representative encodings of multi-photo students, codes.npy / scale.npy with
+the quantized rows, names.json). Workers
+map those arrays read-only (``np.load(mmap_mode='r')``), so the pages are shared
+by all workers through the OS page cache.
+
+The current generation is an 8-byte counter file that every worker keeps mapped.
+Reading it costs no system call, so ``snapshot`` checks it on every access
+and swaps in a newer version as soon as one is published. Nothing is
+re-encoded. Writers (load / add / remove) hold an exclusive file lock, bring
+themselves up to the latest version, apply their change and publish the next
+generation.
+
+At startup a published version is reused as long as the images directory
+still matches it (same files, sizes and mtimes); otherwise the first worker
+rebuilds it from the encoding cache and the rest adopt that.
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# published versions kept on disk besides the current one, for workers still
+# switching over (POSIX keeps unlinked mappings valid anyway)
+KEEP_VERSIONS = 2
+
+
+def listing_digest(paths, root: str = None) -> str:
+    """sha1 over (path, size, mtime) of every image, to tell whether a published
+    version still matches the images directory. Paths are taken relative to
+    ``root`` (student folders included), or by file name without one."""
+    h = hashlib.sha1()
+    for path in sorted(paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        rel = os.path.relpath(path, root).replace(os.sep, '/') if root else os.path.basename(path)
+        h.update(f'{rel}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode())
+    return h.hexdigest()
+
+
+class SharedGallery:
+    def __init__(self, gallery, directory: str, list_paths):
+        """``list_paths()`` returns the current image paths (for the digest)."""
+        self.gallery = gallery
+        self.directory = directory
+        self.list_paths = list_paths
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, 'lock')
+        self._counter_path = os.path.join(directory, 'generation')
+        self._thread_lock = threading.RLock()
+        self.generation = 0   # version this process currently serves
+        self._counter = self._map_counter()
+
+    # --- generation counter -----------------------------------------------------
+
+    def _map_counter(self):
+        fd = os.open(self._counter_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < 8:
+                os.write(fd, b'\0' * 8)
+            return mmap.mmap(fd, 8)
+        finally:
+            os.close(fd)
+
+    def published_generation(self) -> int:
+        return int.from_bytes(self._counter[:8], 'little')
+
+    def _set_published_generation(self, generation):
+        self._counter[:8] = int(generation).to_bytes(8, 'little')
+        self._counter.flush()
+
+    @contextmanager
+    def _exclusive(self):
+        """Inter-process (file) + intra-process lock around writers."""
+        with self._thread_lock, open(self._lock_path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # --- published versions -----------------------------------------------------
+
+    def _version_dir(self, generation):
+        return os.path.join(self.directory, f'v{generation}')
+
+    def _read_meta(self, generation):
+        try:
+            with open(os.path.join(self._version_dir(generation), 'names.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _adopt(self, generation, reindex=True) -> bool:
+        meta = self._read_meta(generation)
+        if meta is None:
+            return False
+        vdir = self._version_dir(generation)
+        try:
+            matrix = np.load(os.path.join(vdir, 'vectors.npy'), mmap_mode='r')
+            sqnorms = np.load(os.path.join(vdir, 'sqnorms.npy'), mmap_mode='r')
+            reps = {}
+            if meta.get('reps'):
+                rep_matrix = np.load(os.path.join(vdir, 'reps.npy'), mmap_mode='r')
+                start = 0
+                for name, count in meta['reps']:
+                    reps[name] = rep_matrix[start:start + count]
+                    start += count
+            codes = scale = None
+            if os.path.exists(os.path.join(vdir, 'codes.npy')):
+                codes = np.load(os.path.join(vdir, 'codes.npy'), mmap_mode='r')
+                if os.path.exists(os.path.join(vdir, 'scale.npy')):
+                    scale = np.load(os.path.join(vdir, 'scale.npy'))
+        except (OSError, ValueError) as e:
+            print(f'Cannot map gallery version {generation}: {e}')
+            return False
+        self.gallery.adopt(meta['names'], matrix, sqnorms, reindex=reindex, reps=reps, codes=codes, scale=scale)
+        self.generation = generation
+        return True
+
+    def _publish(self):
+        """Write the gallery's current rows as the next generation and switch this
+        process over to the mapped copy (dropping its private buffers)."""
+        snap = self.gallery.snapshot
+        generation = max(self.published_generation(), self.generation) + 1
+        vdir = self._version_dir(generation)
+        tmp = vdir + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(vdir, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'vectors.npy'), np.ascontiguousarray(snap.matrix))
+        np.save(os.path.join(tmp, 'sqnorms.npy'), np.ascontiguousarray(snap.sqnorms))
+        reps = [(str(name), snap.reps[name]) for name in snap.names if name in snap.reps]
+        if reps:
+            np.save(os.path.join(tmp, 'reps.npy'), np.ascontiguousarray(np.concatenate([r for _, r in reps])))
+        if snap.codes is not None:
+            np.save(os.path.join(tmp, 'codes.npy'), np.ascontiguousarray(snap.codes))
+            if snap.scale is not None:
+                np.save(os.path.join(tmp, 'scale.npy'), snap.scale)
+        with open(os.path.join(tmp, 'names.json'), 'w', encoding='utf-8') as f:
+            json.dump({'names': [str(n) for n in snap.names],
+                       'reps': [[name, len(r)] for name, r in reps],
+                       'digest': listing_digest(self.list_paths(), self.gallery.cache.root)}, f)
+        os.replace(tmp, vdir)
+        self._set_published_generation(generation)
+        self._adopt(generation, reindex=False)
+        for name in os.listdir(self.directory):
+            if name.startswith('v') and name[1:].isdigit() and int(name[1:]) < generation - KEEP_VERSIONS:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    # --- Gallery interface ------------------------------------------------------
+
+    def sync(self):
+        """Switch to the latest published version if another worker published one."""
+        generation = self.published_generation()
+        if generation != self.generation:
+            with self._thread_lock:
+                if generation != self.generation:
+                    self._adopt(generation)
+
+    @property
+    def snapshot(self):
+        self.sync()
+        return self.gallery.snapshot
+
+    def names(self):
+        return list(self.snapshot.names)
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def load(self, paths, timer=None):
+        """Adopt the published version if it matches ``paths``; otherwise build the
+        gallery (from the encoding cache) and publish it."""
+        with self._exclusive():
+            generation = self.published_generation()
+            meta = self._read_meta(generation) if generation else None
+            if meta is not None and meta.get('digest') == listing_digest(paths, self.gallery.cache.root):
+                with timer('adopt') if timer else nullcontext():
+                    adopted = self._adopt(generation)
+                if adopted:
+                    return self.gallery.snapshot
+            self.gallery.load(paths, timer)
+            with timer('publish') if timer else nullcontext():
+                self._publish()
+            return self.gallery.snapshot
+
+    def add(self, name: str, paths, forget=()) -> bool:
+        with self._exclusive():
+            self.sync()
+            # another worker may have written the encoding cache since we read it
+            self.gallery.cache.load()
+            added = self.gallery.add(name, paths, forget)
+            self._publish()
+            return added
+
+    def add_many(self, students, known=None):
+        with self._exclusive():
+            self.sync()
+            self.gallery.cache.load()
+            added = self.gallery.add_many(students, known)
+            self._publish()
+            return added
+
+    def remove(self, name: str, paths=()) -> bool:
+        with self._exclusive():
+            self.sync()
+            self.gallery.cache.load()
+            removed = self.gallery.remove(name, paths)
+            self._publish()
+            return removed
@@ -101,11 +101,13 @@
     
     const fileInput = addForm.querySelector('[name="image"]');
     if (fileInput && fileInput.files && fileInput.files.length > 0) {
-      fd.append('image', fileInput.files[0]);
+      for (const file of fileInput.files) fd.append('image', file);
     } else if (capturedBlob) {
       const filename = (name || 'student') + '.jpg';
       fd.append('image', new File([capturedBlob], filename, { type: 'image/jpeg' }));
     }
+    const appendInput = addForm.querySelector('[name="append"]');
+    if (appendInput && appendInput.checked) fd.append('mode', 'append');
     // Allow submission without image (placeholder will be used)
 
     try {
@@ -223,6 +225,135 @@
     capture.addEventListener('click', onCaptureClicked);
   }
 
+  // Attendance records: loaded a page at a time from /api/admin/attendance
+  const attendanceFilters = el('attendanceFilters');
+  const attendanceBody = el('attendanceBody');
+  const attendanceMore = el('attendanceMore');
+  let attendanceCursor = null;
+
+  function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+  }
+
+  function attendanceQuery() {
+    const params = new URLSearchParams();
+    new FormData(attendanceFilters).forEach((value, key) => {
+      if (value) params.set(key, value);
+    });
+    return params;
+  }
+
+  function attendanceMessage(message) {
+    attendanceBody.innerHTML = `
+      <tr>
+        <td colspan="4" class="text-center text-white-60 py-4">
+          <i class="fas fa-clipboard-list fa-2x mb-3 d-block"></i>
+          ${escapeHtml(message)}
+        </td>
+      </tr>`;
+  }
+
+  async function loadAttendance(reset) {
+    const params = attendanceQuery();
+    el('exportCsv').href = '/admin/export.csv?' + params.toString();
+    if (reset) attendanceCursor = null;
+    if (attendanceCursor) params.set('cursor', attendanceCursor);
+    attendanceMore.disabled = true;
+    try {
+      const resp = await fetch('/api/admin/attendance?' + params.toString());
+      const j = await resp.json();
+      if (j.error) {
+        attendanceMessage('Error: ' + j.error);
+        return;
+      }
+      if (reset) attendanceBody.innerHTML = '';
+      if (reset && !j.rows.length) {
+        attendanceMessage('No attendance records yet');
+      }
+      j.rows.forEach(r => {
+        const tr = document.createElement('tr');
+        tr.innerHTML = `
+          <td class="align-middle">
+            <strong class="student-name-dark">${escapeHtml(r.name)}</strong>
+          </td>
+          <td class="align-middle text-white-80">${escapeHtml(r.date)}</td>
+          <td class="align-middle text-white-80">${escapeHtml(r.time)}</td>
+          <td class="align-middle">
+            <span class="badge bg-success bg-opacity-75">
+              <i class="fas fa-check me-1"></i>Present
+            </span>
+          </td>`;
+        attendanceBody.appendChild(tr);
+      });
+      attendanceCursor = j.next_cursor;
+      attendanceMore.classList.toggle('d-none', !attendanceCursor);
+    } catch (e) {
+      attendanceMessage('Request failed: ' + e.message);
+    } finally {
+      attendanceMore.disabled = false;
+    }
+  }
+
+  // Bulk import: upload a zip, then poll the job until it finishes
+  const bulkForm = el('bulkForm');
+
+  function showJob(job) {
+    el('bulkStatus').classList.remove('d-none');
+    el('bulkProgress').style.width = Math.round(job.progress * 100) + '%';
+    let text = `${job.status}: ${job.processed}/${job.total} photos`;
+    if (job.images_per_second) text += `, ${job.images_per_second} photos/s`;
+    if (job.failed) text += `, ${job.failed} failed`;
+    if (job.status === 'done') text += ` - ${job.students} student(s) enrolled`;
+    if (job.error) text += ` - ${job.error}`;
+    el('bulkText').textContent = text;
+    el('bulkFailures').innerHTML = job.failures.map(f =>
+      `<li>${escapeHtml(f.student)} / ${escapeHtml(f.file)}: ${escapeHtml(f.error)}</li>`).join('');
+  }
+
+  async function pollJob(url) {
+    try {
+      const resp = await fetch(url);
+      const job = await resp.json();
+      if (job.error && !job.status) {
+        el('bulkText').textContent = job.error;
+        return;
+      }
+      showJob(job);
+      if (job.status === 'done') {
+        setTimeout(() => location.reload(), 3000);
+      } else if (job.status !== 'failed') {
+        setTimeout(() => pollJob(url), 1000);
+      }
+    } catch (e) {
+      el('bulkText').textContent = 'Request failed: ' + e.message;
+    }
+  }
+
+  async function onBulkSubmit(e) {
+    e.preventDefault();
+    const fd = new FormData();
+    const archive = bulkForm.querySelector('[name="archive"]').files[0];
+    if (!archive) return;
+    fd.append('archive', archive);
+    if (bulkForm.querySelector('[name="append"]').checked) fd.append('mode', 'append');
+    el('bulkStatus').classList.remove('d-none');
+    el('bulkText').textContent = 'Uploading...';
+    try {
+      const resp = await fetch('/api/admin/enroll_jobs', { method: 'POST', body: fd });
+      const job = await resp.json();
+      if (resp.status !== 202) {
+        el('bulkText').textContent = job.error || 'Import failed';
+        return;
+      }
+      showJob(job);
+      pollJob(resp.headers.get('Location'));
+    } catch (err) {
+      el('bulkText').textContent = 'Upload failed: ' + err.message;
+    }
+  }
+
   // Cleanup on page unload
   window.addEventListener('beforeunload', () => {
     if (stream) {
@@ -236,4 +367,13 @@
     setupWebcamUI();
   }
   attachRemoveHandlers();
+  if (bulkForm) bulkForm.addEventListener('submit', onBulkSubmit);
+  if (attendanceBody) {
+    attendanceFilters.addEventListener('submit', (ev) => {
+      ev.preventDefault();
+      loadAttendance(true);
+    });
+    attendanceMore.addEventListener('click', () => loadAttendance(false));
+    loadAttendance(true);
+  }
 })();
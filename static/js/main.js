@@ -24,14 +24,14 @@ async function initCamera() {
   }
 }
 
-// Capture image as data URL
-function captureDataUrl() {
+// Capture image as a JPEG blob (sent as the raw request body, no base64)
+function captureBlob() {
   const canvas = document.createElement('canvas');
   canvas.width = video.videoWidth || 640;
   canvas.height = video.videoHeight || 480;
   const ctx = canvas.getContext('2d');
   ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-  return canvas.toDataURL('image/jpeg', 0.9);
+  return new Promise(resolve => canvas.toBlob(blob => resolve(blob), 'image/jpeg', 0.9));
 }
 
 // Show result with enhanced styling
@@ -59,15 +59,14 @@ verifyBtn?.addEventListener('click', async () => {
   
   showResult('Capturing image and verifying...', true);
   
-  const dataUrl = captureDataUrl();
-  
   try {
+    const blob = await captureBlob();
     const resp = await fetch('/api/verify', {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'image/jpeg'
       },
-      body: JSON.stringify({ image: dataUrl })
+      body: blob
     });
     
     const j = await resp.json();
@@ -81,7 +80,11 @@ verifyBtn?.addEventListener('click', async () => {
         result.style.transform = 'scale(1)';
       }, 200);
       
-      showResult(`Success! Welcome ${j.name}! Your attendance has been recorded.`, true);
+      if (j.already_marked) {
+        showResult(`Welcome back ${j.name}! Your attendance was already marked.`, true);
+      } else {
+        showResult(`Success! Welcome ${j.name}! Your attendance has been recorded.`, true);
+      }
       
       // Success sound effect (optional - browser may block)
       try {
@@ -115,6 +118,52 @@ verifyBtn?.addEventListener('click', async () => {
   }
 });
 
+// Live mode: send frames continuously; the server tracks faces across frames and
+// marks each student once
+const liveBtn = document.getElementById('live');
+let liveStream = null;
+
+async function liveLoop(id) {
+  while (liveStream === id) {
+    try {
+      const blob = await captureBlob();
+      const resp = await fetch('/api/stream/frame?stream=' + encodeURIComponent(id), {
+        method: 'POST',
+        headers: { 'Content-Type': 'image/jpeg' },
+        body: blob
+      });
+      const j = await resp.json();
+      if (j.error) {
+        showResult('Error: ' + j.error, false);
+        if (resp.status === 400) stopLive();
+      } else if (j.recorded && j.recorded.length) {
+        showResult(`Welcome ${j.recorded.join(', ')}! Your attendance has been recorded.`, true);
+      }
+    } catch (e) {
+      showResult('Request failed: ' + e.message, false);
+    }
+    await new Promise(resolve => setTimeout(resolve, 100));
+  }
+}
+
+function stopLive() {
+  liveStream = null;
+  liveBtn.innerHTML = '<i class="fas fa-video me-2"></i>Start Live Mode';
+  verifyBtn.disabled = false;
+}
+
+liveBtn?.addEventListener('click', () => {
+  if (liveStream) {
+    stopLive();
+    return;
+  }
+  liveStream = Date.now().toString(36) + Math.random().toString(36).slice(2);
+  liveBtn.innerHTML = '<i class="fas fa-stop me-2"></i>Stop Live Mode';
+  verifyBtn.disabled = true;
+  showResult('Live mode on. Look at the camera.', true);
+  liveLoop(liveStream);
+});
+
 // Add video loaded event for better UX
 video.addEventListener('loadedmetadata', () => {
   console.log('Video loaded:', video.videoWidth, 'x', video.videoHeight);
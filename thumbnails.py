@@ -0,0 +1,85 @@
+"""On-disk thumbnails of enrollment photos.
+
+The dashboard shows students as 50px avatars, so sending the full-resolution
+enrollment photo is wasteful. ``ThumbnailCache`` writes small JPEG copies in a
+few fixed sizes to ``<cache_dir>/<size>/``. It does this when a student is
+enrolled, or lazily on first request for images that predate it. A thumbnail
+is regenerated whenever its source photo is newer.
+"""
+import os
+import tempfile
+
+from face_pipeline import decode_image
+
+
+class ThumbnailCache:
+    def __init__(self, images_dir: str, cache_dir: str, sizes=(64, 128, 256), quality: int = 85):
+        self.images_dir = images_dir
+        self.cache_dir = cache_dir
+        self.sizes = tuple(sizes)
+        self.quality = quality
+
+    def _thumb_path(self, filename, size):
+        # keep the extension in the name so kalpana.png and kalpana.jpg don't collide
+        return os.path.join(self.cache_dir, str(size), filename + '.jpg')
+
+    def get(self, filename: str, size: int):
+        """Path of the ``size`` thumbnail of IMAGES_DIR/``filename`` (relative,
+        already validated by the caller), generating it if missing or stale.
+        Returns None if the source is missing or not a readable image."""
+        source = os.path.join(self.images_dir, filename)
+        try:
+            source_mtime = os.stat(source).st_mtime
+        except OSError:
+            return None
+        thumb = self._thumb_path(filename, size)
+        try:
+            if os.stat(thumb).st_mtime >= source_mtime:
+                return thumb
+        except OSError:
+            pass
+        return self._write(source, filename, (size,)).get(size)
+
+    def generate(self, filename: str):
+        """(Re)generate every size for one enrollment photo; {size: path}."""
+        return self._write(os.path.join(self.images_dir, filename), filename, self.sizes)
+
+    def _write(self, source, filename, sizes):
+        try:
+            with open(source, 'rb') as f:
+                data = f.read()
+            # decode once at the largest size needed; JPEGs are downscaled while decoding
+            image, _ = decode_image(data, max(sizes))
+        except Exception as e:
+            print(f'Cannot make thumbnail of {source}: {e}')
+            return {}
+        written = {}
+        for size in sorted(sizes, reverse=True):
+            image.thumbnail((size, size))
+            path = self._thumb_path(filename, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # a private temp file per writer: concurrent requests for the same
+            # thumbnail each write their own copy and the last rename wins
+            fd, tmp = tempfile.mkstemp(prefix='.thumb-', suffix='.tmp', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, 'JPEG', quality=self.quality, optimize=True)
+                os.replace(tmp, path)
+            except OSError as e:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                if not os.path.exists(path):
+                    print(f'Cannot write thumbnail {path}: {e}')
+                    continue
+                # lost a race with another writer: its thumbnail is just as good
+            written[size] = path
+        return written
+
+    def remove(self, filename: str):
+        for size in self.sizes:
+            try:
+                os.remove(self._thumb_path(filename, size))
+            except OSError:
+                pass
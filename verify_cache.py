@@ -0,0 +1,95 @@
+"""Short-lived cache of /api/verify results for near-duplicate frames.
+
+Kiosks often send the same scene twice within a second or two: a double click,
+or a retry after a timeout. The client captures a new frame each time, so the
+bytes differ even when nothing in front of the camera moved.
+``frame_fingerprint`` reduces a frame to a 16x16 grey thumbnail, each pixel the
+mean of one cell of the frame; for JPEGs only the luma is decoded, downscaled,
+so this takes about a millisecond. ``VerificationCache`` answers a frame with
+the result of a recent one whose thumbnail differs by at most ``max_diff`` grey
+levels in every cell, without detection or encoding.
+
+Cells are compared one by one rather than by an overall distance so that the
+next student at a kiosk with a static background does not match: they change
+only the cells around the face, but those far more than camera noise, exposure
+changes or a small movement do (up to 10 levels for a 2 px shift, over 100 for
+another face).
+
+Entries expire after ``ttl`` seconds, and the least recently used ones are
+evicted beyond ``size``. Results depend on the gallery, so each entry keeps the
+gallery snapshot it was computed against and only answers lookups made with
+that same snapshot (every enrollment or removal publishes a new one).
+"""
+import io
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image as PILImage
+
+# fingerprint grid: FINGERPRINT_SIZE x FINGERPRINT_SIZE cells
+FINGERPRINT_SIZE = 16
+
+
+def frame_fingerprint(file_bytes, size: int = FINGERPRINT_SIZE):
+    """``size`` x ``size`` int16 array of the mean grey level of each cell of
+    an image. Raises for undecodable images."""
+    pil = PILImage.open(io.BytesIO(file_bytes))
+    if pil.format == 'JPEG':
+        # luma only, downscaled inside the DCT (1/4 or 1/8 for webcam frames)
+        pil.draft('L', (size * 4, size * 4))
+    return np.asarray(pil.convert('L').resize((size, size), PILImage.BOX), dtype=np.int16)
+
+
+class VerificationCache:
+    """LRU of (snapshot, variant, fingerprint) -> result, bounded to ``size``
+    entries that each live ``ttl`` seconds. ``variant`` separates requests whose
+    results differ for the same frame (e.g. top_k). ``size`` 0 disables the
+    cache."""
+
+    def __init__(self, size: int = 256, ttl: float = 5.0, max_diff: int = 12):
+        self.size = size
+        self.ttl = ttl
+        self.max_diff = max_diff
+        # key -> (expires, snapshot, variant, fingerprint, result)
+        self._entries = OrderedDict()
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint, snapshot, variant=None):
+        """The result of a recent near-duplicate of this frame, computed against
+        gallery ``snapshot``, or None."""
+        if not self.size:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            expired = []
+            found = None
+            for key, (expires, snap, var, cached, result) in reversed(self._entries.items()):
+                if expires <= now:
+                    expired.append(key)
+                elif (snap is snapshot and var == variant
+                      and np.abs(cached - fingerprint).max() <= self.max_diff):
+                    found = key, result
+                    break
+            for key in expired:
+                del self._entries[key]
+            if found is None:
+                return None
+            self._entries.move_to_end(found[0])
+            return found[1]
+
+    def put(self, fingerprint, snapshot, result, variant=None):
+        """Remember ``result``, computed against gallery ``snapshot``. Entries of
+        other snapshots are left alone; they age out."""
+        if not self.size:
+            return
+        with self._lock:
+            self._entries[next(self._keys)] = (time.monotonic() + self.ttl, snapshot, variant, fingerprint, result)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)